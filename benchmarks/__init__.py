@@ -0,0 +1,4 @@
+"""
+Offline benchmarks for python-bluefin. These run against a local fake
+gateway (bluefin.testing.gateway), so no credentials are needed.
+"""
@@ -0,0 +1,188 @@
+"""
+Measures client throughput and latency against a local fake gateway.
+
+    python -m benchmarks.bench_clients
+    python -m benchmarks.bench_clients --requests 5000 --latency 0.005
+    python -m benchmarks.bench_clients --json before.json
+    python -m benchmarks.bench_clients --compare before.json
+
+With ``--compare``, exits with status 1 if any workload's throughput drops,
+or its p99 latency rises, by more than ``--tolerance``.
+"""
+import argparse
+import sys
+import threading
+
+from bluefin.dataretrieval.clients import V1Client
+from bluefin.directmode.clients import V3Client
+from bluefin.testing.gateway import FakeGateway
+from benchmarks.utils import clock, compare_results, print_results, save_results, summarize
+
+CHARGE = {
+    'pay_type': 'C',
+    'tran_type': 'A',
+    'account_id': 123456789012,
+    'amount': 1.0,
+    'card_number': 4444333322221111,
+    'card_expire': '1212',
+    'dynip_sec_code': 'BENCHMARK',
+}
+
+
+def timed_call(func, latencies):
+    started = clock()
+    try:
+        func()
+    except Exception:
+        # Injected errors are part of the workload.
+        pass
+    latencies.append(clock() - started)
+
+
+def bench_single(gateway, options):
+    """
+    One request at a time, from one thread.
+    """
+    api = V3Client(host=gateway.url)
+    latencies = []
+    started = clock()
+    for i in range(options.requests):
+        timed_call(lambda: api.send_request(CHARGE), latencies)
+    return summarize('direct_single', latencies, clock() - started)
+
+
+def bench_threaded(gateway, options):
+    """
+    One client shared by a bunch of threads, as in a threaded web worker.
+    """
+    api = V3Client(host=gateway.url)
+    latencies = []
+    per_thread = options.requests // options.concurrency
+
+    def worker():
+        for i in range(per_thread):
+            timed_call(lambda: api.send_request(CHARGE), latencies)
+
+    threads = [threading.Thread(target=worker)
+               for i in range(options.concurrency)]
+    started = clock()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize('direct_threaded', latencies, clock() - started)
+
+
+def bench_batched(gateway, options):
+    """
+    V3Client.send_batch().
+    """
+    api = V3Client(host=gateway.url)
+    latencies = []
+    started = clock()
+    last = started
+    # Latency per item isn't visible from the outside, so this measures the
+    # time between results instead.
+    for result in api.send_batch((CHARGE for i in range(options.requests)),
+                                 concurrency=options.concurrency,
+                                 ordered=False):
+        now = clock()
+        latencies.append(now - last)
+        last = now
+    return summarize('direct_batched', latencies, clock() - started)
+
+
+def bench_report(gateway, options):
+    """
+    Fetching and parsing a large report, all at once.
+    """
+    api = V1Client(host=gateway.url)
+    latencies = []
+    started = clock()
+    for i in range(options.reports):
+        timed_call(lambda: api.send_request({'site_tag': 'MAIN'}), latencies)
+    return summarize('report_send_request', latencies, clock() - started)
+
+
+def bench_report_streaming(gateway, options):
+    """
+    Fetching and parsing a large report, streamed.
+    """
+    api = V1Client(host=gateway.url)
+    latencies = []
+    started = clock()
+    for i in range(options.reports):
+        timed_call(lambda: list(api.iter_records({'site_tag': 'MAIN'})),
+                   latencies)
+    return summarize('report_iter_records', latencies, clock() - started)
+
+
+WORKLOADS = {
+    'single': bench_single,
+    'threaded': bench_threaded,
+    'batched': bench_batched,
+    'report': bench_report,
+    'report_streaming': bench_report_streaming,
+}
+DEFAULT_WORKLOADS = ['single', 'threaded', 'batched', 'report',
+                     'report_streaming']
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('workloads', nargs='*', metavar='workload',
+                        help='Workloads to run: %s. Defaults to all of them.'
+                             % ', '.join(DEFAULT_WORKLOADS))
+    parser.add_argument('--requests', type=int, default=1000,
+                        help='Direct Mode requests per workload.')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='Threads for the threaded and batched workloads.')
+    parser.add_argument('--reports', type=int, default=20,
+                        help='Reports to fetch per report workload.')
+    parser.add_argument('--report-size', type=int, default=10000,
+                        help='Transactions per report.')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Simulated gateway latency, in seconds.')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='Fraction of requests to fail with a 408.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', metavar='PATH',
+                        help='Save the results to this file.')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='Compare the results to a saved run.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Regression threshold for --compare, as a fraction.')
+    options = parser.parse_args(argv)
+    options.workloads = options.workloads or DEFAULT_WORKLOADS
+    for name in options.workloads:
+        if name not in WORKLOADS:
+            parser.error('Unknown workload: %s' % name)
+    return options
+
+
+def main(argv=None):
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+    error_rates = {408: options.error_rate} if options.error_rate else None
+
+    results = []
+    with FakeGateway(latency=options.latency, error_rates=error_rates,
+                     report_size=options.report_size,
+                     seed=options.seed) as gateway:
+        for name in options.workloads:
+            results.append(WORKLOADS[name](gateway, options))
+
+    print_results(results)
+    if options.json:
+        save_results(results, options.json)
+    if options.compare:
+        regressions = compare_results(results, options.compare,
+                                      options.tolerance)
+        for regression in regressions:
+            print('REGRESSION: %s' % regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
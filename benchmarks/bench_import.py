@@ -0,0 +1,101 @@
+"""
+Import-time benchmarks for the client modules.
+
+    python -m benchmarks.bench_import
+    python -m benchmarks.bench_import --iterations 50 --json imports.json
+
+Each import is timed in a fresh interpreter, since a module is only ever
+imported once per process. Short-lived scripts and serverless handlers pay
+this on every cold start, so the clients leave the HTTP stack (requests) and
+optional extras to be imported on first use. The modules that did get
+imported along the way are listed, to catch a stray top-level import.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+from benchmarks.utils import compare_results, print_results, save_results, summarize
+
+MODULES = [
+    'bluefin.directmode.clients',
+    'bluefin.dataretrieval.clients',
+    # For reference: what the clients import on first use.
+    'bluefin.transport',
+]
+
+# Modules the clients shouldn't import until they're needed.
+HEAVY_MODULES = ['requests', 'urllib3', 'multiprocessing', 'numpy',
+                 'sqlite3', 'aiohttp']
+
+# Run in a fresh interpreter. Prints the import time, and which of the heavy
+# modules came along.
+SCRIPT = """
+import json, sys, time
+clock = getattr(time, 'perf_counter', time.time)
+started = clock()
+import %(module)s
+elapsed = clock() - started
+print(json.dumps([elapsed, [m for m in %(heavy)r if m in sys.modules]]))
+"""
+
+
+def time_import(module):
+    """
+    :rtype: tuple
+    :returns: Seconds the import took, and the heavy modules it pulled in.
+    """
+    output = subprocess.check_output([
+        sys.executable, '-c', SCRIPT % {'module': module, 'heavy': HEAVY_MODULES}])
+    elapsed, heavy = json.loads(output.decode('utf-8'))
+    return elapsed, heavy
+
+
+def run(module, iterations):
+    latencies = []
+    heavy = set()
+    for i in range(iterations):
+        elapsed, imported = time_import(module)
+        latencies.append(elapsed)
+        heavy.update(imported)
+    result = summarize(module[len('bluefin.'):], latencies, sum(latencies))
+    result['heavy_modules'] = sorted(heavy)
+    return result
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--iterations', type=int, default=20,
+                        help='Fresh interpreters to time each import in.')
+    parser.add_argument('--json', metavar='PATH',
+                        help='Save the results to this file.')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='Compare the results to a saved run.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Regression threshold for --compare, as a fraction.')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+    results = [run(module, options.iterations) for module in MODULES]
+
+    print_results(results)
+    for result in results:
+        if result['heavy_modules']:
+            print('%s imports: %s' % (result['name'],
+                                      ', '.join(result['heavy_modules'])))
+    if options.json:
+        save_results(results, options.json)
+    if options.compare:
+        regressions = compare_results(results, options.compare,
+                                      options.tolerance)
+        for regression in regressions:
+            print('REGRESSION: %s' % regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+Micro-benchmarks for the response parsers.
+
+    python -m benchmarks.bench_parsing
+    python -m benchmarks.bench_parsing --iterations 50000 --json parsing.json
+
+Compares bluefin.parsing.parse_response() to the old parse_qs-and-join
+approach, on a typical Direct Mode response and on a large report. Also
+times decline classification (bluefin.directmode.declines).
+"""
+import argparse
+import datetime
+import sys
+
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+from bluefin.directmode.declines import classify
+from bluefin.parsing import iter_fields, iter_records, parse_response
+from bluefin.testing.gateway import generate_report
+from benchmarks.utils import clock, compare_results, print_results, save_results, summarize
+
+DIRECT_RESPONSE = (
+    b'avs_code=X&auth_msg=TEST+APPROVED&status_code=1'
+    b'&ticket_code=XXXXXXXXXXXXXXX&auth_date=2011-01-01+12%3A00%3A00'
+    b'&settle_currency=USD&auth_code=999999&settle_amount=1.00'
+    b'&cvv2_code=M&processor=TEST&trans_id=123456789012'
+)
+
+DECLINE_MESSAGE = 'AUTH DECLINED 05 DO NOT HONOR'
+
+
+def parse_qs_join(body):
+    """
+    How the clients used to parse responses.
+    """
+    result_dict = parse_qs(body.decode('utf-8'))
+    for key, value in result_dict.items():
+        result_dict[key] = ','.join(value)
+    return result_dict
+
+
+def parse_records(body):
+    return list(iter_records(iter_fields([body])))
+
+
+def run(name, func, body, iterations):
+    latencies = []
+    started = clock()
+    for i in range(iterations):
+        call_started = clock()
+        func(body)
+        latencies.append(clock() - call_started)
+    return summarize(name, latencies, clock() - started)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--iterations', type=int, default=20000,
+                        help='Direct Mode responses to parse per parser.')
+    parser.add_argument('--report-iterations', type=int, default=20,
+                        help='Reports to parse per parser.')
+    parser.add_argument('--report-size', type=int, default=10000,
+                        help='Transactions per report.')
+    parser.add_argument('--json', metavar='PATH',
+                        help='Save the results to this file.')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='Compare the results to a saved run.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Regression threshold for --compare, as a fraction.')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+    today = datetime.date.today()
+    report = generate_report((today, n) for n in range(options.report_size))
+
+    results = [
+        run('direct_parse_qs_join', parse_qs_join, DIRECT_RESPONSE,
+            options.iterations),
+        run('direct_parse_response', parse_response, DIRECT_RESPONSE,
+            options.iterations),
+        run('report_parse_qs_join', parse_qs_join, report,
+            options.report_iterations),
+        run('report_parse_response', parse_response, report,
+            options.report_iterations),
+        run('report_iter_records', parse_records, report,
+            options.report_iterations),
+        run('decline_classify', classify, DECLINE_MESSAGE, options.iterations),
+    ]
+
+    print_results(results)
+    if options.json:
+        save_results(results, options.json)
+    if options.compare:
+        regressions = compare_results(results, options.compare,
+                                      options.tolerance)
+        for regression in regressions:
+            print('REGRESSION: %s' % regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,504 @@
+"""
+Load and soak tests for the clients, against a local fake gateway.
+
+    python -m benchmarks.loadtest
+    python -m benchmarks.loadtest --concurrency 1,4,16,64 --step-duration 30
+    python -m benchmarks.loadtest --latency 0.02 --latency-max 0.2 \\
+        --error 408=0.01 --error 500=0.002 --decline-rate 0.05
+    python -m benchmarks.loadtest --soak 3600 --json soak.json
+    python -m benchmarks.loadtest --compare soak.json
+
+Ramps the number of threads sending requests through one shared V3Client
+(and, with ``--report-ratio``, one V1Client) up step by step, to find
+where throughput stops growing. Each step reports throughput, a latency
+histogram and the outcomes. A sampler keeps track of memory, open file
+descriptors and threads the whole time, and ``--soak`` adds a long run at
+the end, to catch slow leaks.
+
+The gateway runs in a child process, so that its sockets, memory and GIL
+don't muddle the client's numbers. Each step also reports how much CPU the
+client process used, as a share of one core (``cpu``), and how much of the
+client's time went into parsing (``parse_share``). When throughput stops
+growing while ``cpu`` is near 1.0, the client is CPU-bound, which with
+threads usually means the GIL. When ``cpu`` is low, look at the latencies
+and at ``fds`` instead: the bottleneck is likely the gateway, the sockets,
+or the connection pool (see ``--pool-maxsize``).
+
+With ``--compare``, exits with status 1 if any step's throughput drops, or
+its p99 latency rises, by more than ``--tolerance``.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from bluefin.dataretrieval.clients import V1Client
+from bluefin.directmode.clients import V3Client
+from bluefin.directmode.exceptions import V3ClientDeclinedException
+from bluefin.testing.gateway import FakeGateway
+from bluefin.transport import HTTPTransport
+from benchmarks.bench_clients import CHARGE
+from benchmarks.utils import clock, compare_results, percentile, print_results, summarize
+
+# Upper bounds of the latency histogram buckets, in milliseconds. The last
+# bucket (null in the JSON) catches everything slower.
+HISTOGRAM_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+                    10000)
+
+REPORT_VALUES = {'site_tag': 'MAIN'}
+
+
+def rss_bytes():
+    """
+    :rtype: int or None
+    :returns: The process's resident memory, or None if there's no telling.
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # The peak, rather than the current size. Bytes on macOS, kilobytes
+    # elsewhere.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def open_fds():
+    """
+    :rtype: int or None
+    :returns: The number of open file descriptors, or None if there's no
+        telling.
+    """
+    for path in ('/proc/self/fd', '/dev/fd'):
+        try:
+            # Less the one listdir() itself opens.
+            return len(os.listdir(path)) - 1
+        except OSError:
+            continue
+    return None
+
+
+def cpu_seconds():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def histogram(latencies):
+    """
+    :param list latencies: Sorted latencies, in seconds.
+    :rtype: list
+    :returns: ``{'le': ms, 'count': n}`` dicts, one per bucket.
+    """
+    buckets = []
+    index = 0
+    for bound in HISTOGRAM_BOUNDS + (None,):
+        count = 0
+        while index < len(latencies) and (
+                bound is None or latencies[index] * 1000 <= bound):
+            count += 1
+            index += 1
+        buckets.append({'le': bound, 'count': count})
+    return buckets
+
+
+class Sampler(object):
+    """
+    Samples the process's memory, file descriptors and threads every
+    ``interval`` seconds, from a background thread.
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = []
+        # What's running, for labelling the samples.
+        self.step = None
+        self._started = clock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+
+    def sample(self):
+        sample = {
+            'time': clock() - self._started,
+            'step': self.step,
+            'rss': rss_bytes(),
+            'fds': open_fds(),
+            'threads': threading.active_count(),
+        }
+        self.samples.append(sample)
+        return sample
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        self.sample()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.step = None
+        self.sample()
+
+
+class Step(object):
+    """
+    The latencies and outcomes of one kind of call during a step.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.outcomes = {}
+
+    def record(self, elapsed, outcome):
+        with self.lock:
+            self.latencies.append(elapsed)
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+
+class ParseTimer(object):
+    """
+    A request listener that adds up the time spent on whole calls, and on
+    parsing.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.total = 0.0
+        self.parse = 0.0
+
+    def __call__(self, event):
+        if event.kind != 'request':
+            return
+        with self.lock:
+            self.total += event.timings.get('total', 0)
+            self.parse += event.timings.get('parse', 0)
+
+
+def call(func, step):
+    started = clock()
+    try:
+        func()
+    except V3ClientDeclinedException:
+        outcome = 'declined'
+    except Exception as exc:
+        # Injected errors are part of the workload.
+        outcome = exc.__class__.__name__
+    else:
+        outcome = 'ok'
+    step.record(clock() - started, outcome)
+
+
+def run_step(name, concurrency, duration, clients, options, sampler,
+             parse_timer):
+    """
+    Runs ``concurrency`` threads sending requests for ``duration`` seconds.
+
+    :rtype: list
+    :returns: A result dict per kind of call made.
+    """
+    v3, v1 = clients
+    direct, report = Step(), Step()
+    stop = threading.Event()
+    # Spread the report calls evenly, rather than at random, so runs are
+    # repeatable.
+    report_every = int(round(1 / options.report_ratio)) \
+        if options.report_ratio else None
+
+    def worker():
+        n = 0
+        while not stop.is_set():
+            n += 1
+            if report_every and n % report_every == 0:
+                call(lambda: v1.send_request(REPORT_VALUES), report)
+            else:
+                call(lambda: v3.send_request(CHARGE), direct)
+
+    sampler.step = name
+    before = sampler.sample()
+    parse_timer.reset()
+    threads = [threading.Thread(target=worker) for i in range(concurrency)]
+    cpu_started = cpu_seconds()
+    started = clock()
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = clock() - started
+    cpu = cpu_seconds() - cpu_started
+    after = sampler.sample()
+
+    step_samples = [sample for sample in sampler.samples
+                    if sample['step'] == name]
+    resources = {
+        'concurrency': concurrency,
+        'cpu': cpu / elapsed if elapsed else None,
+        'parse_share': parse_timer.parse / parse_timer.total
+        if parse_timer.total else None,
+        'rss_start': before['rss'],
+        'rss_end': after['rss'],
+        'fds_max': _max(sample['fds'] for sample in step_samples),
+        'threads_max': _max(sample['threads'] for sample in step_samples),
+    }
+
+    results = []
+    for kind, step in (('direct', direct), ('report', report)):
+        if not step.latencies:
+            continue
+        result = summarize('%s_%s' % (kind, name), step.latencies, elapsed)
+        latencies = sorted(step.latencies)
+        errors = sum(count for outcome, count in step.outcomes.items()
+                     if outcome not in ('ok', 'declined'))
+        result.update(resources)
+        result.update({
+            'p90': percentile(latencies, 90),
+            'max': latencies[-1],
+            'histogram': histogram(latencies),
+            'outcomes': step.outcomes,
+            'error_rate': float(errors) / len(latencies),
+        })
+        results.append(result)
+    return results
+
+
+def _max(values):
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def analyze(results, samples, soak_name):
+    """
+    Boils the run down to where throughput peaked, where it stopped
+    growing, and how memory and file descriptors grew during the soak.
+
+    :rtype: dict
+    """
+    direct = [result for result in results
+              if result['name'].startswith('direct_c')]
+    summary = {}
+    if direct:
+        peak = max(direct, key=lambda result: result['throughput'])
+        summary['peak'] = {'concurrency': peak['concurrency'],
+                           'throughput': peak['throughput'],
+                           'cpu': peak['cpu']}
+        # The first step that added concurrency for less than 10% more
+        # throughput.
+        for previous, result in zip(direct, direct[1:]):
+            if result['throughput'] < previous['throughput'] * 1.1:
+                summary['saturation_concurrency'] = previous['concurrency']
+                break
+
+    soak = [sample for sample in samples if sample['step'] == soak_name]
+    if len(soak) >= 2 and soak[0]['rss'] is not None:
+        first, last = soak[0], soak[-1]
+        minutes = (last['time'] - first['time']) / 60.0
+        summary['soak'] = {
+            'duration': last['time'] - first['time'],
+            'rss_growth': last['rss'] - first['rss'],
+            'rss_growth_per_minute': (last['rss'] - first['rss']) / minutes
+            if minutes else None,
+            'fds_start': first['fds'],
+            'fds_end': last['fds'],
+            'threads_start': first['threads'],
+            'threads_end': last['threads'],
+        }
+    return summary
+
+
+def start_gateway(options):
+    """
+    Starts the fake gateway in a child process.
+
+    :rtype: tuple
+    :returns: The process, and the gateway's URL.
+    """
+    args = [sys.executable, '-m', 'benchmarks.loadtest', '--serve',
+            '--latency', str(options.latency),
+            '--decline-rate', str(options.decline_rate),
+            '--report-size', str(options.report_size),
+            '--seed', str(options.seed)]
+    if options.latency_max is not None:
+        args += ['--latency-max', str(options.latency_max)]
+    for error in options.error or ():
+        args += ['--error', error]
+    process = subprocess.Popen(args, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE)
+    url = process.stdout.readline().decode('utf-8').strip()
+    if not url:
+        raise RuntimeError("The gateway didn't start.")
+    return process, url
+
+
+def make_gateway(options):
+    latency = options.latency
+    if options.latency_max is not None:
+        latency = (options.latency, options.latency_max)
+    error_rates = {}
+    for error in options.error or ():
+        status, rate = error.split('=')
+        error_rates[int(status)] = float(rate)
+    return FakeGateway(latency=latency, error_rates=error_rates,
+                       decline_rate=options.decline_rate,
+                       report_size=options.report_size, seed=options.seed)
+
+
+def serve(options):
+    """
+    Runs the gateway until stdin is closed. Used by start_gateway().
+    """
+    with make_gateway(options) as gateway:
+        sys.stdout.write(gateway.url + '\n')
+        sys.stdout.flush()
+        sys.stdin.read()
+    return 0
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--concurrency', default='1,2,4,8,16,32,64',
+                        help='Comma-separated thread counts to ramp through.')
+    parser.add_argument('--step-duration', type=float, default=5,
+                        help='Seconds to run each step for.')
+    parser.add_argument('--soak', type=float, default=0,
+                        help='Seconds to run at --soak-concurrency after the '
+                             'ramp.')
+    parser.add_argument('--soak-concurrency', type=int,
+                        help='Threads for the soak. Defaults to the highest '
+                             'in --concurrency.')
+    parser.add_argument('--stop-error-rate', type=float,
+                        help='End the ramp once a step fails this fraction of '
+                             'its calls.')
+    parser.add_argument('--report-ratio', type=float, default=0,
+                        help='Fraction of calls that fetch a report through '
+                             'V1Client, instead of charging through V3Client.')
+    parser.add_argument('--report-size', type=int, default=100,
+                        help='Transactions per report.')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Simulated gateway latency, in seconds.')
+    parser.add_argument('--latency-max', type=float,
+                        help='If given, latencies are picked at random between '
+                             '--latency and this.')
+    parser.add_argument('--error', action='append', metavar='STATUS=RATE',
+                        help='Fail this fraction of requests with this HTTP '
+                             'status. May be repeated.')
+    parser.add_argument('--decline-rate', type=float, default=0,
+                        help='Fraction of charges to decline.')
+    parser.add_argument('--pool-maxsize', type=int,
+                        help='Connections to keep per client. Defaults to the '
+                             'highest concurrency.')
+    parser.add_argument('--sample-interval', type=float, default=1,
+                        help='Seconds between memory and file descriptor '
+                             'samples.')
+    parser.add_argument('--in-process', action='store_true',
+                        help="Run the gateway in this process. Quicker to "
+                             "start, but it skews the numbers.")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', metavar='PATH',
+                        help='Save the results, samples and summary to this '
+                             'file.')
+    parser.add_argument('--compare', metavar='PATH',
+                        help='Compare the results to a saved run.')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Regression threshold for --compare, as a fraction.')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    options = parser.parse_args(argv)
+    try:
+        options.concurrency = [int(n) for n in options.concurrency.split(',')]
+        for error in options.error or ():
+            status, rate = error.split('=')
+            int(status), float(rate)
+    except ValueError:
+        parser.error('Bad --concurrency or --error.')
+    if options.soak_concurrency is None:
+        options.soak_concurrency = max(options.concurrency)
+    if options.pool_maxsize is None:
+        options.pool_maxsize = max(options.concurrency +
+                                   [options.soak_concurrency])
+    return options
+
+
+def main(argv=None):
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+    if options.serve:
+        return serve(options)
+
+    if options.in_process:
+        gateway = make_gateway(options).start()
+        url = gateway.url
+    else:
+        process, url = start_gateway(options)
+
+    parse_timer = ParseTimer()
+    clients = (
+        V3Client(host=url, listeners=[parse_timer],
+                 transport=HTTPTransport(pool_maxsize=options.pool_maxsize)),
+        V1Client(host=url, listeners=[parse_timer],
+                 transport=HTTPTransport(pool_maxsize=options.pool_maxsize)),
+    )
+    sampler = Sampler(options.sample_interval).start()
+    results = []
+    soak_name = None
+    try:
+        for concurrency in options.concurrency:
+            step_results = run_step(
+                'c%d' % concurrency, concurrency, options.step_duration,
+                clients, options, sampler, parse_timer)
+            results.extend(step_results)
+            if options.stop_error_rate is not None and any(
+                    result['error_rate'] >= options.stop_error_rate
+                    for result in step_results):
+                break
+        if options.soak:
+            soak_name = 'soak_c%d' % options.soak_concurrency
+            results.extend(run_step(
+                soak_name, options.soak_concurrency, options.soak, clients,
+                options, sampler, parse_timer))
+    finally:
+        sampler.stop()
+        if options.in_process:
+            gateway.stop()
+        else:
+            process.stdin.close()
+            process.wait()
+
+    summary = analyze(results, sampler.samples, soak_name)
+    print_results(results)
+    for result in results:
+        print('%s: %s' % (result['name'], ', '.join(
+            '%s=%d' % item for item in sorted(result['outcomes'].items()))))
+    print(json.dumps(summary, indent=2, sort_keys=True))
+
+    if options.json:
+        config = dict(vars(options))
+        config.pop('serve')
+        with open(options.json, 'w') as f:
+            json.dump({'config': config, 'results': results,
+                       'samples': sampler.samples, 'summary': summary},
+                      f, indent=2, sort_keys=True)
+    if options.compare:
+        regressions = compare_results(results, options.compare,
+                                      options.tolerance)
+        for regression in regressions:
+            print('REGRESSION: %s' % regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""
+Shared bits for the benchmark scripts.
+"""
+import json
+
+from bluefin.compat import perf_counter as clock
+
+
+def percentile(samples, percent):
+    """
+    :param list samples: Sorted samples.
+    :param float percent: Between 0 and 100.
+    """
+    if not samples:
+        return None
+    return samples[int(round((len(samples) - 1) * percent / 100.0))]
+
+
+def summarize(name, latencies, elapsed, ops=None):
+    """
+    Boils a workload's per-operation latencies down to the numbers we track.
+
+    :param str name: The workload's name.
+    :param list latencies: Seconds per operation.
+    :param float elapsed: Wall clock seconds for the whole workload.
+    :keyword int ops: Number of operations, if not len(latencies).
+    :rtype: dict
+    """
+    latencies = sorted(latencies)
+    ops = len(latencies) if ops is None else ops
+    return {
+        'name': name,
+        'ops': ops,
+        'elapsed': elapsed,
+        'throughput': ops / elapsed if elapsed else None,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+    }
+
+
+def print_results(results):
+    print('%-24s %8s %12s %10s %10s' % ('workload', 'ops', 'ops/sec',
+                                        'p50 (ms)', 'p99 (ms)'))
+    for result in results:
+        print('%-24s %8d %12.1f %10s %10s' % (
+            result['name'], result['ops'], result['throughput'] or 0,
+            _ms(result['p50']), _ms(result['p99'])))
+
+
+def _ms(seconds):
+    if seconds is None:
+        return '-'
+    return '%.3f' % (seconds * 1000)
+
+
+def save_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def compare_results(results, baseline_path, tolerance):
+    """
+    Compares results to a saved baseline.
+
+    :returns: A list of human-readable regressions. Empty if there are none.
+    """
+    with open(baseline_path) as f:
+        saved = json.load(f)
+    if isinstance(saved, dict):
+        # A load test run, with its samples and summary.
+        saved = saved['results']
+    baseline = dict((r['name'], r) for r in saved)
+
+    regressions = []
+    for result in results:
+        old = baseline.get(result['name'])
+        if old is None:
+            continue
+        if old['throughput'] and result['throughput'] < old['throughput'] * (1 - tolerance):
+            regressions.append('%s: throughput %.1f -> %.1f ops/sec' % (
+                result['name'], old['throughput'], result['throughput']))
+        if old['p99'] and result['p99'] > old['p99'] * (1 + tolerance):
+            regressions.append('%s: p99 %s -> %s ms' % (
+                result['name'], _ms(old['p99']), _ms(result['p99'])))
+    return regressions
@@ -0,0 +1,85 @@
+"""
+Non-blocking HTTP transport for the asyncio clients. Requires Python 3.5+
+and aiohttp (``pip install bluefin[async]``).
+"""
+import aiohttp
+
+
+class BufferedResponse(object):
+    """
+    A fully-read HTTP response. Quacks enough like a
+    :py:class:`requests.Response` for the clients' error checking and
+    parsing to work with either transport.
+    """
+    def __init__(self, status_code, content, encoding=None):
+        self.status_code = status_code
+        self.content = content
+        self.encoding = encoding or 'utf-8'
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, 'replace')
+
+
+class AsyncHTTPTransport(object):
+    """
+    A pooled HTTP transport built on aiohttp. Connections are kept alive and
+    re-used between requests.
+
+    The underlying aiohttp session is created on first use, and is bound to
+    the event loop that was running at the time. Don't share an instance
+    between event loops.
+    """
+    def __init__(self, limit=100, limit_per_host=0, keepalive_timeout=15):
+        """
+        :keyword int limit: Maximum number of simultaneous connections
+            across all hosts. 0 means no limit.
+        :keyword int limit_per_host: Maximum number of simultaneous
+            connections to a single host. 0 means no limit.
+        :keyword float keepalive_timeout: How long, in seconds, to keep idle
+            connections around for re-use.
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self._session = None
+
+    def _get_session(self):
+        """
+        Returns our aiohttp session, creating it if need be.
+
+        :rtype: aiohttp.ClientSession
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def post(self, url, data=None, headers=None, timeout=None):
+        """
+        POSTs to the given URL over a pooled connection, and reads the whole
+        response body.
+
+        :param str url: Full URI to POST to.
+        :keyword data: A dict of form values, or an already-encoded body.
+        :keyword dict headers: Any extra HTTP headers to send.
+        :keyword timeout: Total timeout for the request, in seconds.
+        :rtype: BufferedResponse
+        """
+        session = self._get_session()
+        async with session.post(url, data=data, headers=headers,
+                                timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            content = await response.read()
+            return BufferedResponse(response.status, content, response.charset)
+
+    async def close(self):
+        """
+        Closes all pooled connections.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
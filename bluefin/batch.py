@@ -0,0 +1,130 @@
+"""
+Helpers for running many API calls in parallel over a pool of threads.
+"""
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class BatchResult(object):
+    """
+    The outcome of a single item in a batch. Exactly one of :py:attr:`result`
+    and :py:attr:`exception` is set.
+    """
+    __slots__ = ('index', 'values', 'result', 'exception')
+
+    def __init__(self, index, values, result=None, exception=None):
+        # Position of the item in the input iterable.
+        self.index = index
+        # The item itself, as it was passed in.
+        self.values = values
+        # Whatever the call returned, if it succeeded.
+        self.result = result
+        # The exception raised by the call, if it failed.
+        self.exception = exception
+
+    @property
+    def ok(self):
+        return self.exception is None
+
+    def get(self):
+        """
+        Returns the result, or raises the exception if the call failed.
+        """
+        if self.exception is not None:
+            raise self.exception
+        return self.result
+
+    def __repr__(self):
+        if self.ok:
+            return '<BatchResult %d: ok>' % self.index
+        return '<BatchResult %d: %s>' % (
+            self.index, self.exception.__class__.__name__)
+
+
+def run_parallel(func, iterable, concurrency=4, ordered=True):
+    """
+    Calls ``func(item)`` for every item in ``iterable``, using up to
+    ``concurrency`` threads. This is a generator, yielding a
+    :py:class:`BatchResult` per item.
+
+    The input is consumed lazily: no more than ``concurrency * 2`` items are
+    ever pending (queued, running, or finished but not yet yielded), so huge
+    or endless iterables are fine. An exception raised by ``func`` is
+    captured in its item's result, and does not stop the batch.
+
+    If the generator is closed early, items that haven't been started yet
+    are dropped. Items already running are allowed to finish.
+
+    :param callable func: Called with each item.
+    :param iterable: The items to process.
+    :keyword int concurrency: Number of worker threads.
+    :keyword bool ordered: If True, results are yielded in input order.
+        If False, they're yielded as they complete, which keeps the
+        workers busier when call times vary.
+    """
+    tasks = queue.Queue()
+    done = queue.Queue()
+
+    def worker():
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            index, item = task
+            try:
+                done.put(BatchResult(index, item, result=func(item)))
+            except Exception as exc:
+                done.put(BatchResult(index, item, exception=exc))
+
+    threads = []
+    for i in range(concurrency):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    window = concurrency * 2
+    items = enumerate(iterable)
+    exhausted = False
+    in_flight = 0
+    # Results that finished ahead of an earlier item, when ordered.
+    finished = {}
+    next_index = 0
+
+    try:
+        while True:
+            while not exhausted and in_flight + len(finished) < window:
+                try:
+                    tasks.put(next(items))
+                except StopIteration:
+                    exhausted = True
+                    break
+                in_flight += 1
+
+            if not in_flight:
+                break
+
+            result = done.get()
+            in_flight -= 1
+
+            if not ordered:
+                yield result
+                continue
+
+            finished[result.index] = result
+            while next_index in finished:
+                yield finished.pop(next_index)
+                next_index += 1
+    finally:
+        # Drop anything that hasn't been started, then stop the workers.
+        while True:
+            try:
+                tasks.get_nowait()
+            except queue.Empty:
+                break
+        for thread in threads:
+            tasks.put(None)
@@ -0,0 +1,131 @@
+"""
+A small in-process cache, used by the idempotency layer and anything else
+that needs to remember things for a while.
+"""
+import collections
+import threading
+
+from bluefin.compat import monotonic as _clock
+
+
+class TTLCache(object):
+    """
+    A thread-safe, size-bounded cache whose entries expire. Once it holds
+    ``max_entries`` entries (or, if ``max_bytes`` is set, entries whose
+    sizes add up to more than that), the least recently used ones are
+    evicted to make room.
+
+    This also serves as the reference implementation of the backend
+    interface (:py:meth:`get`, :py:meth:`set`, :py:meth:`add`,
+    :py:meth:`delete`) that shared caches, such as one built on Redis or
+    memcached, need to provide to stand in for it.
+    """
+    def __init__(self, max_entries=10000, max_bytes=None):
+        """
+        :keyword int max_entries: Most entries to hold at once.
+        :keyword int max_bytes: Most bytes to hold at once, going by the
+            ``size`` given for each entry. None means no limit.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> (expires_at, value, size), least recently used first.
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        # Lifetime total of entries evicted to make room.
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key, now):
+        """
+        Looks up an entry, dropping it if it has expired. Must be called with
+        the lock held.
+
+        :returns: The ``(expires_at, value, size)`` tuple, or None.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] <= now:
+            self._bytes -= entry[2]
+            return None
+        # Re-inserting moves it to the most recently used end.
+        self._entries[key] = entry
+        return entry
+
+    def _set(self, key, value, ttl, now, size):
+        """
+        Must be called with the lock held.
+        """
+        self._pop(key)
+        self._entries[key] = (now + ttl if ttl is not None else None, value,
+                              size)
+        self._bytes += size
+        # An entry bigger than max_bytes on its own goes too.
+        while len(self._entries) > self.max_entries or (
+                self.max_bytes is not None and self._bytes > self.max_bytes):
+            self._bytes -= self._entries.popitem(last=False)[1][2]
+            self.evictions += 1
+
+    def _pop(self, key):
+        """
+        Must be called with the lock held.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def get(self, key, default=None):
+        """
+        :returns: The cached value, or ``default`` if there's none (or it
+            has expired).
+        """
+        with self._lock:
+            entry = self._get(key, _clock())
+        if entry is None:
+            return default
+        return entry[1]
+
+    def set(self, key, value, ttl=None, size=0):
+        """
+        Caches a value, replacing any existing one.
+
+        :keyword float ttl: Seconds until the entry expires. None means never,
+            though it may still be evicted to make room.
+        :keyword int size: The value's size in bytes, for ``max_bytes``.
+        """
+        with self._lock:
+            self._set(key, value, ttl, _clock(), size)
+
+    def add(self, key, value, ttl=None, size=0):
+        """
+        Caches a value, unless there's already one for the key.
+
+        :rtype: bool
+        :returns: True if the value was added.
+        """
+        with self._lock:
+            now = _clock()
+            if self._get(key, now) is not None:
+                return False
+            self._set(key, value, ttl, now, size)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    @property
+    def bytes(self):
+        """
+        The total size of the entries held, including any that have expired
+        but haven't been dropped yet.
+        """
+        return self._bytes
@@ -0,0 +1,237 @@
+"""
+A circuit breaker for the Bluefin gateway. When the gateway is clearly in
+trouble, failing fast beats tying up a worker for the full timeout (times
+the number of retries) on every call.
+"""
+import threading
+
+from bluefin.compat import monotonic as _clock
+
+# Normal operation. Requests go through.
+CLOSED = 'closed'
+# Too many failures in a row. Requests fail fast.
+OPEN = 'open'
+# Cooling down is over. A few probe requests go through to test the waters.
+HALF_OPEN = 'half_open'
+
+
+def default_failure_exceptions():
+    """
+    :rtype: tuple
+    :returns: requests' connection error and timeout exceptions. Imported
+        here, rather than at the top, so that importing the clients doesn't
+        import requests.
+    """
+    from requests.exceptions import ConnectionError, Timeout
+    return (ConnectionError, Timeout)
+
+
+def is_gateway_failure(exc, failure_exceptions, failure_statuses):
+    """
+    :param Exception exc: The exception a request failed with.
+    :param tuple failure_exceptions: Exception classes that count as
+        failures.
+    :param tuple failure_statuses: Inclusive ``(low, high)`` ranges of HTTP
+        status codes that count as failures.
+    :rtype: bool
+    :returns: True if the exception says the gateway is in trouble.
+    """
+    if isinstance(exc, failure_exceptions):
+        return True
+    try:
+        error_code = int(getattr(exc, 'error_code', None))
+    except (TypeError, ValueError):
+        return False
+    for low, high in failure_statuses:
+        if low <= error_code <= high:
+            return True
+    return False
+
+
+class Ticket(object):
+    """
+    Handed out by :py:meth:`CircuitBreaker.allow_request` for an attempt it
+    lets through. Pass it back to :py:meth:`CircuitBreaker.record`.
+    """
+    __slots__ = ('generation', 'probe')
+
+    def __init__(self, generation, probe):
+        # How many times the breaker had opened when the attempt started.
+        self.generation = generation
+        # Whether the attempt is a half-open probe.
+        self.probe = probe
+
+
+class CircuitBreaker(object):
+    """
+    Counts consecutive gateway failures (timeouts, connection errors, and
+    5xx/7xx responses). Once ``failure_threshold`` of them pile up, the
+    breaker opens, and the clients refuse to send anything for ``cooldown``
+    seconds. After that, up to ``half_open_probes`` requests at a time are
+    let through. The first one to succeed closes the breaker again, while a
+    failure re-opens it.
+
+    Input errors and declines aren't failures: they show the gateway is up
+    and answering. Pass the same instance to several clients to have them
+    share their view of the gateway's health. Instances are thread-safe.
+
+        >>> breaker = CircuitBreaker(failure_threshold=5, cooldown=30)
+        >>> api = V3Client(circuit_breaker=breaker)
+        >>> breaker.state
+        'closed'
+    """
+    def __init__(self, failure_threshold=5, cooldown=30, half_open_probes=1,
+                 failure_exceptions=None,
+                 failure_statuses=((500, 599), (700, 799))):
+        """
+        :keyword int failure_threshold: Consecutive failures that open the
+            breaker.
+        :keyword float cooldown: Seconds to stay open before letting probe
+            requests through.
+        :keyword int half_open_probes: Most probe requests in flight at once
+            while half-open.
+        :keyword tuple failure_exceptions: Exception classes that count as
+            failures. Defaults to requests' ConnectionError and Timeout.
+        :keyword tuple failure_statuses: Inclusive ``(low, high)`` ranges of
+            HTTP status codes that count as failures.
+        """
+        # Clients that raise exceptions of their own add them to the
+        # defaults. See add_default_failure_exceptions().
+        self._default_exceptions = failure_exceptions is None
+        if failure_exceptions is None:
+            failure_exceptions = default_failure_exceptions()
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.half_open_probes = half_open_probes
+        self.failure_exceptions = tuple(failure_exceptions)
+        self.failure_statuses = tuple(failure_statuses)
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._probes_in_flight = 0
+        # Goes up every time the breaker opens. Outcomes of attempts from
+        # an earlier generation are ignored.
+        self._generation = 0
+        # Lifetime totals, for health checks and dashboards.
+        self._times_opened = 0
+        self._rejected = 0
+
+    @property
+    def state(self):
+        """
+        One of :py:data:`CLOSED`, :py:data:`OPEN` or :py:data:`HALF_OPEN`.
+        """
+        with self._lock:
+            self._update_state()
+            return self._state
+
+    def _update_state(self):
+        """
+        Moves from open to half-open once the cooldown is over. Must be
+        called with the lock held.
+        """
+        if self._state == OPEN and _clock() - self._opened_at >= self.cooldown:
+            self._state = HALF_OPEN
+            self._probes_in_flight = 0
+
+    def is_failure(self, exc):
+        """
+        :param Exception exc: The exception a request failed with.
+        :rtype: bool
+        :returns: True if the exception says the gateway is in trouble.
+        """
+        return is_gateway_failure(exc, self.failure_exceptions,
+                                  self.failure_statuses)
+
+    def add_default_failure_exceptions(self, exceptions):
+        """
+        Adds to the failure exceptions, unless they were passed in. Called
+        by clients whose transports raise exceptions other than requests',
+        such as the asyncio ones.
+
+        :param tuple exceptions: Exception classes that count as failures.
+        """
+        if self._default_exceptions:
+            self.failure_exceptions += tuple(
+                e for e in exceptions if e not in self.failure_exceptions)
+
+    def allow_request(self):
+        """
+        Called by the clients before each attempt.
+
+        :rtype: Ticket or None
+        :returns: A ticket to pass to :py:meth:`record` if the request may
+            go through, or None if it should fail fast.
+        """
+        with self._lock:
+            self._update_state()
+            if self._state == CLOSED:
+                return Ticket(self._generation, False)
+            if self._state == HALF_OPEN and \
+                    self._probes_in_flight < self.half_open_probes:
+                self._probes_in_flight += 1
+                return Ticket(self._generation, True)
+            self._rejected += 1
+            return None
+
+    def record(self, exc=None, ticket=None):
+        """
+        Called by the clients after each attempt that
+        :py:meth:`allow_request` let through.
+
+        :keyword Exception exc: The exception the attempt failed with, or
+            None if it went through fine.
+        :keyword Ticket ticket: The attempt's ticket. Outcomes of attempts
+            that started before the breaker last opened are ignored, and
+            only probes count while it's half-open. Without a ticket, only
+            outcomes recorded while the breaker is open are ignored.
+        """
+        failed = exc is not None and self.is_failure(exc)
+        with self._lock:
+            if ticket is not None:
+                if ticket.generation != self._generation:
+                    # Started before the breaker opened. Its outcome says
+                    # nothing about the gateway since.
+                    return
+                if ticket.probe:
+                    self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                elif self._state != CLOSED:
+                    return
+            elif self._state == OPEN:
+                return
+            elif self._state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+            if not failed:
+                self._consecutive_failures = 0
+                self._state = CLOSED
+                return
+
+            self._consecutive_failures += 1
+            if self._state == HALF_OPEN or \
+                    self._consecutive_failures >= self.failure_threshold:
+                self._times_opened += 1
+                self._generation += 1
+                self._state = OPEN
+                self._opened_at = _clock()
+
+    def snapshot(self):
+        """
+        Returns the breaker's current state, for health checks.
+
+        :rtype: dict
+        """
+        with self._lock:
+            self._update_state()
+            retry_in = None
+            if self._state == OPEN:
+                retry_in = max(0, self.cooldown - (_clock() - self._opened_at))
+            return {
+                'state': self._state,
+                'consecutive_failures': self._consecutive_failures,
+                'retry_in': retry_in,
+                'times_opened': self._times_opened,
+                'rejected': self._rejected,
+            }
@@ -0,0 +1,115 @@
+"""
+What the Direct Mode and Data Retrieval clients have in common around each
+attempt: waiting for the rate limiter, checking the circuit breaker,
+picking a host, and letting them all know how the attempt went.
+"""
+
+
+class AttemptGuard(object):
+    """
+    A base for the client classes. Subclasses have ``limiter``,
+    ``circuit_breaker``, ``router`` and ``host`` attributes, and set the
+    exception classes below.
+    """
+    # Raised when the circuit breaker is open.
+    circuit_open_exception = None
+    # Raised when there's no permit to be had from the rate limiter in time.
+    rate_limited_exception = None
+
+    def _check_circuit_breaker(self):
+        """
+        Fails fast if the circuit breaker is open.
+
+        :rtype: bluefin.circuitbreaker.Ticket or None
+        :returns: The breaker's ticket for the attempt, if there's a breaker.
+        :raises: :py:attr:`circuit_open_exception`
+        """
+        if self.circuit_breaker is None:
+            return None
+        ticket = self.circuit_breaker.allow_request()
+        if not ticket:
+            raise self.circuit_open_exception(
+                "Too many consecutive gateway failures. Not sending any "
+                "requests until the circuit breaker's cooldown is over.")
+        return ticket
+
+    def _rate_limited(self):
+        """
+        :returns: The exception to raise when the rate limiter had no permit
+            to give in time.
+        """
+        return self.rate_limited_exception(
+            "Timed out waiting for the rate limiter. Too many requests in "
+            "flight, or too many per second.")
+
+    def _admit(self, permit):
+        """
+        Checks the circuit breaker, once there's a permit from the rate
+        limiter (if any). The permit is given back if the breaker is open.
+
+        :param permit: The attempt's :py:class:`bluefin.ratelimit.Permit`,
+            or None.
+        :rtype: tuple
+        :returns: ``permit``, and the circuit breaker's ticket (or None).
+        :raises: :py:attr:`circuit_open_exception`
+        """
+        try:
+            ticket = self._check_circuit_breaker()
+        except self.circuit_open_exception:
+            if permit is not None:
+                self.limiter.cancel(permit)
+            raise
+        return permit, ticket
+
+    def _acquire_permit(self):
+        """
+        Waits for a permit from the rate limiter (if any), then checks the
+        circuit breaker.
+
+        :rtype: tuple
+        :returns: The limiter's :py:class:`bluefin.ratelimit.Permit` and the
+            breaker's :py:class:`bluefin.circuitbreaker.Ticket`, either of
+            which is None if there's no limiter or breaker.
+        :raises: :py:attr:`rate_limited_exception` or
+            :py:attr:`circuit_open_exception`
+        """
+        permit = None
+        if self.limiter is not None:
+            permit = self.limiter.acquire()
+            if permit is None:
+                raise self._rate_limited()
+        return self._admit(permit)
+
+    def _choose_host(self, tried):
+        """
+        Picks the host for the next attempt.
+
+        :param set tried: Hosts that already failed during this call.
+        :rtype: str
+        """
+        if self.router is None:
+            return self.host
+        return self.router.choose(exclude=tried)
+
+    def _record_attempt(self, trace, response=None, exc=None, host=None,
+                        elapsed=None, permit=None, ticket=None):
+        """
+        Lets the circuit breaker, router and rate limiter (if any) and the
+        listeners know how an attempt went.
+
+        :param trace: The call's :py:class:`bluefin.instrumentation.RequestTrace`.
+        :keyword response: The response, if one came in.
+        :keyword Exception exc: The exception the attempt failed with.
+        :keyword str host: The host the attempt went to.
+        :keyword float elapsed: How long the attempt took, in seconds.
+        :keyword permit: The attempt's :py:class:`bluefin.ratelimit.Permit`.
+        :keyword ticket: The attempt's
+            :py:class:`bluefin.circuitbreaker.Ticket`.
+        """
+        if permit is not None:
+            self.limiter.release(permit, exc)
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record(exc, ticket)
+        if self.router is not None:
+            self.router.record(host, elapsed, exc)
+        trace.attempt(response, exc)
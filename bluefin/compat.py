@@ -0,0 +1,13 @@
+"""
+Stand-ins for what Python 2 doesn't have.
+"""
+import os
+import time
+
+# For timeouts, cooldowns and latencies: unaffected by changes to the
+# system clock.
+monotonic = getattr(time, 'monotonic', time.time)
+# For benchmarks: the highest resolution clock there is.
+perf_counter = getattr(time, 'perf_counter', time.time)
+# Atomically replaces the destination, on Windows too.
+replace = getattr(os, 'replace', os.rename)
@@ -0,0 +1,33 @@
+"""
+Transforms for :py:meth:`bluefin.dataretrieval.clients.V1Client.bulk_reports`,
+which run in worker processes.
+
+A transform is called with a report's raw body (bytes), and returns
+whatever should be handed back to the parent process. Transforms have to be
+picklable, so use module-level functions, not lambdas or methods. Everything
+they return is pickled back to the parent, so a transform that boils the
+report down (to totals, or to arrays) saves a lot over returning every
+record.
+"""
+from bluefin.parsing import iter_fields, iter_records
+
+
+def parse_records(body):
+    """
+    :param bytes body: A report's raw body.
+    :rtype: list
+    :returns: A dict per transaction.
+    """
+    return list(iter_records(iter_fields([body])))
+
+
+def parse_columnar(body):
+    """
+    :param bytes body: A report's raw body.
+    :rtype: bluefin.dataretrieval.columnar.ColumnarReport
+    :returns: The report, column-wise. Its NumPy arrays pickle as raw
+        buffers, which is much cheaper than a dict per transaction. Requires
+        NumPy.
+    """
+    from bluefin.dataretrieval.columnar import ColumnarReport
+    return ColumnarReport.from_fields(iter_fields([body]))
@@ -1,50 +1,204 @@
 """
 Client classes for Data Retrieval Interface API.
 """
-import socket
-import urllib
-import urllib2
-import urlparse
-import requests
+import datetime
+import threading
+import time
 
-from bluefin.dataretrieval.exceptions import V1ClientProcessingException, V1ClientInputException, V1ClientException
+try:
+    import Queue as queue
+except ImportError:
+    import queue
 
-class V1Client(object):
+from bluefin.batch import run_parallel
+from bluefin.clientbase import AttemptGuard
+from bluefin.compat import monotonic as _clock
+from bluefin.dataretrieval.bulk import parse_records
+from bluefin.instrumentation import NULL_TRACE, start_trace
+from bluefin.parsing import iter_fields, iter_records, parse_response
+from bluefin.retry import RetryPolicy
+from bluefin.routing import EndpointRouter
+from bluefin.dataretrieval.exceptions import V1ClientProcessingException, V1ClientInputException, V1ClientException, V1ClientCircuitOpenException, V1ClientRateLimitedException
+
+
+class _HedgedTrace(object):
+    """
+    Passes a hedged call's attempts on to its trace, one at a time, until
+    :py:meth:`close` is called.
+    """
+    def __init__(self, trace, done):
+        self._trace = trace
+        self._done = done
+        self._lock = threading.Lock()
+
+    def attempt(self, response=None, exc=None):
+        with self._lock:
+            if not self._done.is_set():
+                self._trace.attempt(response, exc)
+
+    def close(self):
+        """
+        Drops any further attempts, and tells the losing attempt to give up.
+        """
+        with self._lock:
+            self._done.set()
+
+
+class V1Client(AttemptGuard):
     """
     This is the class used to send API calls and receive responses through for
     the V1.x Data Retrival Interface API client.
     """
+    circuit_open_exception = V1ClientCircuitOpenException
+    rate_limited_exception = V1ClientRateLimitedException
+
+    # The request keys that bound a report's date range. Used by
+    # fetch_report() when splitting a range into shards.
+    start_date_key = 'transactions_after'
+    end_date_key = 'transactions_before'
+
     def __init__(self, host='https://secure.bluefingateway.com',
-                 path='/gw/reports/transaction1.5', http_timeout=15):
+                 path='/gw/reports/transaction1.5', http_timeout=15,
+                 transport=None, max_retries=3, retry_policy=None,
+                 circuit_breaker=None, listeners=None, router=None,
+                 hedge_policy=None, limiter=None, response_cache=None):
         """
         Instantiates our API interface with sensible defaults.
 
         :keyword str host: Full URI to the API gateway, including protocol,
-            hostname, and port. No trailing slash.
+            hostname, and port. No trailing slash. May also be a list of
+            them, to spread requests over several endpoints and fail over
+            between them. See :py:class:`bluefin.routing.EndpointRouter`.
         :keyword str path: The path to the API endpoint.
         :keyword int http_timeout: Socket timeout in seconds. This is globally
             applied, so be careful.
+        :keyword bluefin.transport.HTTPTransport transport: The pooled HTTP
+            transport to send requests through. Pass the same instance to
+            several clients to have them share a connection pool. If not
+            specified, the client creates its own.
+        :keyword int max_retries: Maximum number of retries in the event we
+            run into a retryable error. Ignored if ``retry_policy`` is given.
+        :keyword bluefin.retry.RetryPolicy retry_policy: Decides what gets
+            retried, and how. If not specified, connection errors, timeouts,
+            HTTP 408's and 5xx's are retried up to ``max_retries`` times,
+            with jittered exponential backoff. Reports are read-only, so
+            this is safe. With several hosts, retries go to a different one.
+        :keyword bluefin.circuitbreaker.CircuitBreaker circuit_breaker: If
+            given, requests fail fast with V1ClientCircuitOpenException
+            while the breaker is open.
+        :keyword list listeners: Callables that are sent a
+            :py:class:`bluefin.instrumentation.RequestEvent` after every
+            attempt, and once more at the end of each call. See
+            :py:mod:`bluefin.instrumentation`.
+        :keyword bluefin.routing.EndpointRouter router: Picks the endpoint
+            for each attempt. Pass one to tune the routing, or to share it
+            between clients. Its hosts are used instead of ``host``.
+        :keyword bluefin.hedging.HedgePolicy hedge_policy: If given,
+            :py:meth:`send_request` sends a second, identical request when
+            the first is slow to answer, and uses whichever answers first.
+            Reports are read-only, so this is safe.
+        :keyword bluefin.ratelimit.RateLimiter limiter: If given, every
+            attempt waits for a permit from it first, and requests fail with
+            V1ClientRateLimitedException if none comes within its
+            ``max_wait``. Share one between clients to limit them as a
+            whole.
+        :keyword bluefin.dataretrieval.responsecache.ResponseCache response_cache:
+            If given, :py:meth:`send_request` results are kept in it for a
+            while, and repeated requests are answered from it instead of
+            going to the gateway.
         """
-        # Default to the HTTPS endpoint.
+        # Default to the HTTPS endpoint. Sets up self.router, if there are
+        # several.
         self.host = host
+        if router is not None:
+            self.router = router
         # Default to the Transaction interface.
         self.path = path
         # Note that this is applied gobally, so be careful.
         self.http_timeout = http_timeout
+        self.max_retries = max_retries
+        # Connections are pooled and re-used across calls (and threads).
+        # The default transport and retry policy need requests, which is
+        # slow to import, so they're only built on first use.
+        self._transport = transport
+        self._retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.listeners = list(listeners or [])
+        self.hedge_policy = hedge_policy
+        self.limiter = limiter
+        self.response_cache = response_cache
+
+    def _default_retry_policy(self, max_retries):
+        """
+        Builds the retry policy used when none is passed in.
+
+        :rtype: bluefin.retry.RetryPolicy
+        """
+        from requests.exceptions import ConnectionError, Timeout
+        return RetryPolicy(
+            max_retries=max_retries,
+            retry_statuses=(408, 500, 502, 503, 504),
+            retry_exceptions=(ConnectionError, Timeout),
+        )
+
+    @property
+    def transport(self):
+        transport = self._transport
+        if transport is None:
+            from bluefin.transport import HTTPTransport
+            transport = self._transport = HTTPTransport()
+        return transport
+
+    @transport.setter
+    def transport(self, transport):
+        self._transport = transport
+
+    @property
+    def retry_policy(self):
+        retry_policy = self._retry_policy
+        if retry_policy is None:
+            retry_policy = self._retry_policy = \
+                self._default_retry_policy(self.max_retries)
+        return retry_policy
+
+    @retry_policy.setter
+    def retry_policy(self, retry_policy):
+        self._retry_policy = retry_policy
+
+    def add_listener(self, listener):
+        """
+        Adds a callable to send :py:class:`bluefin.instrumentation.RequestEvent`
+        objects to. See the ``listeners`` keyword.
+        """
+        self.listeners.append(listener)
+
+    @property
+    def host(self):
+        return self._host
 
-    def _get_endpoint(self):
+    @host.setter
+    def host(self, host):
+        self._host = host
+        if isinstance(host, (list, tuple)):
+            self.router = EndpointRouter(host)
+        else:
+            self.router = None
+
+    def _get_endpoint(self, host=None):
         """
         urllib2.Request wants a full URI with protocol, host, and path.
         Assemble the proto+host+path into a URI to request.
+
+        :keyword str host: The host to send to. Defaults to ``self.host``.
         """
-        return '%s%s' % (self.host, self.path)
+        return '%s%s' % (host or self.host, self.path)
 
     def _check_for_error_http_status_code(self, response):
         """
         Checks the response's HTTP status code for common error code numbers.
 
         :param requests.Response response: A requests Response object generated
-            by requests.post().
+            by the transport.
         :raises: An appropriate bluefin.directmode.exceptions.V3ClientException
             sub-class, depending on the error.
         """
@@ -59,6 +213,134 @@ class V1Client(object):
         elif http_status > 200:
             raise V1ClientException(response.text, error_code=http_status)
 
+    def _post(self, values, stream=False, trace=NULL_TRACE, cancelled=None):
+        """
+        POSTs the given values to the API, and checks the response's HTTP
+        status code.
+
+        :param dict values: Key/value pairs for your desired API call.
+        :keyword bool stream: If True, the response body is left unread.
+        :keyword trace: The call's :py:class:`bluefin.instrumentation.RequestTrace`.
+        :keyword threading.Event cancelled: If given, no more retries are
+            made once it's set. The last attempt's exception is raised
+            instead.
+        :rtype: requests.Response
+        """
+        headers = {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Host': 'secure.bluefingateway.com',
+            'User-Agent': 'PythonBluefin/Version:2011.Jun.28',
+        }
+
+        retry_state = self.retry_policy.start()
+        # Hosts that already failed during this call.
+        tried = set()
+        while True:
+            permit, ticket = self._acquire_permit()
+            host = self._choose_host(tried)
+            response = None
+            started = _clock()
+            try:
+                response = self.transport.post(
+                    self._get_endpoint(host),
+                    data=values,
+                    headers=headers,
+                    timeout=retry_state.timeout(self.http_timeout),
+                    stream=stream
+                )
+                # Looks at the HTTP status code and raises an exception if any
+                # of the known number ranges for errors are returned.
+                self._check_for_error_http_status_code(response)
+            except Exception as exc:
+                self._record_attempt(trace, response, exc, host,
+                                     _clock() - started, permit, ticket)
+                delay = retry_state.next_delay(exc)
+                if delay is None:
+                    raise
+                # Fail over to another host, if there is one.
+                tried.add(host)
+                if cancelled is None:
+                    time.sleep(delay)
+                elif cancelled.is_set() or cancelled.wait(delay):
+                    raise
+                continue
+
+            self._record_attempt(trace, response, host=host,
+                                 elapsed=_clock() - started, permit=permit,
+                                 ticket=ticket)
+            return response
+
+    def _hedged_read(self, values, trace):
+        """
+        POSTs the given values and reads the response body, like
+        ``self._post(values).content``, but sends a second request if the
+        first hasn't been answered within the hedge policy's delay. The first
+        to come back in one piece wins, and the other is dropped.
+
+        :param dict values: Key/value pairs for your desired API call.
+        :param trace: The call's :py:class:`bluefin.instrumentation.RequestTrace`.
+        :rtype: bytes
+        """
+        policy = self.hedge_policy
+        outcomes = queue.Queue()
+        # Set once there's a winner, so the loser stops reading, and stops
+        # retrying.
+        done = threading.Event()
+        # The attempts share the call's trace, but the loser's mustn't reach
+        # it once the call is over.
+        trace = _HedgedTrace(trace, done)
+
+        def attempt():
+            started = _clock()
+            try:
+                response = self._post(values, stream=True, trace=trace,
+                                      cancelled=done)
+                try:
+                    chunks = []
+                    for chunk in response.iter_content(policy.chunk_size):
+                        if done.is_set():
+                            # Lost. Closing the response half-read drops
+                            # the connection, rather than reading the rest.
+                            return
+                        chunks.append(chunk)
+                finally:
+                    response.close()
+            except Exception as exc:
+                outcomes.put((None, exc))
+                return
+            policy.record(_clock() - started)
+            outcomes.put((b''.join(chunks), None))
+
+        def send():
+            thread = threading.Thread(target=attempt)
+            thread.daemon = True
+            thread.start()
+
+        policy.start()
+        send()
+        in_flight = 1
+        try:
+            outcome = outcomes.get(timeout=policy.delay())
+        except queue.Empty:
+            if policy.allow_hedge():
+                send()
+                in_flight += 1
+            outcome = outcomes.get()
+
+        first_exc = None
+        while True:
+            in_flight -= 1
+            body, exc = outcome
+            if exc is None:
+                trace.close()
+                return body
+            # Failed, but the other one may still come through.
+            first_exc = first_exc or exc
+            if not in_flight:
+                trace.close()
+                raise first_exc
+            outcome = outcomes.get()
+
     def send_request(self, values):
         """
         Sends an API request. You are on your own to pass in the correct
@@ -68,33 +350,308 @@ class V1Client(object):
             the Bluefin documentation for what these should be.
         :rtype: dict
         :returns: A dict of output from the API server. See the Bluefin API
-            docs for how to interpret this.
+            docs for how to interpret this. If the client has a
+            ``response_cache``, this may be a copy of a recent result.
         :raises: V3ClientInputException when the Bluefin API says we have
             an input error, and V3ClientProcessingException when the Bluefin
             API encounters an error during processing. The lower level
-            urllib2 may raise urllib2.HTTPError exceptions also.
+            requests library may raise its own exceptions also.
         """
+        if self.response_cache is not None:
+            return self.response_cache.call(
+                values, lambda: self._traced_send(values))
+        return self._traced_send(values)
 
-        headers = {
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'Host': 'secure.bluefingateway.com',
-            'User-Agent': 'PythonBluefin/Version:2011.Jun.28',
-        }
+    def _traced_send(self, values):
+        """
+        Does the actual sending and parsing for :py:meth:`send_request`.
 
-        response = requests.post(
-            self._get_endpoint(),
-            data=values,
-            headers=headers,
-            timeout=self.http_timeout
-        )
-        # Looks at the HTTP status code and raises an exception if any of the
-        # known number ranges for errors are returned.
-        self._check_for_error_http_status_code(response)
+        :param dict values: Key/value pairs for the API call.
+        :rtype: dict
+        """
+        trace = start_trace(self.listeners, self.__class__.__name__, values)
+        try:
+            if self.hedge_policy is not None:
+                body = self._hedged_read(values, trace)
+            else:
+                body = self._post(values, trace=trace).content
+
+            trace.parse_started()
+            # Repeated keys have their values joined with commas.
+            result_dict = parse_response(body)
+            trace.parsed(result_dict)
+        except Exception as exc:
+            trace.finish(exc)
+            raise
+        trace.finish()
+
+        return result_dict
+
+    def iter_fields(self, values, chunk_size=8192):
+        """
+        Sends an API request, like :py:meth:`send_request`, but streams the
+        response instead of loading it all at once. ``(key, value)`` pairs
+        are yielded as they arrive, so large reports are processed in
+        constant memory, and you can get started before the download
+        finishes.
+
+        Unlike :py:meth:`send_request`, keys that repeat are yielded once
+        per occurrence, rather than being joined with commas.
+
+        :param dict values: Key/value pairs for your desired API call.
+        :keyword int chunk_size: Number of bytes to read at a time.
+        :rtype: generator
+        :raises: The same exceptions as :py:meth:`send_request`, before the
+            first pair is yielded.
+        """
+        trace = start_trace(self.listeners, self.__class__.__name__, values)
+        try:
+            response = self._post(values, stream=True, trace=trace)
+        except Exception as exc:
+            trace.finish(exc)
+            raise
+
+        failure = None
+        try:
+            for pair in iter_fields(response.iter_content(chunk_size)):
+                yield pair
+        except Exception as exc:
+            failure = exc
+            raise
+        finally:
+            # Also when the caller stopped early, closing the generator.
+            trace.finish(failure)
+            # Hands the connection back to the pool if we read to the end,
+            # or drops it if we bailed early.
+            response.close()
+
+    def iter_records(self, values, chunk_size=8192):
+        """
+        Sends an API request and streams back the response as records, one
+        dict per transaction. See :py:meth:`iter_fields` and
+        :py:func:`bluefin.parsing.iter_records`.
+
+        :param dict values: Key/value pairs for your desired API call.
+        :keyword int chunk_size: Number of bytes to read at a time.
+        :rtype: generator
+        """
+        return iter_records(self.iter_fields(values, chunk_size=chunk_size))
+
+    def columnar_report(self, values, chunk_size=8192):
+        """
+        Sends an API request and loads the response column-wise, into
+        NumPy arrays, for fast filtering, totals and exports. Requires NumPy.
+        See :py:class:`bluefin.dataretrieval.columnar.ColumnarReport`.
+
+        :param dict values: Key/value pairs for your desired API call.
+        :keyword int chunk_size: Number of bytes to read at a time.
+        :rtype: bluefin.dataretrieval.columnar.ColumnarReport
+        """
+        # NumPy is optional, so only import it when asked to.
+        from bluefin.dataretrieval.columnar import ColumnarReport
+        return ColumnarReport.from_fields(
+            self.iter_fields(values, chunk_size=chunk_size))
+
+    def _is_retryable_shard_error(self, exc):
+        """
+        Decides whether a failed report shard is worth another try. Network
+        errors, timeouts and gateway-side errors are. Input errors won't get
+        any better by asking again.
+
+        :param Exception exc: The exception raised while fetching the shard.
+        :rtype: bool
+        """
+        if not isinstance(exc, V1ClientException):
+            return True
+        if isinstance(exc, V1ClientCircuitOpenException):
+            return False
+        if isinstance(exc, V1ClientProcessingException):
+            return True
+        # Server errors get lumped in with input errors by
+        # _check_for_error_http_status_code(), so look at the code itself.
+        return exc.error_code == 408 or 500 <= (exc.error_code or 0) <= 599
+
+    def _fetch_shard(self, values, shard_retries):
+        """
+        Fetches a single shard of a report, retrying it on its own if it
+        fails. The shard is read in full before it's returned, since a
+        half-read shard can't be retried. This is on top of the retry policy,
+        which only covers the part up to the response headers.
+
+        :param dict values: Key/value pairs for the shard's API call.
+        :param int shard_retries: Number of times to retry a failed shard.
+        :rtype: list
+        :returns: A list of record dicts.
+        """
+        retries = 0
+        while True:
+            try:
+                return list(self.iter_records(values))
+            except Exception as exc:
+                if retries >= shard_retries or not self._is_retryable_shard_error(exc):
+                    raise
+                retries += 1
+
+    def fetch_report(self, values, start_date, end_date, days_per_shard=7,
+                     concurrency=4, shard_retries=2, key='trans_id'):
+        """
+        Fetches a report covering a (potentially very long) date range. The
+        range is split into shards of ``days_per_shard`` days, which are
+        fetched in parallel over the client's connection pool. A shard that
+        fails is retried on its own, without affecting the others.
+
+        Records are yielded shard by shard, in date order, with duplicates
+        (records whose ``key`` was already yielded by the same shard or the
+        one before, such as those on a shard boundary) dropped. Records
+        without a ``key`` are passed through as they are, so any on a shard
+        boundary come through twice. Memory use depends on the size of a
+        shard, not the report.
+
+        :param dict values: Key/value pairs for your desired API call, minus
+            the date range (``account_id``, ``site_tag``, and so on).
+        :param datetime.date start_date: First day of the range.
+        :param datetime.date end_date: Last day of the range.
+        :keyword int days_per_shard: Number of days each shard covers.
+        :keyword int concurrency: Number of shards to fetch at once.
+        :keyword int shard_retries: Number of times to retry a failed shard.
+        :keyword str key: The field records are de-duplicated on.
+        :rtype: generator
+        :returns: A dict per record.
+        :raises: ValueError if ``days_per_shard`` isn't positive. While
+            iterating, the exception from any shard that still fails after
+            its retries. Records from earlier shards will have been yielded.
+        """
+        if days_per_shard <= 0:
+            raise ValueError("days_per_shard must be at least 1, not %r." %
+                             days_per_shard)
+        return self._fetch_report(values, start_date, end_date,
+                                  days_per_shard, concurrency, shard_retries,
+                                  key)
+
+    def _fetch_report(self, values, start_date, end_date, days_per_shard,
+                      concurrency, shard_retries, key):
+        """
+        The generator behind :py:meth:`fetch_report`, which checks its
+        arguments before any iterating starts.
+        """
+        def shards():
+            shard_start = start_date
+            step = datetime.timedelta(days=days_per_shard)
+            while shard_start <= end_date:
+                shard_end = min(shard_start + step, end_date)
+                shard_values = values.copy()
+                shard_values[self.start_date_key] = shard_start.strftime('%Y-%m-%d')
+                shard_values[self.end_date_key] = shard_end.strftime('%Y-%m-%d')
+                yield shard_values
+                if shard_end >= end_date:
+                    break
+                # Shards share their boundary day, so nothing slips between
+                # them. The overlap is de-duplicated below.
+                shard_start = shard_end
+
+        def fetch(shard_values):
+            return self._fetch_shard(shard_values, shard_retries)
+
+        # Only neighbouring shards overlap, so only the previous shard's keys
+        # are kept, not the whole report's.
+        previous = set()
+        results = run_parallel(fetch, shards(), concurrency=concurrency)
+        try:
+            for result in results:
+                seen = set()
+                for record in result.get():
+                    record_key = record.get(key)
+                    if record_key is not None:
+                        if record_key in seen or record_key in previous:
+                            continue
+                        seen.add(record_key)
+                    yield record
+                previous = seen
+        finally:
+            results.close()
+
+    def _fetch_and_transform(self, values, transform, pool):
+        """
+        Fetches a report's raw body, then hands it to ``transform``, in
+        ``pool`` if there is one.
+
+        :param dict values: Key/value pairs for the report's API call.
+        :rtype: The return value of ``transform``.
+        """
+        trace = start_trace(self.listeners, self.__class__.__name__, values)
+        try:
+            # Read as bytes, and passed on as is. No decoding to text, and no
+            # copies beyond the one that pickling makes.
+            body = self._post(values, trace=trace).content
+            trace.parse_started()
+            if pool is None:
+                result = transform(body)
+            else:
+                result = pool.apply(transform, (body,))
+            trace.parsed({})
+        except Exception as exc:
+            trace.finish(exc)
+            raise
+        trace.finish()
+        return result
+
+    def bulk_reports(self, values_iter, transform=parse_records,
+                     concurrency=8, processes=None, pool=None, ordered=False):
+        """
+        Fetches many reports (one per account or site tag, say), and parses
+        them in a pool of worker processes, so parsing isn't stuck on one
+        core.
+
+        Reports are fetched by ``concurrency`` threads, over the client's
+        connection pool. Each raw body is then passed to ``transform`` in a
+        worker process. The default transform returns a dict per transaction.
+        See :py:mod:`bluefin.dataretrieval.bulk` for others, or to write your
+        own.
+
+        This is a generator, yielding a :py:class:`bluefin.batch.BatchResult`
+        per report, as they finish. Its ``values`` are the report's request
+        values, and its ``result`` is whatever the transform returned. A
+        failed report doesn't stop the rest. Its exception is captured in
+        its result instead.
+
+            >>> accounts = ({'account_id': a, 'site_tag': t} for a, t in pairs)
+            >>> for item in api.bulk_reports(accounts, processes=4):
+            ...     if item.ok:
+            ...         store.add(item.result, item.values['account_id'])
+
+        :param values_iter: An iterable of value dicts, one per report.
+        :keyword callable transform: Called with each report's raw body, in
+            a worker process. Must be picklable.
+        :keyword int concurrency: Number of reports to fetch at once. For
+            best results, the transport's ``pool_maxsize`` should be at
+            least this.
+        :keyword int processes: Number of worker processes. Defaults to the
+            number of CPUs. 0 parses in the fetching threads instead, which
+            is only worth it for small reports.
+        :keyword multiprocessing.pool.Pool pool: A pool to use instead of
+            starting (and stopping) one. ``processes`` is ignored.
+        :keyword bool ordered: If True, results are yielded in input order.
+        :rtype: generator
+        """
+        own_pool = pool is None and processes != 0
+        if own_pool:
+            import multiprocessing
+            # Started before any threads are, since forking a process with
+            # threads running is asking for trouble.
+            pool = multiprocessing.Pool(processes)
 
-        result_dict = urlparse.parse_qs(response.text)
-        for key, value in result_dict.items():
-            # Strip away the lists from the value, since these should all just
-            # be a one-member list. We'll join with commas just in case.
-            result_dict[key] = ','.join(value)
+        def fetch(values):
+            return self._fetch_and_transform(values, transform, pool)
 
-        return result_dict
\ No newline at end of file
+        results = run_parallel(fetch, values_iter, concurrency=concurrency,
+                               ordered=ordered)
+        try:
+            for result in results:
+                yield result
+        finally:
+            results.close()
+            if own_pool:
+                # If we were stopped early, this waits on the few reports
+                # still being parsed. The ones not fetched yet are dropped.
+                pool.close()
+                pool.join()
@@ -0,0 +1,363 @@
+"""
+Column-wise, NumPy-backed report results, for analyzing large Data
+Retrieval reports without a dict per transaction. Requires NumPy
+(``pip install bluefin[columnar]``).
+"""
+import decimal
+import io
+
+import numpy
+
+# What's kept in each kind of column.
+AMOUNT = 'amount'
+DATE = 'date'
+STRING = 'string'
+
+# Groups on the day part of the report's date field in total_by() and
+# count_by().
+DAY = 'day'
+
+
+def _to_cents(values, places):
+    """
+    :param list values: Amounts, as strings. Blanks count as zero.
+    :rtype: numpy.ndarray
+    :returns: An int64 array of amounts in minor units (cents).
+    """
+    strings = numpy.array(values, dtype='U')
+    strings[strings == ''] = '0'
+    scaled = strings.astype(numpy.float64) * 10 ** places
+    return numpy.rint(scaled).astype(numpy.int64)
+
+
+def _to_datetimes(values):
+    """
+    :param list values: Timestamps, as ``YYYY-MM-DD HH:MM:SS`` strings.
+        Blanks become NaT.
+    :rtype: numpy.ndarray
+    """
+    strings = numpy.array(values, dtype='U')
+    strings[strings == ''] = 'NaT'
+    strings = numpy.char.replace(strings, ' ', 'T')
+    return strings.astype('datetime64[s]')
+
+
+class ColumnarReport(object):
+    """
+    A report's transactions, stored as one NumPy array per field instead of
+    a dict per transaction. Amounts are int64 arrays of minor units (cents),
+    so totals are exact. Timestamps are ``datetime64[s]`` arrays, and
+    everything else is a unicode string array.
+
+        >>> report = api.columnar_report({'transactions_after': '2011-01-01',
+        ...                               'transactions_before': '2011-01-31'})
+        >>> approved = report.where(status_code='1')
+        >>> approved.total_by('processor')
+        {'VISA': Decimal('10234.50'), 'TEST': Decimal('12.00')}
+        >>> approved.total_by('day')
+        {datetime.date(2011, 1, 1): Decimal('432.10'), ...}
+        >>> approved.to_csv('january.csv')
+
+    Index with a field name to get its array, or with a boolean array (or
+    use :py:meth:`filter`) to get a new report with the matching rows.
+    """
+    #: Fields kept as amounts, when present.
+    amount_fields = ('settle_amount', 'amount')
+    #: Fields kept as timestamps, when present.
+    date_fields = ('auth_date', 'settle_date')
+    #: Decimal places in amounts.
+    amount_places = 2
+    #: Rows formatted and written at a time by :py:meth:`to_csv`.
+    csv_chunk_rows = 65536
+
+    def __init__(self, columns, names=None, date_field='auth_date'):
+        """
+        :param dict columns: Field names to NumPy arrays, all the same length.
+            Use :py:meth:`from_fields` or :py:meth:`from_records` to build
+            these from a report.
+        :keyword list names: The order to keep fields in. Defaults to
+            sorted.
+        :keyword str date_field: The timestamp field that ``'day'`` groups
+            on.
+        """
+        self.columns = columns
+        self.names = list(names) if names is not None else sorted(columns)
+        self.date_field = date_field
+        lengths = set(len(array) for array in columns.values())
+        if len(lengths) > 1:
+            raise ValueError("Columns have different lengths: %s" %
+                             sorted(lengths))
+
+    @classmethod
+    def _from_lists(cls, lists, names, rows, **kwargs):
+        """
+        Converts per-field lists of strings into typed arrays.
+        """
+        columns = {}
+        for name in names:
+            values = lists[name]
+            # Fields missing from the last rows are blank.
+            values.extend([''] * (rows - len(values)))
+            if name in cls.amount_fields:
+                columns[name] = _to_cents(values, cls.amount_places)
+            elif name in cls.date_fields:
+                columns[name] = _to_datetimes(values)
+            else:
+                columns[name] = numpy.array(values, dtype='U')
+        return cls(columns, names=names, **kwargs)
+
+    @classmethod
+    def from_fields(cls, fields, **kwargs):
+        """
+        Builds a report from a stream of ``(key, value)`` pairs, as yielded
+        by :py:meth:`bluefin.dataretrieval.clients.V1Client.iter_fields`.
+        As with :py:func:`bluefin.parsing.iter_records`, a new row starts
+        whenever a field turns up that the current row already has. No
+        per-row objects are built along the way.
+
+        :param fields: An iterable of ``(key, value)`` pairs.
+        :rtype: ColumnarReport
+        """
+        lists = {}
+        names = []
+        rows = 0
+        for key, value in fields:
+            values = lists.get(key)
+            if values is None:
+                values = lists[key] = []
+                names.append(key)
+            if len(values) == rows:
+                # The current row already has this field. Start a new one.
+                rows += 1
+            if len(values) < rows - 1:
+                # Fields missing from earlier rows are blank.
+                values.extend([''] * (rows - 1 - len(values)))
+            values.append(value)
+        return cls._from_lists(lists, names, rows, **kwargs)
+
+    @classmethod
+    def from_records(cls, records, **kwargs):
+        """
+        Builds a report from record dicts, such as those yielded by
+        :py:meth:`bluefin.dataretrieval.clients.V1Client.fetch_report`.
+
+        :param records: An iterable of dicts.
+        :rtype: ColumnarReport
+        """
+        lists = {}
+        names = []
+        rows = 0
+        for record in records:
+            for key, value in record.items():
+                values = lists.get(key)
+                if values is None:
+                    values = lists[key] = []
+                    names.append(key)
+                values.extend([''] * (rows - len(values)))
+                values.append(value)
+            rows += 1
+        return cls._from_lists(lists, names, rows, **kwargs)
+
+    def _kind(self, name):
+        dtype = self.columns[name].dtype
+        if dtype.kind == 'M':
+            return DATE
+        if name in self.amount_fields and dtype.kind == 'i':
+            return AMOUNT
+        return STRING
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(self.columns[self.names[0]])
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, key):
+        if isinstance(key, numpy.ndarray):
+            return self.filter(key)
+        return self.columns[key]
+
+    def __repr__(self):
+        return '<ColumnarReport: %d rows, %d fields>' % (len(self),
+                                                         len(self.names))
+
+    def filter(self, mask):
+        """
+        :param numpy.ndarray mask: A boolean array with one entry per row,
+            such as ``report['processor'] == 'VISA'``.
+        :rtype: ColumnarReport
+        :returns: A new report with only the rows where ``mask`` is True.
+        """
+        columns = dict((name, array[mask])
+                       for name, array in self.columns.items())
+        return self.__class__(columns, names=self.names,
+                              date_field=self.date_field)
+
+    def where(self, **equals):
+        """
+        Filters on field values:
+
+            >>> report.where(status_code='1', processor='VISA')
+
+        :rtype: ColumnarReport
+        :returns: A new report with only the rows whose fields have all of
+            the given values.
+        """
+        mask = numpy.ones(len(self), dtype=bool)
+        for name, value in equals.items():
+            mask &= self.columns[name] == value
+        return self.filter(mask)
+
+    def _group(self, key):
+        """
+        :param str key: A field name, or ``'day'``.
+        :returns: A ``(labels, inverse)`` tuple, as from ``numpy.unique``.
+        """
+        if key == DAY:
+            values = self.columns[self.date_field].astype('datetime64[D]')
+        else:
+            values = self.columns[key]
+        return numpy.unique(values, return_inverse=True)
+
+    def _to_decimal(self, cents):
+        return decimal.Decimal(int(cents)).scaleb(-self.amount_places)
+
+    def total(self, amount_field='settle_amount'):
+        """
+        :rtype: decimal.Decimal
+        :returns: The sum of an amount field.
+        """
+        return self._to_decimal(self.columns[amount_field].sum())
+
+    def total_by(self, key, amount_field='settle_amount'):
+        """
+        Sums an amount field per value of another field, such as
+        ``'status_code'`` or ``'processor'``. Pass ``'day'`` to sum per day
+        of the report's ``date_field``.
+
+        :param str key: The field to group on, or ``'day'``.
+        :keyword str amount_field: The amount field to sum.
+        :rtype: dict
+        :returns: Maps each value (or ``datetime.date``) to a Decimal total.
+        """
+        labels, inverse = self._group(key)
+        totals = numpy.zeros(len(labels), dtype=numpy.int64)
+        numpy.add.at(totals, inverse, self.columns[amount_field])
+        return dict((label, self._to_decimal(total))
+                    for label, total in zip(labels.tolist(), totals))
+
+    def count_by(self, key):
+        """
+        Counts rows per value of a field, or per day with ``'day'``.
+
+        :rtype: dict
+        :returns: Maps each value (or ``datetime.date``) to a row count.
+        """
+        labels, inverse = self._group(key)
+        counts = numpy.bincount(inverse, minlength=len(labels))
+        return dict(zip(labels.tolist(), counts.tolist()))
+
+    def _format(self, name, start=0, stop=None):
+        """
+        :keyword int start: First row to format.
+        :keyword int stop: Row to stop before. Defaults to the end.
+        :rtype: numpy.ndarray
+        :returns: A column (or rows of it) formatted as CSV-ready strings.
+        """
+        array = self.columns[name][start:stop]
+        kind = self._kind(name)
+        if kind == AMOUNT:
+            places = self.amount_places
+            units, fraction = numpy.divmod(numpy.abs(array), 10 ** places)
+            strings = numpy.char.add(
+                numpy.char.add(units.astype('U'), '.'),
+                numpy.char.zfill(fraction.astype('U'), places))
+            return numpy.where(array < 0, numpy.char.add('-', strings), strings)
+        if kind == DATE:
+            strings = numpy.char.replace(array.astype('U'), 'T', ' ')
+            return numpy.where(numpy.isnat(array), '', strings)
+
+        # Quote anything with a separator, quote or line break in it.
+        needs_quotes = numpy.zeros(len(array), dtype=bool)
+        for char in (',', '"', '\n', '\r'):
+            needs_quotes |= numpy.char.find(array, char) >= 0
+        if not needs_quotes.any():
+            return array
+        quoted = numpy.char.add(
+            numpy.char.add('"', numpy.char.replace(array, '"', '""')), '"')
+        return numpy.where(needs_quotes, quoted, array)
+
+    def to_csv(self, path, names=None):
+        """
+        Writes the report to a UTF-8 CSV file with a header row. Amounts are
+        written as decimals, and timestamps as ``YYYY-MM-DD HH:MM:SS``.
+        Lines are built a column at a time, ``csv_chunk_rows`` rows at a
+        time, so memory use depends on the chunk size, not the report.
+
+        :param str path: The file to write.
+        :keyword list names: The fields to write, in order. Defaults to all.
+        """
+        names = list(names or self.names)
+        with io.open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(u','.join(names) + u'\n')
+            if not names:
+                return
+            for start in range(0, len(self), self.csv_chunk_rows):
+                stop = start + self.csv_chunk_rows
+                lines = self._format(names[0], start, stop)
+                for name in names[1:]:
+                    lines = numpy.char.add(numpy.char.add(lines, ','),
+                                           self._format(name, start, stop))
+                f.write(u'\n'.join(lines.tolist()) + u'\n')
+
+    def to_npz(self, path):
+        """
+        Saves the report's arrays to a compressed NumPy ``.npz`` file. Load
+        it back with :py:meth:`from_npz`.
+
+        :param str path: The file to write.
+        """
+        arrays = [self.columns[name] for name in self.names]
+        numpy.savez_compressed(path, names=numpy.array(self.names, dtype='U'),
+                               date_field=numpy.array(self.date_field),
+                               *arrays)
+
+    @classmethod
+    def from_npz(cls, path):
+        """
+        Loads a report saved with :py:meth:`to_npz`.
+
+        :param str path: The file to read.
+        :rtype: ColumnarReport
+        """
+        with numpy.load(path) as data:
+            names = data['names'].tolist()
+            columns = dict((name, data['arr_%d' % i])
+                           for i, name in enumerate(names))
+            return cls(columns, names=names,
+                       date_field=data['date_field'].tolist())
+
+    def to_parquet(self, path):
+        """
+        Writes the report to a Parquet file. Amounts are stored as
+        ``decimal128(19, 2)`` columns, and timestamps as ``timestamp[s]``.
+        Requires pyarrow.
+
+        :param str path: The file to write.
+        """
+        import pyarrow
+        import pyarrow.parquet
+
+        arrays = []
+        for name in self.names:
+            array = pyarrow.array(self.columns[name])
+            if self._kind(name) == AMOUNT:
+                # Decimals are stored as unscaled integers, so cents can be
+                # cast as is, then relabeled with the right scale.
+                array = array.cast(pyarrow.decimal128(19, 0)).view(
+                    pyarrow.decimal128(19, self.amount_places))
+            arrays.append(array)
+        table = pyarrow.Table.from_arrays(arrays, names=self.names)
+        pyarrow.parquet.write_table(table, path)
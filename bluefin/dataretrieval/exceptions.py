@@ -34,4 +34,22 @@ class V1ClientProcessingException(V1ClientException):
     Raised when a processing error occurs on the Bluefin side. These are
     generally HTTP error codes 700-799.
     """
-    pass
\ No newline at end of file
+    pass
+
+
+class V1ClientCircuitOpenException(V1ClientException):
+    """
+    Raised without contacting the gateway when the client's circuit breaker
+    is open, after too many consecutive failures. See
+    :py:class:`bluefin.circuitbreaker.CircuitBreaker`.
+    """
+    pass
+
+
+class V1ClientRateLimitedException(V1ClientException):
+    """
+    Raised without contacting the gateway when the client's rate limiter
+    has no permit to give within its ``max_wait``. See
+    :py:class:`bluefin.ratelimit.RateLimiter`.
+    """
+    pass
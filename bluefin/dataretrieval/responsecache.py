@@ -0,0 +1,205 @@
+"""
+Memoization of Data Retrieval responses, for dashboards and the like that
+ask for the same report over and over.
+"""
+import hashlib
+import hmac
+import logging
+import os
+import sys
+import threading
+
+from bluefin.cache import TTLCache
+
+logger = logging.getLogger('bluefin')
+
+
+class _Flight(object):
+    """
+    A request in flight, for callers with the same key to wait on.
+    """
+    __slots__ = ('event', 'result', 'exception')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+def result_size(result_dict):
+    """
+    Roughly how much memory a parsed response takes up.
+
+    :param dict result_dict: The parsed response.
+    :rtype: int
+    :returns: A size in bytes.
+    """
+    size = sys.getsizeof(result_dict)
+    for key, value in result_dict.items():
+        size += sys.getsizeof(key) + sys.getsizeof(value)
+    return size
+
+
+class ResponseCache(object):
+    """
+    Remembers :py:meth:`V1Client.send_request` results for a while. Pass one
+    to :py:class:`bluefin.dataretrieval.clients.V1Client`'s
+    ``response_cache`` keyword.
+
+        >>> api = V1Client(response_cache=ResponseCache(ttl=30))
+
+    Requests are matched on all of their values, so the same report asked
+    for with different credentials is fetched separately. Identical
+    requests that come in while one is already in flight wait for its
+    result, rather than all going to the gateway. Errors aren't cached, but
+    callers waiting on a request that fails get its exception too.
+
+    Keys are safe to log: the ``authorization`` value is replaced with a
+    keyed hash, using a secret that's picked at random for each cache.
+    Results are only kept in memory, and each caller gets its own copy.
+    Instances are thread-safe, and may be shared between clients.
+    """
+    # Values that are replaced with a hash in keys.
+    secret_fields = ('authorization',)
+
+    def __init__(self, ttl=60, max_entries=1000, max_bytes=16 * 1024 * 1024):
+        """
+        :keyword ttl: Seconds to keep results for. May also be a callable
+            that's passed a request's values, and returns the number of
+            seconds for that request, or None not to cache it at all. Old
+            date ranges won't change, for example, while today's will.
+        :keyword int max_entries: Most results to keep.
+        :keyword int max_bytes: Most memory to take up with results, roughly.
+            None means no limit. Results bigger than this aren't kept.
+        """
+        self.ttl = ttl
+        self._cache = TTLCache(max_entries=max_entries, max_bytes=max_bytes)
+        self._secret = os.urandom(16)
+        self._lock = threading.Lock()
+        # key -> _Flight, for requests in flight.
+        self._in_flight = {}
+        # Lifetime totals, for dashboards.
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._bypassed = 0
+
+    def _hash_secret(self, value):
+        digest = hmac.new(self._secret, value.encode('utf-8'), hashlib.sha256)
+        return 'hmac:' + digest.hexdigest()[:16]
+
+    def make_key(self, values):
+        """
+        Normalizes a request's values into a cache key: keys in order, and
+        values as text, so that ``123`` and ``'123'`` match, as do a date
+        and its ISO format. The ``authorization`` value is hashed.
+
+        :param dict values: The request's values.
+        :rtype: str
+        """
+        parts = []
+        for key in sorted(values):
+            value = u'%s' % (values[key],)
+            if key in self.secret_fields:
+                value = self._hash_secret(value)
+            parts.append(u'%s=%s' % (key, value))
+        return u'&'.join(parts)
+
+    def ttl_for(self, values):
+        """
+        :param dict values: The request's values.
+        :rtype: float or None
+        :returns: Seconds to keep the request's result for, or None if it
+            shouldn't be cached.
+        """
+        if callable(self.ttl):
+            return self.ttl(values)
+        return self.ttl
+
+    def call(self, values, func):
+        """
+        Calls ``func()`` to send a request, unless there's a matching result
+        in the cache, or a matching request in flight.
+
+        :param dict values: The request's values.
+        :param callable func: Sends the request, returning the result dict.
+        :rtype: dict
+        :returns: A copy of the result dict.
+        :raises: Whatever the request (ours or the matching one) raised.
+        """
+        ttl = self.ttl_for(values)
+        if ttl is None or ttl <= 0:
+            with self._lock:
+                self._bypassed += 1
+            return func()
+
+        key = self.make_key(values)
+        ours = False
+        with self._lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self._hits += 1
+            else:
+                flight = self._in_flight.get(key)
+                if flight is None:
+                    ours = True
+                    self._misses += 1
+                    flight = self._in_flight[key] = _Flight()
+                else:
+                    self._coalesced += 1
+
+        if result is not None:
+            logger.debug("Response cache hit: %s", key)
+            return dict(result)
+        if not ours:
+            # Someone else is on it.
+            flight.event.wait()
+            if flight.exception is not None:
+                raise flight.exception
+            return dict(flight.result)
+
+        logger.debug("Response cache miss: %s", key)
+        try:
+            result = func()
+        except BaseException as exc:
+            flight.exception = exc
+            raise
+        else:
+            flight.result = result
+            self._cache.set(key, result, ttl, size=result_size(result))
+            return dict(result)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            flight.event.set()
+
+    def invalidate(self, values):
+        """
+        Drops the cached result for a request, if there is one.
+
+        :param dict values: The request's values.
+        """
+        self._cache.delete(self.make_key(values))
+
+    def clear(self):
+        """
+        Drops all cached results.
+        """
+        self._cache.clear()
+
+    def snapshot(self):
+        """
+        Returns the cache's current state, for dashboards.
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'coalesced': self._coalesced,
+                'bypassed': self._bypassed,
+                'entries': len(self._cache),
+                'bytes': self._cache.bytes,
+                'evictions': self._cache.evictions,
+            }
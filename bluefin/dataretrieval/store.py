@@ -0,0 +1,229 @@
+"""
+A local, incrementally updated store of fetched transactions.
+"""
+import datetime
+import json
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    trans_id TEXT PRIMARY KEY,
+    account_id TEXT,
+    site_tag TEXT,
+    trans_date TEXT,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transactions_by_date
+    ON transactions (trans_date);
+CREATE INDEX IF NOT EXISTS transactions_by_site_tag
+    ON transactions (account_id, site_tag, trans_date);
+CREATE TABLE IF NOT EXISTS high_water_marks (
+    account_id TEXT NOT NULL,
+    site_tag TEXT NOT NULL,
+    fetched_through TEXT NOT NULL,
+    PRIMARY KEY (account_id, site_tag)
+);
+"""
+
+
+class TransactionStore(object):
+    """
+    Keeps the transactions fetched through a
+    :py:class:`bluefin.dataretrieval.clients.V1Client` in a SQLite database,
+    indexed by ``trans_id``, date, and account/site tag. Once a date range
+    has been fetched, lookups are answered locally, and :py:meth:`sync` only
+    asks the gateway for what's new since the last sync.
+
+        >>> store = TransactionStore('/var/lib/billing/transactions.db')
+        >>> store.sync(api, {'account_id': 123456789012, 'site_tag': 'MAIN',
+        ...                  'authorization': 'AUTH_CODE'},
+        ...            since=datetime.date(2011, 1, 1))
+        >>> store.get('123456789012')
+
+    Instances may be shared between threads.
+    """
+    # Number of records to write per transaction in add().
+    write_batch_size = 500
+
+    def __init__(self, path=':memory:', date_field='auth_date'):
+        """
+        :keyword str path: Path to the SQLite database file. It's created if
+            it doesn't exist yet. Defaults to an in-memory database.
+        :keyword str date_field: The record field to index dates on.
+        """
+        self.path = path
+        self.date_field = date_field
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(SCHEMA)
+
+    def add(self, records, account_id=None, site_tag=None):
+        """
+        Adds records to the store. Records that are already stored (by
+        ``trans_id``) are replaced. Records without a ``trans_id`` are
+        skipped, since there's no way to look them up again.
+
+        :param records: An iterable of record dicts, such as those yielded by
+            :py:meth:`V1Client.fetch_report`.
+        :keyword account_id: The account the records belong to.
+        :keyword str site_tag: The site tag the records belong to.
+        :rtype: int
+        :returns: The number of records stored.
+        """
+        return self._add(records, account_id, site_tag)
+
+    def _add(self, records, account_id, site_tag, mark=None):
+        """
+        Does the work of :py:meth:`add`. If given a ``mark``, it's set as
+        the high-water mark along with the last batch.
+        """
+        count = 0
+        rows = []
+        for record in records:
+            if not record.get('trans_id'):
+                continue
+            rows.append((
+                _to_text(record['trans_id']), _to_text(account_id), site_tag,
+                record.get(self.date_field), json.dumps(record)))
+            if len(rows) >= self.write_batch_size:
+                count += self._write(rows)
+                rows = []
+        if rows or mark is not None:
+            count += self._write(rows, account_id, site_tag, mark)
+        return count
+
+    def _write(self, rows, account_id=None, site_tag=None, mark=None):
+        """
+        Writes a batch of rows in a single transaction. Records may come
+        straight off the network, so we only hold the lock per batch.
+        """
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO transactions '
+                    '(trans_id, account_id, site_tag, trans_date, record) '
+                    'VALUES (?, ?, ?, ?, ?)', rows)
+                if mark is not None:
+                    self._conn.execute(
+                        'INSERT OR REPLACE INTO high_water_marks '
+                        '(account_id, site_tag, fetched_through) '
+                        'VALUES (?, ?, ?)',
+                        _mark_key(account_id, site_tag) + (mark.isoformat(),))
+        return len(rows)
+
+    def get(self, trans_id):
+        """
+        Looks up a single transaction.
+
+        :param trans_id: The transaction's ID.
+        :rtype: dict or None
+        :returns: The stored record, or None if we don't have it.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT record FROM transactions WHERE trans_id = ?',
+                (_to_text(trans_id),)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def between(self, start_date, end_date, account_id=None, site_tag=None):
+        """
+        Looks up the stored transactions in a date range, in date order.
+
+        :param datetime.date start_date: First day of the range.
+        :param datetime.date end_date: Last day of the range.
+        :keyword account_id: Only return this account's transactions.
+        :keyword str site_tag: Only return this site tag's transactions.
+        :rtype: list
+        :returns: A list of record dicts.
+        """
+        query = 'SELECT record FROM transactions ' \
+                'WHERE trans_date >= ? AND trans_date < ?'
+        params = [start_date.isoformat(),
+                  (end_date + datetime.timedelta(days=1)).isoformat()]
+        if account_id is not None:
+            query += ' AND account_id = ?'
+            params.append(_to_text(account_id))
+        if site_tag is not None:
+            query += ' AND site_tag = ?'
+            params.append(site_tag)
+        query += ' ORDER BY trans_date, trans_id'
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def high_water_mark(self, account_id, site_tag):
+        """
+        Returns the last day that has been synced for an account and site
+        tag. A site tag of None is the account's sync without one.
+
+        :rtype: datetime.date or None
+        :returns: The date, or None if nothing has been synced yet.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT fetched_through FROM high_water_marks '
+                'WHERE account_id = ? AND site_tag = ?',
+                _mark_key(account_id, site_tag)).fetchone()
+        if row is None:
+            return None
+        return datetime.datetime.strptime(row[0], '%Y-%m-%d').date()
+
+    def _set_high_water_mark(self, account_id, site_tag, date):
+        self._write([], account_id, site_tag, date)
+
+    def sync(self, client, values, since, until=None, **kwargs):
+        """
+        Fetches whatever is new for the account and site tag in ``values``,
+        and adds it to the store. Only the days after the high-water mark
+        left by the previous sync are fetched (plus the high-water mark day
+        itself, which may have been incomplete back then).
+
+        :param V1Client client: The client to fetch through.
+        :param dict values: Key/value pairs for the report API call,
+            including ``account_id``, ``authorization`` and optionally
+            ``site_tag``.
+        :param datetime.date since: Where to start, if nothing has been
+            synced yet.
+        :keyword datetime.date until: Last day to fetch. Defaults to today.
+        :keyword kwargs: Passed on to :py:meth:`V1Client.fetch_report`.
+        :rtype: int
+        :returns: The number of records fetched.
+        """
+        account_id = values.get('account_id')
+        site_tag = values.get('site_tag')
+        until = until or datetime.date.today()
+
+        start = max(self.high_water_mark(account_id, site_tag) or since, since)
+        if start > until:
+            return 0
+
+        records = client.fetch_report(values, start, until, **kwargs)
+        # The mark is written in the same transaction as the last records,
+        # so it only moves once everything up to it is safely stored.
+        return self._add(records, account_id, site_tag, mark=until)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _mark_key(account_id, site_tag):
+    """
+    The high-water mark's key. The site tag is optional, but part of the
+    primary key, so no site tag is stored as ''.
+    """
+    return _to_text(account_id), site_tag or u''
+
+
+def _to_text(value):
+    """
+    Account IDs and transaction IDs show up as both ints and strings. Store
+    them consistently.
+    """
+    if value is None:
+        return None
+    return u'%s' % value
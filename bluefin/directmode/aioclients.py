@@ -0,0 +1,244 @@
+"""
+asyncio client classes for Direct Mode services. Requires Python 3.5+
+and aiohttp (``pip install bluefin[async]``).
+"""
+import asyncio
+import time
+
+import aiohttp
+
+from bluefin.aiotransport import AsyncHTTPTransport
+from bluefin.batch import BatchResult
+from bluefin.directmode.clients import V3Client
+from bluefin.instrumentation import start_trace
+from bluefin.parsing import FORM_HEADERS
+from bluefin.retry import RetryPolicy
+from bluefin.routing import EndpointRouter
+
+# What aiohttp raises when the gateway is down, unreachable or too slow.
+FAILURE_EXCEPTIONS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+class AsyncV3Client(V3Client):
+    """
+    A native asyncio version of :py:class:`V3Client`. Everything but
+    :py:meth:`send_request` and :py:meth:`send_batch` behaves exactly the
+    same, including the defaults, retries and error handling. Those two are
+    coroutines.
+
+    The ``idempotency`` cache isn't supported, since it blocks while waiting
+    on in-flight requests.
+    """
+    def __init__(self, host='https://secure.bluefingateway.com:1402',
+                 path='/gw/sas/direct3.1', http_timeout=15,
+                 account_id=None, dynip_sec_code=None, max_retries=3,
+                 transport=None, retry_policy=None, circuit_breaker=None,
+                 listeners=None, result_class=None, validator=None,
+                 router=None, limiter=None, concurrency=100):
+        """
+        Takes the same keywords as :py:class:`V3Client`, plus:
+
+        :keyword bluefin.aiotransport.AsyncHTTPTransport transport: The
+            non-blocking transport to send requests through. If not
+            specified, the client creates its own.
+        :keyword bluefin.circuitbreaker.CircuitBreaker circuit_breaker: If
+            given, requests fail fast while the breaker is open. If it was
+            built without ``failure_exceptions``, aiohttp's
+            ``ClientError`` and ``asyncio.TimeoutError`` are added to the
+            defaults. Otherwise, make sure they're among them.
+        :keyword bluefin.routing.EndpointRouter router: Picks the endpoint
+            for each attempt. The same goes for its ``failure_exceptions``.
+            The router built for a list of hosts takes care of that.
+        :keyword bluefin.ratelimit.RateLimiter limiter: If given, every
+            attempt waits for a permit from it first, on the event loop.
+            The same goes for its ``throttle_exceptions``.
+        :keyword int concurrency: Maximum number of requests this client
+            will have in flight at once. Further calls wait their turn.
+        """
+        super(AsyncV3Client, self).__init__(
+            host=host, path=path, http_timeout=http_timeout,
+            account_id=account_id, dynip_sec_code=dynip_sec_code,
+            max_retries=max_retries,
+            transport=transport or AsyncHTTPTransport(),
+            retry_policy=retry_policy,
+            circuit_breaker=circuit_breaker,
+            listeners=listeners,
+            result_class=result_class,
+            validator=validator,
+            router=router,
+            limiter=limiter,
+        )
+        if circuit_breaker is not None:
+            circuit_breaker.add_default_failure_exceptions(FAILURE_EXCEPTIONS)
+        if limiter is not None:
+            limiter.add_default_throttle_exceptions(FAILURE_EXCEPTIONS)
+        self.concurrency = concurrency
+        # Created on first use, so it's bound to the right event loop.
+        self._semaphore = None
+
+    def _default_retry_policy(self, max_retries):
+        """
+        Same as :py:class:`V3Client`'s, but for aiohttp's connection errors.
+
+        :rtype: bluefin.retry.RetryPolicy
+        """
+        return RetryPolicy(max_retries=max_retries, retry_statuses=(408,),
+                           retry_exceptions=(aiohttp.ClientConnectorError,))
+
+    def _default_router(self, hosts):
+        """
+        Same as :py:class:`V3Client`'s, but for aiohttp's exceptions.
+
+        :rtype: bluefin.routing.EndpointRouter
+        """
+        return EndpointRouter(hosts, failure_exceptions=(
+            aiohttp.ClientConnectionError, asyncio.TimeoutError))
+
+    def _get_semaphore(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def _wait_for_permit(self):
+        """
+        Same as :py:meth:`V3Client._acquire_permit`, but waits on the event
+        loop rather than blocking it.
+        """
+        limiter = self.limiter
+        if limiter is None:
+            return self._admit(None)
+        started = time.monotonic()
+        max_wait = limiter.max_wait
+        wait = limiter.reserve(max_wait)
+        if wait is None:
+            permit = None
+        else:
+            if wait:
+                await asyncio.sleep(wait)
+            permit = limiter.try_acquire()
+            while permit is None and (max_wait is None or
+                                      time.monotonic() - started < max_wait):
+                await asyncio.sleep(limiter.poll_interval)
+                permit = limiter.try_acquire()
+            if permit is None:
+                limiter.refund()
+        if permit is None:
+            limiter.record_timeout()
+            raise self._rate_limited()
+        return self._admit(permit)
+
+    async def send_request(self, values):
+        """
+        Sends an API request. See :py:meth:`V3Client.send_request`.
+
+        :param dict values: Key/value pairs for your desired API call.
+        :rtype: dict
+        :returns: A dict of output from the API server.
+        :raises: The same exceptions as :py:meth:`V3Client.send_request`.
+            aiohttp may raise its own exceptions also.
+        """
+        if self.validator is None and not self.listeners:
+            all_values = values
+        else:
+            all_values = self._get_all_values(values)
+        if self.validator is not None:
+            self.validator(all_values)
+        body = self._encode_body(values)
+
+        trace = start_trace(self.listeners, self.__class__.__name__, all_values)
+        try:
+            async with self._get_semaphore():
+                result_dict = await self._send(body, trace)
+        except Exception as exc:
+            trace.finish(exc)
+            raise
+        trace.finish()
+
+        if self.result_class is not None:
+            return self.result_class(result_dict)
+        return result_dict
+
+    async def send_batch(self, values_iter, concurrency=4, ordered=True):
+        """
+        Sends many API requests at once. Like :py:meth:`V3Client.send_batch`,
+        a failed request doesn't stop the rest of the batch, but this is a
+        coroutine, and returns all of the results together, once they're in.
+
+            >>> for item in await api.send_batch(charges, concurrency=8):
+            ...     if item.ok:
+            ...         print(item.result['trans_id'])
+
+        :param values_iter: An iterable of value dicts, as you'd pass to
+            :py:meth:`send_request`.
+        :keyword int concurrency: Number of requests to have in flight. The
+            client's own ``concurrency`` still applies on top of this.
+        :keyword bool ordered: If True, results are in input order. If
+            False, they're in the order they completed.
+        :rtype: list
+        :returns: A :py:class:`bluefin.batch.BatchResult` per value dict.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        completed = []
+
+        async def send(index, values):
+            async with semaphore:
+                try:
+                    result = BatchResult(index, values,
+                                         result=await self.send_request(values))
+                except Exception as exc:
+                    result = BatchResult(index, values, exception=exc)
+            completed.append(result)
+            return result
+
+        results = await asyncio.gather(
+            *[send(index, values) for index, values in enumerate(values_iter)])
+        return list(results) if ordered else completed
+
+    async def _send(self, body, trace):
+        """
+        Does the actual sending, retrying, and parsing for
+        :py:meth:`send_request`. Retries send the exact same body.
+        """
+        retry_state = self.retry_policy.start()
+        tried = set()
+        while True:
+            permit, ticket = await self._wait_for_permit()
+            host = self._choose_host(tried)
+            response = None
+            started = time.monotonic()
+            try:
+                response = await self.transport.post(
+                    self._get_endpoint(host),
+                    data=body,
+                    headers=FORM_HEADERS,
+                    timeout=retry_state.timeout(self.http_timeout)
+                )
+                self._check_for_error_http_status_code(response)
+            except Exception as exc:
+                self._record_attempt(trace, response, exc, host,
+                                     time.monotonic() - started, permit,
+                                     ticket)
+                delay = retry_state.next_delay(exc)
+                if delay is None:
+                    raise
+                tried.add(host)
+                await asyncio.sleep(delay)
+                continue
+
+            self._record_attempt(trace, response, host=host,
+                                 elapsed=time.monotonic() - started,
+                                 permit=permit, ticket=ticket)
+            break
+
+        trace.parse_started()
+        result_dict = self._parse_response(response)
+        trace.parsed(result_dict)
+        self._check_parsed_response_for_error_codes(result_dict)
+
+        return result_dict
+
+    async def close(self):
+        """
+        Closes the transport's pooled connections.
+        """
+        await self.transport.close()
@@ -2,24 +2,40 @@
 Client classes for Direct Mode services.
 """
 
-import urlparse
-import requests
+import time
 
-from bluefin.directmode.exceptions import V3ClientInputException, V3ClientProcessingException, V3ClientException, V3ClientDeclinedException
+from bluefin.batch import run_parallel
+from bluefin.clientbase import AttemptGuard
+from bluefin.compat import monotonic as _clock
+from bluefin.directmode.declines import DECLINE_STATUS_CODES, decline_message
+from bluefin.instrumentation import start_trace
+from bluefin.parsing import FORM_HEADERS, encode_form, parse_response
+from bluefin.retry import RetryPolicy
+from bluefin.routing import EndpointRouter
+from bluefin.directmode.exceptions import V3ClientInputException, V3ClientProcessingException, V3ClientException, V3ClientDeclinedException, V3ClientCircuitOpenException, V3ClientRateLimitedException
 
-class V3Client(object):
+
+class V3Client(AttemptGuard):
     """
     This is the class used to send API calls and receive responses through for
     the V3.x Direct Mode API client.
     """
+    circuit_open_exception = V3ClientCircuitOpenException
+    rate_limited_exception = V3ClientRateLimitedException
+
     def __init__(self, host='https://secure.bluefingateway.com:1402',
                  path='/gw/sas/direct3.1', http_timeout=15,
-                 account_id=None, dynip_sec_code=None, max_retries=3):
+                 account_id=None, dynip_sec_code=None, max_retries=3,
+                 transport=None, retry_policy=None, circuit_breaker=None,
+                 listeners=None, idempotency=None, result_class=None,
+                 validator=None, router=None, limiter=None):
         """
         Instantiates our API interface with sensible defaults.
 
         :keyword str host: Full URI to the API gateway, including protocol,
-            hostname, and port. No trailing slash.
+            hostname, and port. No trailing slash. May also be a list of
+            them, to spread requests over several endpoints and fail over
+            between them. See :py:class:`bluefin.routing.EndpointRouter`.
         :keyword str path: The path to the API endpoint.
         :keyword int http_timeout: Socket timeout in seconds. This is globally
             applied, so be careful.
@@ -30,38 +46,215 @@ class V3Client(object):
             value here means you don't have to pass it with each value dict
             to :py:meth:`send_request`.
         :keyword int max_retries: Maximum number of retries in the event we
-            run into a retryable error.
+            run into a retryable error. Ignored if ``retry_policy`` is given.
+        :keyword bluefin.transport.HTTPTransport transport: The pooled HTTP
+            transport to send requests through. Pass the same instance to
+            several clients to have them share a connection pool. If not
+            specified, the client creates its own.
+        :keyword bluefin.retry.RetryPolicy retry_policy: Decides what gets
+            retried, and how. If not specified, HTTP 408's and failures to
+            connect are retried up to ``max_retries`` times, with jittered
+            exponential backoff. With several hosts, retries go to a
+            different one. Anything that may have reached the gateway
+            isn't retried, to avoid double charges.
+        :keyword bluefin.circuitbreaker.CircuitBreaker circuit_breaker: If
+            given, requests fail fast with V3ClientCircuitOpenException
+            while the breaker is open.
+        :keyword list listeners: Callables that are sent a
+            :py:class:`bluefin.instrumentation.RequestEvent` after every
+            attempt, and once more at the end of each call. See
+            :py:mod:`bluefin.instrumentation`.
+        :keyword bluefin.directmode.idempotency.IdempotencyCache idempotency:
+            If given, duplicate submissions get the original's result (or
+            wait for it, if it's still in flight) instead of going to the
+            gateway again. See the ``idempotency_key`` argument to
+            :py:meth:`send_request`.
+        :keyword type result_class: If given, :py:meth:`send_request`
+            returns instances of this class, built from the response dict,
+            instead of the dict itself. See
+            :py:class:`bluefin.directmode.results.V3Result`, which takes a
+            fraction of a dict's memory and has typed accessors.
+        :keyword bluefin.directmode.validation.Validator validator: If
+            given, requests are checked before they're sent, and obviously
+            bad ones fail right away, without a round trip to the gateway.
+        :keyword bluefin.routing.EndpointRouter router: Picks the endpoint
+            for each attempt. Pass one to tune the routing, or to share it
+            between clients. Its hosts are used instead of ``host``.
+        :keyword bluefin.ratelimit.RateLimiter limiter: If given, every
+            attempt waits for a permit from it first, and requests fail with
+            V3ClientRateLimitedException if none comes within its
+            ``max_wait``. Share one between clients to limit them as a
+            whole.
         """
 
-        # Default to the HTTPS endpoint.
+        # Default to the HTTPS endpoint. Sets up self.router, if there are
+        # several.
         self.host = host
+        if router is not None:
+            self.router = router
         # Default to the Transaction interface.
         self.path = path
         # Note that this is applied globally, so be careful.
         self.http_timeout = http_timeout
         # Maximum number of retries in the event we run into a retryable error.
         self.max_retries = max_retries
+        # Connections are pooled and re-used across calls (and threads).
+        # The default transport and retry policy need requests, which is
+        # slow to import, so they're only built on first use.
+        self._transport = transport
+        self._retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.listeners = list(listeners or [])
+        self.idempotency = idempotency
+        self.result_class = result_class
+        self.validator = validator
+        self.limiter = limiter
 
         self.default_values = {}
+        # The encoded defaults, and the defaults they were encoded from. See
+        # _encode_body().
+        self._encoded_defaults = ({}, frozenset(), b'')
 
         if account_id:
             self.default_values['account_id'] = account_id
         if dynip_sec_code:
             self.default_values['dynip_sec_code'] = dynip_sec_code
 
-    def _get_endpoint(self):
+    def _default_retry_policy(self, max_retries):
+        """
+        Builds the retry policy used when none is passed in.
+
+        :rtype: bluefin.retry.RetryPolicy
+        """
+        from requests.exceptions import ConnectTimeout
+        from bluefin.transport import ConnectError
+
+        # 408's are often network related, and are safe to retry. So are
+        # connection timeouts and refused connections, since the request
+        # never made it out.
+        return RetryPolicy(max_retries=max_retries, retry_statuses=(408,),
+                           retry_exceptions=(ConnectTimeout, ConnectError))
+
+    @property
+    def transport(self):
+        transport = self._transport
+        if transport is None:
+            from bluefin.transport import HTTPTransport
+            transport = self._transport = HTTPTransport()
+        return transport
+
+    @transport.setter
+    def transport(self, transport):
+        self._transport = transport
+
+    @property
+    def retry_policy(self):
+        retry_policy = self._retry_policy
+        if retry_policy is None:
+            retry_policy = self._retry_policy = \
+                self._default_retry_policy(self.max_retries)
+        return retry_policy
+
+    @retry_policy.setter
+    def retry_policy(self, retry_policy):
+        self._retry_policy = retry_policy
+
+    def _default_router(self, hosts):
+        """
+        Builds the router used when ``host`` is a list.
+
+        :rtype: bluefin.routing.EndpointRouter
+        """
+        return EndpointRouter(hosts)
+
+    def add_listener(self, listener):
+        """
+        Adds a callable to send :py:class:`bluefin.instrumentation.RequestEvent`
+        objects to. See the ``listeners`` keyword.
+        """
+        self.listeners.append(listener)
+
+    @property
+    def host(self):
+        return self._host
+
+    @host.setter
+    def host(self, host):
+        self._host = host
+        self._endpoints = {}
+        if isinstance(host, (list, tuple)):
+            self.router = self._default_router(host)
+        else:
+            self.router = None
+
+    @property
+    def path(self):
+        return self._path
+
+    @path.setter
+    def path(self, path):
+        self._path = path
+        self._endpoints = {}
+
+    def _get_endpoint(self, host=None):
         """
         urllib2.Request wants a full URI with protocol, host, and path.
-        Assemble the proto+host+path into a URI to request.
+        Assemble the proto+host+path into a URI to request. This is only done
+        once per host, until the host or path change.
+
+        :keyword str host: The host to send to. Defaults to ``self.host``.
+        """
+        if host is None:
+            host = self.host
+        endpoint = self._endpoints.get(host)
+        if endpoint is None:
+            endpoint = self._endpoints[host] = '%s%s' % (host, self.path)
+        return endpoint
+
+    def _get_all_values(self, values):
+        """
+        :param dict values: The values passed to :py:meth:`send_request`.
+        :rtype: dict
+        :returns: The values merged over the client's defaults.
+        """
+        # Copy the default values dict so we don't have to repeat stuff like
+        # account_id and dynip_sec_code for every request.
+        all_values = self.default_values.copy()
+        # The transaction values can override the defaults.
+        all_values.update(values)
+        return all_values
+
+    def _encode_body(self, values):
+        """
+        Form-encodes a request's values, along with the client's defaults.
+        The defaults never change between requests, so they're only encoded
+        once, and the rest is tacked on.
+
+        :param dict values: The values passed to :py:meth:`send_request`.
+        :rtype: bytes
         """
-        return '%s%s' % (self.host, self.path)
+        snapshot, default_keys, encoded_defaults = self._encoded_defaults
+        if self.default_values != snapshot:
+            # First request, or someone changed the defaults.
+            snapshot = self.default_values.copy()
+            default_keys = frozenset(snapshot)
+            encoded_defaults = encode_form(snapshot)
+            self._encoded_defaults = (snapshot, default_keys, encoded_defaults)
+
+        if not default_keys.isdisjoint(values):
+            # Overriding a default. Rare enough to do it the slow way.
+            return encode_form(self._get_all_values(values))
+        encoded_values = encode_form(values)
+        if encoded_defaults and encoded_values:
+            return encoded_defaults + b'&' + encoded_values
+        return encoded_defaults or encoded_values
 
     def _check_for_error_http_status_code(self, response):
         """
         Checks the response's HTTP status code for common error code numbers.
 
         :param requests.Response response: A requests Response object generated
-            by requests.post().
+            by the transport.
         :raises: An appropriate bluefin.directmode.exceptions.V3ClientException
             sub-class, depending on the error.
         """
@@ -88,80 +281,172 @@ class V3Client(object):
 
         status_code = result_dict.get('status_code')
         # These are the two status codes that indicate issues.
-        if result_dict.get('status_code') in ['F', '0']:
-            reason_code = result_dict.get('reason_code2')
-            # There are multiple error fields to check. auth_msg is almost always
-            # the one to go by.
-            err_message = result_dict.get('auth_msg') or reason_code
-            # These errors don't tend to use HTTP status codes, so check the
-            # reason_code2 field.
-            exc_code = status_code or reason_code
-            raise V3ClientDeclinedException(err_message, error_code=exc_code)
-
-    def send_request(self, values):
+        if status_code in DECLINE_STATUS_CODES:
+            # The exception classifies the message. See
+            # bluefin.directmode.declines.
+            raise V3ClientDeclinedException(decline_message(result_dict),
+                                            error_code=status_code)
+
+    def _parse_response(self, response):
+        """
+        Parses the urlencoded body that Bluefin sends back.
+
+        :param response: The response object returned by the transport.
+        :rtype: dict
+        :returns: A flat dict of the response's key/value pairs.
+        """
+        # Repeated keys should be rare, but they have their values joined
+        # with commas, just in case.
+        return parse_response(response.content)
+
+    def send_request(self, values, idempotency_key=None):
         """
         Sends an API request. You are on your own to pass in the correct
         key/value pairs as a dict in the ``values`` argument.
 
         :param dict values: Key/value pairs for your desired API call. See
             the Bluefin documentation for what these should be.
+        :keyword str idempotency_key: Identifies the request (an order
+            number, say) to the client's ``idempotency`` cache, so that a
+            re-submission isn't sent to the gateway twice. Without one,
+            requests are matched on their values, unless the cache is set
+            up otherwise. Ignored if the client has no cache.
         :rtype: dict
         :returns: A dict of output from the API server. See the Bluefin API
-            docs for how to interpret this.
+            docs for how to interpret this. If the client has a
+            ``result_class``, an instance of that instead.
         :raises: V3ClientInputException when the Bluefin API says we have
             an input error, and V3ClientProcessingException when the Bluefin
             API encounters an error during processing. The lower level
-            urllib2 may raise urllib2.HTTPError exceptions also.
+            requests library may raise its own exceptions also.
         """
 
-        # Copy the default values dict so we don't have to repeat stuff like
-        # account_id and dynip_sec_code for every request.
-        all_values = self.default_values.copy()
-        # The transaction values can override the defaults.
-        all_values.update(values)
+        if self.validator is None and self.idempotency is None and \
+                not self.listeners:
+            # Nothing needs the defaults merged in, so don't bother.
+            all_values = values
+        else:
+            all_values = self._get_all_values(values)
+
+        if self.validator is not None:
+            # Fails fast on obviously bad input.
+            self.validator(all_values)
+
+        body = self._encode_body(values)
+
+        if self.idempotency is not None:
+            result_dict = self.idempotency.call(
+                all_values, lambda: self._traced_send(all_values, body),
+                idempotency_key=idempotency_key)
+        else:
+            result_dict = self._traced_send(all_values, body)
+
+        if self.result_class is not None:
+            return self.result_class(result_dict)
+        return result_dict
+
+    def _traced_send(self, all_values, body):
+        """
+        Wraps :py:meth:`_send` in a :py:class:`bluefin.instrumentation.RequestTrace`.
 
-        retries = 0
-        response = None
+        :param dict all_values: The request's values, defaults included.
+        :param bytes body: The encoded request.
+        :rtype: dict
+        """
+        trace = start_trace(self.listeners, self.__class__.__name__, all_values)
+        try:
+            result_dict = self._send(body, trace)
+        except Exception as exc:
+            trace.finish(exc)
+            raise
+        trace.finish()
+
+        return result_dict
+
+    def _send(self, body, trace):
+        """
+        Does the actual sending, retrying, and parsing for
+        :py:meth:`send_request`. Retries send the exact same body.
+
+        :param bytes body: The encoded request.
+        :param trace: The call's :py:class:`bluefin.instrumentation.RequestTrace`.
+        :rtype: dict
+        """
+        retry_state = self.retry_policy.start()
+        tried = set()
         # I hate to retry within an infinite loop, but it avoids recursion,
         # and it works.
         while True:
-            response = requests.post(
-                self._get_endpoint(),
-                data=all_values,
-                timeout=self.http_timeout
-            )
-
-            # Looks at the HTTP status code and raises an exception if any of the
-            # known number ranges for errors are returned.
+            permit, ticket = self._acquire_permit()
+            host = self._choose_host(tried)
+            response = None
+            started = _clock()
             try:
-                self._check_for_error_http_status_code(response)
-            except V3ClientException, exc:
-                if retries >= self.max_retries:
-                    # We've exceeded the max number of retries. We don't need
-                    # to see what error this is, because we can't retry any more.
-                    raise
+                response = self.transport.post(
+                    self._get_endpoint(host),
+                    data=body,
+                    headers=FORM_HEADERS,
+                    timeout=retry_state.timeout(self.http_timeout)
+                )
 
-                if exc.error_code in [408, '408']:
-                    # 408's are often network related, and are safe to retry.
-                    # Increment the retry counter and jump back to the top
-                    # of the loop.
-                    retries += 1
-                    continue
-                else:
-                    # This is not a retryable error. Re-raise that sucker.
+                # Looks at the HTTP status code and raises an exception if any
+                # of the known number ranges for errors are returned.
+                self._check_for_error_http_status_code(response)
+            except Exception as exc:
+                self._record_attempt(trace, response, exc, host,
+                                     _clock() - started, permit, ticket)
+                delay = retry_state.next_delay(exc)
+                if delay is None:
+                    # This is not a retryable error, or we're out of retries.
+                    # Re-raise that sucker.
                     raise
+                # Fail over to another host, if there is one.
+                tried.add(host)
+                # Back off a bit, then jump back to the top of the loop.
+                time.sleep(delay)
+                continue
 
             # Nothing bad happened. Break the loop.
+            self._record_attempt(trace, response, host=host,
+                                 elapsed=_clock() - started, permit=permit,
+                                 ticket=ticket)
             break
 
-        result_dict = urlparse.parse_qs(response.text)
-        for key, value in result_dict.items():
-            # Strip away the lists from the value, since these should all just
-            # be a one-member list. We'll join with commas just in case.
-            result_dict[key] = ','.join(value)
+        trace.parse_started()
+        result_dict = self._parse_response(response)
+        trace.parsed(result_dict)
 
         # Looks through the parsed response dict for common error codes. Raises
         # exceptions if any are found.
         self._check_parsed_response_for_error_codes(result_dict)
 
-        return result_dict
\ No newline at end of file
+        return result_dict
+
+    def send_batch(self, values_iter, concurrency=4, ordered=True):
+        """
+        Sends many API requests in parallel, over this client's connection
+        pool. For best results, the transport's ``pool_maxsize`` should be
+        at least ``concurrency``.
+
+        This is a generator. Values are pulled from ``values_iter`` as
+        workers free up, and results are yielded as they come in, so batches
+        of any size run in constant memory. A failed request (a decline, for
+        example) doesn't stop the rest of the batch. Its exception is
+        captured in its result instead.
+
+            >>> for item in api.send_batch(charges, concurrency=8):
+            ...     if item.ok:
+            ...         print item.result['trans_id']
+            ...     else:
+            ...         print item.exception
+
+        :param values_iter: An iterable of value dicts, as you'd pass to
+            :py:meth:`send_request`.
+        :keyword int concurrency: Number of requests to have in flight.
+        :keyword bool ordered: If True, results are yielded in input order.
+            If False, they're yielded as they complete.
+        :rtype: generator
+        :returns: A :py:class:`bluefin.batch.BatchResult` per value dict.
+        """
+        return run_parallel(self.send_request, values_iter,
+                            concurrency=concurrency, ordered=ordered)
@@ -0,0 +1,187 @@
+"""
+Classification of Direct Mode declines. Bluefin says why a charge was
+declined in the response's ``auth_msg`` (or ``reason_code2``), as free-form
+text that starts with a well-known prefix. This maps those prefixes to a
+category you can aggregate on, whether retrying might help, and a message
+fit to show the customer.
+
+    >>> decline = classify('CVV2 MISMATCH')
+    >>> decline.category
+    'security_code'
+
+The table is compiled into a prefix tree, so a lookup costs one step per
+character of the matching prefix, however many rules there are. Add your
+own rules with :py:meth:`DeclineClassifier.add`.
+"""
+import threading
+
+# The 'status_code' values of a declined (0) or failed (F) charge.
+DECLINE_STATUS_CODES = frozenset(['0', 'F'])
+
+# Categories.
+DECLINED = 'declined'
+INVALID_CARD = 'invalid_card'
+SECURITY_CODE = 'security_code'
+INVALID_INPUT = 'invalid_input'
+EXPIRED_CARD = 'expired_card'
+UNKNOWN = 'unknown'
+
+
+class Decline(object):
+    """
+    What a decline message means. Instances are shared between lookups, so
+    don't change them.
+    """
+    __slots__ = ('prefix', 'category', 'retryable', 'message')
+
+    def __init__(self, prefix, category, retryable=False, message=None):
+        # The start of the messages this applies to.
+        self.prefix = prefix
+        self.category = category
+        # Whether sending the same request again might go through.
+        self.retryable = retryable
+        # A friendlier message to show the customer, or None to show the
+        # gateway's.
+        self.message = message
+
+    def __repr__(self):
+        return '<Decline %r: %s>' % (self.prefix, self.category)
+
+
+# The fallback, for messages that match no rule.
+UNCLASSIFIED = Decline('', UNKNOWN)
+
+DEFAULT_RULES = (
+    Decline('CVV2', SECURITY_CODE, message=(
+        "The Card Security Code that was provided is invalid. Please check "
+        "the three-digit security code on the back of your card and try "
+        "again.")),
+    Decline('INVALID CARD NO', INVALID_CARD, message=(
+        "The credit card number that was provided is invalid. Please "
+        "re-enter and try again.")),
+    Decline('CVD', INVALID_INPUT, message=(
+        "Invalid card number, security code, or other value. Please check "
+        "your input and try again.")),
+    Decline('C/DECLINED', DECLINED, message="Your payment was declined."),
+    Decline('AUTH DECLINED', DECLINED, message="Your payment was declined."),
+    Decline('EXPIRED CARD', EXPIRED_CARD),
+)
+
+
+class DeclineClassifier(object):
+    """
+    Maps decline messages to :py:class:`Decline` objects, by the longest
+    rule prefix they start with. Prefixes are matched case-insensitively.
+
+    Rules may be added at any time, even while other threads are classifying
+    with the same instance.
+    """
+    def __init__(self, rules=DEFAULT_RULES, default=UNCLASSIFIED):
+        """
+        :keyword rules: The :py:class:`Decline` objects to start with.
+        :keyword Decline default: What messages that match no rule get.
+        """
+        self.default = default
+        self._lock = threading.Lock()
+        # Each node is a (children, decline) pair, children keyed by
+        # character. The decline is None if no rule ends at the node.
+        self._root = ({}, None)
+        self._rules = {}
+        for rule in rules:
+            self.add_rule(rule)
+
+    def add(self, prefix, category, retryable=False, message=None):
+        """
+        Adds a rule, replacing any with the same prefix.
+
+        :param str prefix: The start of the messages the rule applies to.
+        :param str category: The category to put them in.
+        :keyword bool retryable: Whether sending the same request again
+            might go through.
+        :keyword str message: A friendlier message to show the customer.
+        :rtype: Decline
+        """
+        rule = Decline(prefix, category, retryable, message)
+        self.add_rule(rule)
+        return rule
+
+    def add_rule(self, rule):
+        """
+        Adds a :py:class:`Decline`, replacing any with the same prefix.
+        """
+        prefix = rule.prefix.upper()
+        if not prefix:
+            raise ValueError("A rule needs a prefix.")
+        with self._lock:
+            node = self._root
+            for char in prefix[:-1]:
+                children = node[0]
+                child = children.get(char)
+                if child is None:
+                    child = children[char] = ({}, None)
+                node = child
+            children = node[0]
+            last = prefix[-1]
+            child = children.get(last)
+            # Nodes are swapped in whole, so readers never see one
+            # half-built.
+            children[last] = (child[0] if child is not None else {}, rule)
+            self._rules[prefix] = rule
+
+    @property
+    def rules(self):
+        """
+        The rules, in no particular order.
+
+        :rtype: list
+        """
+        with self._lock:
+            return list(self._rules.values())
+
+    def classify(self, message):
+        """
+        :param str message: A decline's ``auth_msg`` or ``reason_code2``.
+        :rtype: Decline
+        :returns: The rule with the longest prefix that ``message`` starts
+            with, or :py:attr:`default`.
+        """
+        decline = self.default
+        if not message:
+            return decline
+        node = self._root
+        for char in message:
+            node = node[0].get(char) or node[0].get(char.upper())
+            if node is None:
+                break
+            if node[1] is not None:
+                decline = node[1]
+        return decline
+
+    def classify_response(self, result_dict):
+        """
+        Classifies a parsed Direct Mode response, the way the clients do
+        before raising V3ClientDeclinedException.
+
+        :param dict result_dict: The parsed response.
+        :rtype: Decline or None
+        :returns: What the decline means, or None if it wasn't declined.
+        """
+        if result_dict.get('status_code') not in DECLINE_STATUS_CODES:
+            return None
+        return self.classify(decline_message(result_dict))
+
+
+def decline_message(result_dict):
+    """
+    :param dict result_dict: A parsed, declined Direct Mode response.
+    :rtype: str
+    :returns: The message explaining why. There are multiple fields to
+        check, but ``auth_msg`` is almost always the one to go by.
+    """
+    return result_dict.get('auth_msg') or result_dict.get('reason_code2')
+
+
+# The classifier used by V3ClientDeclinedException. Add rules to it to
+# change how declines are classified everywhere.
+classifier = DeclineClassifier()
+classify = classifier.classify
@@ -1,6 +1,9 @@
 """
 Exception classes for Direct Mode API operations.
 """
+from bluefin.directmode import declines
+
+
 class V3ClientException(Exception):
     """
     Used to denote some kind of generic error. This does not include errors
@@ -56,12 +59,72 @@ class V3ClientProcessingException(V3ClientException):
     pass
 
 
+class V3ClientCircuitOpenException(V3ClientException):
+    """
+    Raised without contacting the gateway when the client's circuit breaker
+    is open, after too many consecutive failures. See
+    :py:class:`bluefin.circuitbreaker.CircuitBreaker`.
+    """
+
+    pass
+
+
+class V3ClientRateLimitedException(V3ClientException):
+    """
+    Raised without contacting the gateway when the client's rate limiter
+    has no permit to give within its ``max_wait``. See
+    :py:class:`bluefin.ratelimit.RateLimiter`.
+    """
+
+    pass
+
+
+class V3ClientOutcomeUnknownException(V3ClientException):
+    """
+    The outcome of a queued submission whose request may or may not have
+    been processed by the gateway: it timed out, got a 5xx, or was in
+    flight when the process stopped. It's never sent again automatically.
+    See :py:class:`bluefin.directmode.submissions.SubmissionQueue`.
+    """
+
+    pass
+
+
 class V3ClientDeclinedException(V3ClientProcessingException):
     """
     Bluefin has a wonky additional 'status_code' return value that is used
     separately from HTTP status codes. These look to all be authorization
     related so far.
+
+    The message is classified by :py:mod:`bluefin.directmode.declines`.
+    See :py:attr:`category` and :py:attr:`retryable`.
     """
+    # The bluefin.directmode.declines.DeclineClassifier to use. None means
+    # the module's shared one.
+    classifier = None
+
+    def __init__(self, message, error_code=None, *args):
+        classifier = self.classifier
+        if classifier is None:
+            classifier = declines.classifier
+        # What the message means. Looked up once, here.
+        self.decline = classifier.classify(message)
+        V3ClientProcessingException.__init__(self, message, error_code, *args)
+
+    @property
+    def category(self):
+        """
+        The kind of decline, to aggregate on. One of the category
+        constants in :py:mod:`bluefin.directmode.declines`, or your own.
+        """
+        return self.decline.category
+
+    @property
+    def retryable(self):
+        """
+        Whether sending the same request again might go through.
+        """
+        return self.decline.retryable
 
     def clean_error_message(self, message):
         """
@@ -77,19 +140,4 @@ class V3ClientDeclinedException(V3ClientProcessingException):
             # Can't do much here.
             return message
 
-        if message.startswith("CVV2"):
-            return "The Card Security Code that was provided is invalid. " \
-                   "Please check the three-digit security code on the back of " \
-                   "your card and try again."
-        elif message.startswith("INVALID CARD NO"):
-            return "The credit card number that was provided is invalid. Please "\
-                   "re-enter and try again."
-        elif message.startswith("CVD"):
-            return "Invalid card number, security code, or other value. Please " \
-                   "check your input and try again."
-        elif message.startswith("C/DECLINED"):
-            return "Your payment was declined."
-        elif message.startswith("AUTH DECLINED"):
-            return "Your payment was declined."
-
-        return message
\ No newline at end of file
+        return self.decline.message or message
@@ -0,0 +1,226 @@
+"""
+De-duplication of Direct Mode requests, so that re-submitting an order (after
+a worker crash, say) doesn't charge the customer twice.
+"""
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+from bluefin.cache import TTLCache
+from bluefin.directmode import exceptions
+
+# Outcomes that are the gateway's final word on a request. Sending the same
+# request again would just get the same answer (or worse, a second charge).
+DEFINITIVE_EXCEPTIONS = (
+    exceptions.V3ClientDeclinedException,
+    exceptions.V3ClientInputException,
+)
+
+# Marks a request that's being worked on, possibly in another process.
+PENDING = 'pending'
+DONE = 'done'
+
+
+class IdempotencyCache(object):
+    """
+    Remembers the outcome of recent Direct Mode requests. When a request
+    comes in that matches one already in flight, it waits for that one's
+    outcome instead of going to the gateway. When it matches one that has
+    completed within the last ``ttl`` seconds, it gets that one's outcome
+    right away.
+
+    Requests are matched on the ``idempotency_key`` passed to
+    :py:meth:`V3Client.send_request`, or, if there's none (and
+    ``use_fingerprints`` is on), on a hash of all of the request's values.
+
+        >>> api = V3Client(idempotency=IdempotencyCache(ttl=3600))
+        >>> api.send_request(values, idempotency_key='order-1234')
+        >>> api.send_request(values, idempotency_key='order-1234')  # Cached.
+
+    Approvals, declines and input errors are cached. Errors that leave the
+    outcome unknown (timeouts, connection errors, 5xx's) are not, so the
+    request may be tried again.
+
+    Outcomes are kept in a :py:class:`bluefin.cache.TTLCache` by default,
+    which only de-duplicates within the process. To de-duplicate across
+    processes, pass a ``backend`` shared between them, with the same
+    ``get``/``set``/``add``/``delete`` methods. Everything stored in it is
+    made of plain dicts, strings and numbers, and can be serialized as JSON.
+
+    Card numbers have too little entropy for a plain hash to hide them, so
+    fingerprints are keyed with a ``secret``. The default backend gets a
+    random one. A shared backend needs one passed in, the same in every
+    process, unless ``use_fingerprints`` is off.
+    """
+    key_prefix = 'bluefin:idempotency:'
+
+    def __init__(self, ttl=600, max_entries=10000, backend=None,
+                 use_fingerprints=True, pending_ttl=120, poll_interval=0.05,
+                 secret=None):
+        """
+        :keyword float ttl: Seconds to remember completed requests for.
+        :keyword int max_entries: Most requests to remember, when using the
+            default in-process backend.
+        :keyword backend: A shared cache to store outcomes in. Defaults to an
+            in-process :py:class:`bluefin.cache.TTLCache`.
+        :keyword bool use_fingerprints: If True, requests without an
+            idempotency key are matched on all of their values. If False,
+            they aren't de-duplicated at all. Note that two genuinely
+            separate charges of the same amount to the same card look
+            identical, so turn this off if that's a legitimate use case.
+        :keyword float pending_ttl: Seconds to wait on a request that's in
+            flight in another process before giving up on it. Should be
+            longer than your worst-case request time, retries included.
+        :keyword float poll_interval: Seconds between checks on a request
+            that's in flight in another process.
+        :keyword secret: The key for fingerprint hashes (bytes or text). To
+            de-duplicate across processes, they all need the same one. Keep
+            it out of the shared backend. Defaults to a random one when
+            using the default backend.
+        :raises: ValueError if there's a ``backend`` and ``use_fingerprints``
+            is on, but there's no ``secret``.
+        """
+        self.ttl = ttl
+        self.backend = backend if backend is not None else TTLCache(max_entries)
+        self.use_fingerprints = use_fingerprints
+        self.pending_ttl = pending_ttl
+        self.poll_interval = poll_interval
+        if secret is None:
+            if backend is not None and use_fingerprints:
+                raise ValueError(
+                    "A shared backend needs a secret to key fingerprints "
+                    "with, or use_fingerprints=False.")
+            # Nothing outside this process needs to match our fingerprints.
+            secret = os.urandom(16)
+        elif not isinstance(secret, bytes):
+            secret = secret.encode('utf-8')
+        self._secret = secret
+
+        self._lock = threading.Lock()
+        # key -> threading.Event, for requests in flight in this process.
+        self._in_flight = {}
+
+    def fingerprint(self, values):
+        """
+        :param dict values: A request's values, defaults included.
+        :rtype: str
+        :returns: A keyed hash identifying requests with these exact values.
+        """
+        digest = hmac.new(self._secret, digestmod=hashlib.sha256)
+        for key in sorted(values):
+            digest.update(('%s=%s\n' % (key, values[key])).encode('utf-8'))
+        return digest.hexdigest()
+
+    def make_key(self, values, idempotency_key=None):
+        """
+        :rtype: str or None
+        :returns: The cache key for a request, or None if it shouldn't be
+            de-duplicated.
+        """
+        if idempotency_key is not None:
+            return '%skey:%s' % (self.key_prefix, idempotency_key)
+        if self.use_fingerprints:
+            return '%sfp:%s' % (self.key_prefix, self.fingerprint(values))
+        return None
+
+    def call(self, values, func, idempotency_key=None):
+        """
+        Calls ``func()`` to send a request, unless there's a matching one in
+        flight or in the cache.
+
+        :param dict values: The request's values, defaults included.
+        :param callable func: Sends the request, returning the result dict.
+        :keyword idempotency_key: The caller's key for the request.
+        :returns: The result dict, ours or the matching request's.
+        :raises: Whatever the request (ours or the matching one) raised.
+        """
+        key = self.make_key(values, idempotency_key)
+        if key is None:
+            return func()
+
+        while True:
+            # The backend may be remote, so it's only ever called without
+            # the lock held.
+            with self._lock:
+                event = self._in_flight.get(key)
+                if event is None:
+                    # Claim it within this process first, so that other
+                    # threads here wait on us rather than poll the backend.
+                    ours = self._in_flight[key] = threading.Event()
+
+            if event is None:
+                try:
+                    outcome = self.backend.get(key)
+                    claimed = outcome is None and self.backend.add(
+                        key, {'state': PENDING}, self.pending_ttl)
+                except BaseException:
+                    self._release(key)
+                    raise
+                if claimed:
+                    # It's ours.
+                    break
+                # Done already, or in flight in another process. Wake
+                # anyone who queued up behind our claim.
+                self._release(key)
+
+            if event is not None:
+                # Someone in this process is on it. Wait for them.
+                event.wait()
+                outcome = self.backend.get(key)
+                if outcome is None or outcome['state'] != DONE:
+                    # They failed without an answer. Try again ourselves.
+                    continue
+                return self._replay(outcome)
+
+            if outcome is not None and outcome['state'] == DONE:
+                return self._replay(outcome)
+            # Someone in another process is on it.
+            time.sleep(self.poll_interval)
+
+        try:
+            result = func()
+        except DEFINITIVE_EXCEPTIONS as exc:
+            self._finish(key, {'state': DONE, 'exception': exc.__class__.__name__,
+                               'message': exc.raw_message,
+                               'error_code': exc.error_code})
+            raise
+        except BaseException:
+            # The outcome is unknown. Let the next attempt go through.
+            self._finish(key, None)
+            raise
+
+        self._finish(key, {'state': DONE, 'result': result})
+        return result
+
+    def _finish(self, key, outcome):
+        """
+        Records a request's outcome, and wakes up anyone waiting on it.
+        """
+        try:
+            if outcome is None:
+                self.backend.delete(key)
+            else:
+                self.backend.set(key, outcome, self.ttl)
+        finally:
+            self._release(key)
+
+    def _release(self, key):
+        """
+        Drops this process's claim on a key, and wakes up anyone waiting on
+        it.
+        """
+        with self._lock:
+            event = self._in_flight.pop(key)
+        event.set()
+
+    def _replay(self, outcome):
+        """
+        Returns a cached result, or raises a cached exception.
+        """
+        if 'exception' in outcome:
+            exc_class = getattr(exceptions, outcome['exception'])
+            raise exc_class(outcome['message'], error_code=outcome['error_code'])
+        # Hand out copies, so callers can't mess with each other's results.
+        return dict(outcome['result'])
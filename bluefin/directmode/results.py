@@ -0,0 +1,252 @@
+"""
+Compact, typed result objects for Direct Mode responses. See
+:py:class:`V3Result`.
+"""
+import datetime
+import decimal
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+# Marks a field that wasn't in the response.
+_MISSING = object()
+
+# Fields whose values come from a small set (currencies, processors...).
+# Equal values are shared between results instead of each having its own
+# copy.
+_SHARED_FIELDS = frozenset(['status_code', 'avs_code', 'cvv2_code',
+                            'settle_currency', 'processor', 'auth_msg'])
+_shared_values = {}
+# Stop sharing new values past this point, in case one of the fields turns
+# out not to be so small after all.
+_MAX_SHARED_VALUES = 4096
+
+
+def _share(value):
+    shared = _shared_values.get(value)
+    if shared is not None:
+        return shared
+    if len(_shared_values) < _MAX_SHARED_VALUES:
+        _shared_values[value] = value
+    return value
+
+
+class Status(object):
+    """
+    The meaning of a response's ``status_code``. Compare against the
+    constants on this class:
+
+        >>> result.status is Status.APPROVED
+        True
+
+    The test gateway approves with a code of its own, ``'T'``, which is
+    :py:attr:`TEST_APPROVED`. To check for either, use :py:attr:`approved`.
+    """
+    __slots__ = ('code', 'name', 'approved')
+
+    def __init__(self, code, name, approved=False):
+        self.code = code
+        self.name = name
+        # Whether the charge went through, for real or in test mode.
+        self.approved = approved
+
+    def __repr__(self):
+        return '<Status %s (%s)>' % (self.name, self.code)
+
+    @classmethod
+    def from_code(cls, code):
+        """
+        :param str code: A response's 'status_code'.
+        :rtype: Status
+        """
+        status = _STATUSES.get(code)
+        if status is None:
+            status = cls(code, 'UNKNOWN')
+        return status
+
+Status.APPROVED = Status('1', 'APPROVED', approved=True)
+Status.TEST_APPROVED = Status('T', 'TEST_APPROVED', approved=True)
+Status.DECLINED = Status('0', 'DECLINED')
+Status.FAILED = Status('F', 'FAILED')
+
+_STATUSES = dict((status.code, status) for status in
+                 (Status.APPROVED, Status.TEST_APPROVED, Status.DECLINED,
+                  Status.FAILED))
+
+
+class V3Result(object):
+    """
+    A read-only, dict-compatible Direct Mode response, that takes a fraction
+    of the memory of a plain dict. Use it by passing ``result_class=V3Result``
+    to :py:class:`bluefin.directmode.clients.V3Client`.
+
+    The usual response fields are kept in slots, and the (rare) others in a
+    dict on the side. Indexing, ``get()``, ``in``, iteration, ``items()``
+    and comparison to dicts all work as before, and give back the same
+    strings. It isn't a dict, though, so to hand it to ``json.dumps()`` and
+    the like, make a plain one with ``dict(result)`` or :py:meth:`as_dict`
+    (also known as ``to_dict()``). Results pickle as they are.
+
+    On top of that, there are typed accessors, converted when you ask for
+    them:
+
+        >>> result.amount
+        Decimal('1.00')
+        >>> result.authorized_at
+        datetime.datetime(2011, 1, 1, 12, 0)
+        >>> result.status is Status.APPROVED
+        True
+        >>> result.is_approved
+        True
+    """
+    fields = ('trans_id', 'status_code', 'auth_code', 'auth_msg', 'auth_date',
+              'avs_code', 'cvv2_code', 'ticket_code', 'settle_amount',
+              'settle_currency', 'processor', 'reason_code2')
+    __slots__ = fields + ('_extra',)
+    _field_set = frozenset(fields)
+
+    auth_date_format = '%Y-%m-%d %H:%M:%S'
+
+    def __init__(self, values=()):
+        """
+        :param values: A dict (or iterable of ``(key, value)`` pairs) of
+            response fields, as returned by the parser.
+        """
+        extra = None
+        if isinstance(values, Mapping):
+            values = values.items()
+        for key, value in values:
+            if key in _SHARED_FIELDS:
+                value = _share(value)
+            if key in self._field_set:
+                object.__setattr__(self, key, value)
+            else:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+        object.__setattr__(self, '_extra', extra)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("%s objects are read-only." %
+                             self.__class__.__name__)
+
+    def __reduce__(self):
+        # Slots without a __dict__ need a hand with pickling on Python 2.
+        return self.__class__, (self.as_dict(),)
+
+    def __getitem__(self, key):
+        if key in self._field_set:
+            value = getattr(self, key, _MISSING)
+        elif self._extra is not None:
+            value = self._extra.get(key, _MISSING)
+        else:
+            value = _MISSING
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        for key in self.fields:
+            if getattr(self, key, _MISSING) is not _MISSING:
+                yield key
+        if self._extra is not None:
+            for key in self._extra:
+                yield key
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def as_dict(self):
+        """
+        :rtype: dict
+        :returns: The result as a plain dict.
+        """
+        return dict(self.items())
+
+    to_dict = as_dict
+
+    def __eq__(self, other):
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return self.as_dict() == dict(other.items())
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.as_dict())
+
+    @property
+    def amount(self):
+        """
+        :rtype: decimal.Decimal or None
+        :returns: The settled amount, or None if there's none.
+        """
+        value = getattr(self, 'settle_amount', None)
+        if not value:
+            return None
+        return decimal.Decimal(value)
+
+    @property
+    def authorized_at(self):
+        """
+        :rtype: datetime.datetime or None
+        :returns: When the transaction was authorized, in the gateway's
+            time zone, or None if the response doesn't say.
+        """
+        value = getattr(self, 'auth_date', None)
+        if not value:
+            return None
+        return datetime.datetime.strptime(value, self.auth_date_format)
+
+    @property
+    def status(self):
+        """
+        :rtype: Status or None
+        :returns: What the 'status_code' means, or None if there's none.
+        """
+        value = getattr(self, 'status_code', None)
+        if value is None:
+            return None
+        return Status.from_code(value)
+
+    @property
+    def is_approved(self):
+        """
+        :rtype: bool
+        :returns: True if the charge was approved, by the live gateway or
+            the test one.
+        """
+        status = self.status
+        return status is not None and status.approved
+
+Mapping.register(V3Result)
@@ -0,0 +1,618 @@
+"""
+A durable local queue for Direct Mode submissions. During a gateway outage,
+callers can hand requests off and move on, instead of holding worker
+threads open or dropping orders. A background dispatcher sends them once
+the gateway is back.
+
+Queued requests are kept in a write-ahead journal: an append-only file with
+one record per line, which is replayed when the queue is opened again after
+a restart or a crash.
+
+.. warning:: The journal holds each request's values until its outcome has
+    been handled, card numbers and all. Keep it on local, access-controlled
+    storage, or pass a ``serializer`` that encrypts.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from bluefin.compat import monotonic as _clock, replace as _replace
+from bluefin.directmode import exceptions
+from bluefin.directmode.idempotency import DEFINITIVE_EXCEPTIONS
+from bluefin.ratelimit import RateLimiter
+
+logger = logging.getLogger('bluefin')
+
+# Submission states.
+PENDING = 'pending'
+# Handed to the client. It may have reached the gateway from here on.
+SENDING = 'sending'
+DONE = 'done'
+
+
+class Submission(object):
+    """
+    A handle on a queued request, returned by
+    :py:meth:`SubmissionQueue.submit`. Wait on it with :py:meth:`result`.
+    """
+    __slots__ = ('id', 'values', 'idempotency_key', 'state', 'outcome',
+                 'result_class', '_event')
+
+    def __init__(self, id, values, idempotency_key=None, result_class=None):
+        # Identifies the submission in the journal.
+        self.id = id
+        # The request's values. Dropped once it's done.
+        self.values = values
+        self.idempotency_key = idempotency_key
+        self.state = PENDING
+        # How it went, as stored in the journal. See _make_outcome().
+        self.outcome = None
+        self.result_class = result_class
+        self._event = threading.Event()
+
+    def done(self):
+        """
+        :rtype: bool
+        :returns: True if the submission has an outcome.
+        """
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        """
+        Waits for the submission's outcome.
+
+        :keyword float timeout: Most seconds to wait. None means no limit.
+        :rtype: bool
+        :returns: True if the submission is done.
+        """
+        return self._event.wait(timeout)
+
+    def result(self, timeout=None):
+        """
+        Waits for the submission's outcome, and returns the result or raises
+        the exception, just as :py:meth:`V3Client.send_request` would have.
+
+        :keyword float timeout: Most seconds to wait. None means no limit.
+        :rtype: dict
+        :returns: A dict of output from the API server, or an instance of
+            the client's ``result_class``.
+        :raises: V3ClientDeclinedException, V3ClientInputException and the
+            like, V3ClientOutcomeUnknownException if it isn't known whether
+            the gateway got the request, or V3ClientException if the
+            submission isn't done within ``timeout``.
+        """
+        if not self.wait(timeout):
+            raise exceptions.V3ClientException(
+                "Submission %s is still %s." % (self.id, self.state))
+        outcome = self.outcome
+        if 'exception' in outcome:
+            exc_class = getattr(exceptions, outcome['exception'],
+                                exceptions.V3ClientException)
+            raise exc_class(outcome['message'], error_code=outcome['error_code'])
+        # Hand out copies, so callers can't mess with each other's results.
+        result = dict(outcome['result'])
+        if self.result_class is not None:
+            return self.result_class(result)
+        return result
+
+    def __repr__(self):
+        return '<Submission %s: %s>' % (self.id, self.state)
+
+
+def _make_outcome(result=None, exc=None):
+    """
+    Turns the result of a call, or the exception it raised, into something
+    the journal can store.
+
+    :rtype: dict
+    """
+    if exc is None:
+        return {'result': dict(result)}
+    if isinstance(exc, DEFINITIVE_EXCEPTIONS):
+        return {'exception': exc.__class__.__name__,
+                'message': exc.raw_message, 'error_code': exc.error_code}
+    # A timeout, a 5xx... The request may or may not have been processed.
+    return {'exception': 'V3ClientOutcomeUnknownException',
+            'message': getattr(exc, 'raw_message', None) or str(exc),
+            'error_code': getattr(exc, 'error_code', None)}
+
+
+class SubmissionQueue(object):
+    """
+    Queues Direct Mode requests in a local journal, and sends them through
+    a client from a pool of background threads. :py:meth:`submit` returns
+    as soon as the request is safely on disk.
+
+        >>> submissions = SubmissionQueue(api, '/var/lib/billing/submissions.log',
+        ...                               rate=20, on_outcome=record_outcome)
+        >>> submission = submissions.submit(values, idempotency_key='order-1234')
+        >>> submission.result(timeout=30)
+
+    Each request reaches the gateway at most once, and gets exactly one
+    outcome, which is written to the journal before anyone hears about it.
+    A request that fails without reaching the gateway (a refused connection
+    or connection timeout, a 408, or the client's circuit breaker is open)
+    goes back to the head of the queue. The dispatcher then waits ``retry_interval``
+    seconds, doubling up to ``max_retry_interval``, and tries it alone
+    until one goes through. Then it carries on at up to ``rate`` requests
+    per second, so a backlog doesn't all hit the gateway at once.
+
+    A request that may have reached the gateway is never sent again. If it
+    failed in a way that leaves the outcome unknown (a read timeout, a 5xx,
+    or a crash while it was in flight), its outcome is
+    V3ClientOutcomeUnknownException, and it's up to you to reconcile it,
+    through the Data Retrieval API for instance.
+
+    Outcomes are passed to ``on_outcome`` (and to the submission's handle)
+    once each. One that's in the journal but wasn't handled before a crash
+    is passed to ``on_outcome`` again when the queue is next opened, so
+    ``on_outcome`` should cope with seeing a submission twice.
+
+    Journal writes from threads submitting at the same time are flushed to
+    disk with a single fsync, so the cost per request stays low under load.
+    Instances are thread-safe.
+    """
+    def __init__(self, client, path, rate=None, burst=None, concurrency=1,
+                 retry_interval=1.0, max_retry_interval=60.0,
+                 on_outcome=None, serializer=json, fsync=True,
+                 compact_after=10000, start=True):
+        """
+        :param V3Client client: The client to send requests through. Its
+            retry policy, circuit breaker and rate limiter all still apply.
+        :param str path: Path to the journal file. It's created if it
+            doesn't exist yet.
+        :keyword float rate: Most requests per second to send. None means
+            no limit.
+        :keyword float burst: Most requests that may be sent at once.
+            Defaults to ``rate``.
+        :keyword int concurrency: Number of dispatcher threads.
+        :keyword float retry_interval: Seconds to wait before trying again
+            after a request couldn't reach the gateway.
+        :keyword float max_retry_interval: Longest wait between tries during
+            an outage.
+        :keyword callable on_outcome: Called with each
+            :py:class:`Submission` once it's done, from a dispatcher thread.
+            If it raises, the outcome is passed to it again next time the
+            queue is opened.
+        :keyword serializer: Turns journal records into strings and back,
+            with ``dumps`` and ``loads`` functions, like the default
+            :py:mod:`json`. Each record must come out as a single line.
+        :keyword bool fsync: If False, journal writes aren't forced to disk,
+            and a power cut can lose recent submissions. Mostly for tests.
+        :keyword int compact_after: Journal records to write before
+            rewriting the journal without the submissions that are done with.
+        :keyword bool start: If False, requests aren't sent until
+            :py:meth:`start` is called.
+        """
+        self.client = client
+        self.path = path
+        self.concurrency = concurrency
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.on_outcome = on_outcome
+        self.serializer = serializer
+        self.fsync = fsync
+        self.compact_after = compact_after
+        # Just the token bucket, to pace the dispatcher.
+        self._pacer = RateLimiter(rate=rate, burst=burst, concurrency=None)
+
+        # Guards the submissions and the dispatcher's state.
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # Submissions that aren't done with, by ID, in submission order.
+        self._submissions = OrderedDict()
+        self._pending = deque()
+        self._in_flight = 0
+        # Consecutive failures to reach the gateway, when in an outage.
+        self._failures = 0
+        self._resume_at = None
+        self._probing = False
+        self._closed = False
+        self._threads = []
+
+        # Guards the journal file. Taken before _lock, never after.
+        self._write_lock = threading.Lock()
+        # Only one thread at a time fsyncs. See _sync().
+        self._sync_lock = threading.Lock()
+        self._written = 0
+        self._synced = 0
+        self._records = 0
+        # Recovered outcomes, for on_outcome.
+        self._undelivered = []
+
+        self._recover()
+        if start:
+            self.start()
+
+    def _encode(self, record):
+        line = self.serializer.dumps(record)
+        if not isinstance(line, bytes):
+            line = line.encode('utf-8')
+        return line + b'\n'
+
+    def _recover(self):
+        """
+        Replays the journal, then rewrites it with just what's left.
+        """
+        result_class = self.client.result_class
+        submissions = self._submissions
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as journal:
+                for line in journal:
+                    if not line.endswith(b'\n'):
+                        # Torn by a crash mid-write. Nobody was told it was
+                        # saved.
+                        break
+                    record = self.serializer.loads(line[:-1].decode('utf-8'))
+                    op = record['op']
+                    if op == 'submit':
+                        submissions[record['id']] = Submission(
+                            record['id'], record['values'], record.get('key'),
+                            result_class)
+                        continue
+                    submission = submissions.get(record['id'])
+                    if submission is None:
+                        continue
+                    if op == 'send':
+                        submission.state = SENDING
+                    elif op == 'unsent':
+                        submission.state = PENDING
+                    elif op == 'done':
+                        submission.state = DONE
+                        submission.outcome = record['outcome']
+                    elif op == 'ack':
+                        del submissions[record['id']]
+
+        for submission in submissions.values():
+            if submission.state == SENDING:
+                # We went down while it was in flight.
+                submission.state = DONE
+                submission.outcome = {
+                    'exception': 'V3ClientOutcomeUnknownException',
+                    'message': 'The process stopped while the request was '
+                               'in flight.',
+                    'error_code': None}
+            if submission.state == DONE:
+                submission.values = None
+                submission._event.set()
+                self._undelivered.append(submission)
+            else:
+                self._pending.append(submission)
+
+        self._file = open(self.path, 'ab')
+        self.compact()
+
+    def compact(self):
+        """
+        Rewrites the journal with just the submissions that aren't done
+        with. This happens by itself every ``compact_after`` records.
+        """
+        with self._sync_lock:
+            with self._write_lock:
+                with self._lock:
+                    submissions = list(self._submissions.values())
+                temp_path = self.path + '.tmp'
+                with open(temp_path, 'wb') as journal:
+                    for submission in submissions:
+                        journal.write(self._encode({
+                            'op': 'submit', 'id': submission.id,
+                            'values': submission.values,
+                            'key': submission.idempotency_key}))
+                        if submission.state == SENDING:
+                            journal.write(self._encode(
+                                {'op': 'send', 'id': submission.id}))
+                        elif submission.state == DONE:
+                            journal.write(self._encode({
+                                'op': 'done', 'id': submission.id,
+                                'outcome': submission.outcome}))
+                    journal.flush()
+                    if self.fsync:
+                        os.fsync(journal.fileno())
+                _replace(temp_path, self.path)
+                self._sync_directory()
+
+                self._file.close()
+                self._file = open(self.path, 'ab')
+                self._records = len(submissions)
+                # Everything written so far is in the new journal.
+                self._synced = self._written
+
+    def _sync_directory(self):
+        """
+        Makes the rename in :py:meth:`compact` stick.
+        """
+        if not self.fsync or not hasattr(os, 'O_DIRECTORY'):
+            return
+        fd = os.open(os.path.dirname(os.path.abspath(self.path)),
+                     os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _append(self, record, sync=False):
+        """
+        Writes a record to the journal.
+
+        :param dict record: The record.
+        :keyword bool sync: If True, waits until it's on disk.
+        """
+        line = self._encode(record)
+        with self._write_lock:
+            self._file.write(line)
+            self._written += 1
+            self._records += 1
+            sequence = self._written
+        if sync:
+            self._sync(sequence)
+
+    def _sync(self, sequence):
+        """
+        Waits until the journal is on disk up to the given record. Threads
+        that wrote while another was in fsync wait for it to finish, and
+        then the first of them fsyncs for all of them at once.
+
+        :param int sequence: The record's sequence number.
+        """
+        with self._sync_lock:
+            if self._synced >= sequence:
+                # Someone else's fsync covered us.
+                return
+            with self._write_lock:
+                self._file.flush()
+                written = self._written
+                fd = self._file.fileno()
+            if self.fsync:
+                os.fsync(fd)
+            self._synced = written
+
+    def start(self):
+        """
+        Starts the dispatcher threads, and passes any outcomes recovered
+        from the journal to ``on_outcome``.
+        """
+        with self._lock:
+            if self._threads or self._closed:
+                return
+            for i in range(self.concurrency):
+                thread = threading.Thread(target=self._dispatch_loop)
+                thread.daemon = True
+                self._threads.append(thread)
+            undelivered, self._undelivered = self._undelivered, []
+        for submission in undelivered:
+            self._deliver(submission)
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, values, idempotency_key=None):
+        """
+        Queues a request. Returns once it's safely in the journal.
+
+        :param dict values: Key/value pairs for the API call, as you'd pass
+            to :py:meth:`V3Client.send_request`.
+        :keyword str idempotency_key: Passed on to
+            :py:meth:`V3Client.send_request`.
+        :rtype: Submission
+        :returns: A handle on the request.
+        """
+        submission = Submission(uuid.uuid4().hex, dict(values),
+                                idempotency_key, self.client.result_class)
+        with self._lock:
+            if self._closed:
+                raise exceptions.V3ClientException(
+                    "The submission queue is closed.")
+            self._submissions[submission.id] = submission
+        self._append({'op': 'submit', 'id': submission.id,
+                      'values': submission.values, 'key': idempotency_key},
+                     sync=True)
+        with self._lock:
+            self._pending.append(submission)
+            self._wakeup.notify()
+        return submission
+
+    def get(self, submission_id):
+        """
+        Looks up a submission that isn't done with yet.
+
+        :param str submission_id: The submission's ID.
+        :rtype: Submission or None
+        """
+        with self._lock:
+            return self._submissions.get(submission_id)
+
+    def _next(self):
+        """
+        Waits for the next submission to send. During an outage, only one
+        is sent at a time, once the retry interval is up.
+
+        :rtype: Submission or None
+        :returns: The submission, or None if the queue is closing.
+        """
+        with self._lock:
+            while not self._closed:
+                if self._failures:
+                    wait = self._resume_at - _clock()
+                    if wait > 0:
+                        self._wakeup.wait(wait)
+                        continue
+                    if self._probing:
+                        self._wakeup.wait()
+                        continue
+                if self._pending:
+                    submission = self._pending.popleft()
+                    submission.state = SENDING
+                    self._in_flight += 1
+                    if self._failures:
+                        self._probing = True
+                    return submission
+                self._wakeup.wait()
+        return None
+
+    def _dispatch_loop(self):
+        while True:
+            submission = self._next()
+            if submission is None:
+                return
+            wait = self._pacer.reserve()
+            if wait:
+                time.sleep(wait)
+            try:
+                self._dispatch(submission)
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+                    self._wakeup.notify_all()
+
+    def is_unsent(self, exc):
+        """
+        :param Exception exc: The exception a request failed with.
+        :rtype: bool
+        :returns: True if the request certainly didn't reach the gateway,
+            and may be sent again: the connection couldn't be made, the
+            gateway answered with a 408, or the client's circuit breaker or
+            rate limiter stopped it. The client's retry policy doesn't come
+            into it, since it may well retry failures that aren't safe to
+            send again.
+        """
+        from requests.exceptions import ConnectTimeout
+        from bluefin.transport import ConnectError
+
+        if isinstance(exc, (ConnectTimeout, ConnectError,
+                            exceptions.V3ClientCircuitOpenException,
+                            exceptions.V3ClientRateLimitedException)):
+            return True
+        # The gateway gave up waiting for the request, and didn't process
+        # it.
+        return (isinstance(exc, exceptions.V3ClientException)
+                and exc.error_code == 408)
+
+    def _dispatch(self, submission):
+        """
+        Sends a submission, and records how it went.
+        """
+        # From here on, it may reach the gateway, and mustn't be sent again
+        # after a crash.
+        self._append({'op': 'send', 'id': submission.id}, sync=True)
+        try:
+            result = self.client.send_request(
+                submission.values, idempotency_key=submission.idempotency_key)
+        except Exception as exc:
+            if self.is_unsent(exc):
+                self._requeue(submission)
+                return
+            outcome = _make_outcome(exc=exc)
+        else:
+            outcome = _make_outcome(result)
+
+        with self._lock:
+            # The gateway's reachable.
+            self._failures = 0
+            self._probing = False
+            self._wakeup.notify_all()
+            submission.outcome = outcome
+            submission.state = DONE
+        self._append({'op': 'done', 'id': submission.id, 'outcome': outcome},
+                     sync=True)
+        submission.values = None
+        submission._event.set()
+        self._deliver(submission)
+
+    def _requeue(self, submission):
+        """
+        Puts a submission that didn't reach the gateway back at the head of
+        the queue, and backs off.
+        """
+        with self._lock:
+            submission.state = PENDING
+            self._pending.appendleft(submission)
+            self._failures += 1
+            self._resume_at = _clock() + min(
+                self.max_retry_interval,
+                self.retry_interval * 2 ** (self._failures - 1))
+            self._probing = False
+            self._wakeup.notify_all()
+        # If this is lost in a crash, the submission's outcome is unknown
+        # instead, which is safe. So there's no need to wait for the disk.
+        self._append({'op': 'unsent', 'id': submission.id})
+
+    def _deliver(self, submission):
+        """
+        Passes a submission's outcome to ``on_outcome``, then drops it from
+        the journal.
+        """
+        if self.on_outcome is not None:
+            try:
+                self.on_outcome(submission)
+            except Exception:
+                # It'll be passed on again when the journal is replayed.
+                logger.exception("Submission outcome handler %r failed.",
+                                 self.on_outcome)
+                return
+        with self._lock:
+            self._submissions.pop(submission.id, None)
+        self._append({'op': 'ack', 'id': submission.id})
+        if self._records >= self.compact_after:
+            self.compact()
+
+    def drain(self, timeout=None):
+        """
+        Waits until every queued submission has been sent.
+
+        :keyword float timeout: Most seconds to wait. None means no limit.
+        :rtype: bool
+        :returns: True if the queue is empty.
+        """
+        deadline = None if timeout is None else _clock() + timeout
+        with self._lock:
+            while self._pending or self._in_flight:
+                if deadline is None:
+                    self._wakeup.wait()
+                    continue
+                remaining = deadline - _clock()
+                if remaining <= 0:
+                    return False
+                self._wakeup.wait(remaining)
+            return True
+
+    def close(self, timeout=None):
+        """
+        Stops the dispatcher, once the requests in flight are done, and
+        closes the journal. Queued requests stay in the journal, to be sent
+        when it's next opened.
+
+        :keyword float timeout: Most seconds to wait for each dispatcher
+            thread.
+        """
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify_all()
+            threads = self._threads
+        for thread in threads:
+            thread.join(timeout)
+        with self._sync_lock:
+            with self._write_lock:
+                if self._file.closed:
+                    return
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(self._file.fileno())
+                self._file.close()
+
+    def snapshot(self):
+        """
+        Returns the queue's current state, for dashboards.
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'in_flight': self._in_flight,
+                'unacknowledged': len(self._submissions),
+                'outage': bool(self._failures),
+                'consecutive_failures': self._failures,
+            }
@@ -0,0 +1,244 @@
+"""
+Client-side validation of Direct Mode requests, to catch obviously bad ones
+(a missing card number, a mangled expiration date, a negative amount)
+without a round trip to the gateway. Pass a :py:class:`Validator` to
+:py:class:`bluefin.directmode.clients.V3Client`'s ``validator`` keyword.
+
+Failures raise the same exceptions the gateway's answer would have:
+V3ClientInputException for input errors, and V3ClientDeclinedException for
+card numbers that fail the Luhn check, and expired cards. Since the gateway
+never saw the request, their ``error_code`` is None.
+"""
+import datetime
+import re
+
+from bluefin.directmode.exceptions import V3ClientInputException, V3ClientDeclinedException
+
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
+
+_AMOUNT_RE = re.compile(r'^\d+(\.\d+)?$')
+_DIGITS_RE = re.compile(r'^\d+$')
+_EXPIRE_RE = re.compile(r'^(0[1-9]|1[0-2])(\d\d)$')
+
+# Digit sums of each digit doubled, for the Luhn check.
+_DOUBLED = (0, 2, 4, 6, 8, 1, 3, 5, 7, 9)
+
+
+def _text(value):
+    # Card numbers and amounts are often passed as numbers.
+    if isinstance(value, _string_types):
+        return value
+    return str(value)
+
+
+# Checks. Each is called with a field's name and value, and raises if the
+# value is no good.
+
+def amount(field, value):
+    """
+    A decimal amount that isn't negative, such as ``1.00``. Zero is allowed,
+    for card verifications.
+    """
+    value = _text(value)
+    if not _AMOUNT_RE.match(value):
+        raise V3ClientInputException(
+            "Invalid %s: %s. Must be an amount, such as 1.00." % (field, value))
+
+
+def positive_integer(field, value):
+    value = _text(value)
+    if not _DIGITS_RE.match(value) or not int(value):
+        raise V3ClientInputException(
+            "Invalid %s: %s. Must be a positive whole number." % (field, value))
+
+
+def card_number(field, value):
+    """
+    12 to 19 digits, passing the Luhn check.
+    """
+    digits = _text(value)
+    if not _DIGITS_RE.match(digits) or not 12 <= len(digits) <= 19:
+        raise V3ClientInputException("Invalid %s." % field)
+
+    total = 0
+    for position, digit in enumerate(reversed(digits)):
+        digit = ord(digit) - 48
+        total += _DOUBLED[digit] if position % 2 else digit
+    if total % 10:
+        # What the gateway says about these.
+        raise V3ClientDeclinedException("INVALID CARD NO")
+
+
+def card_expire(field, value):
+    """
+    A valid ``MMYY`` expiration date. Whether it's in the past is checked
+    by :py:func:`card_not_expired`.
+    """
+    if not _EXPIRE_RE.match(_text(value)):
+        raise V3ClientInputException(
+            "Invalid %s: %s. Must be in MMYY format." % (field, value))
+
+
+def card_not_expired(field, value):
+    """
+    An ``MMYY`` expiration date that isn't in the past.
+    """
+    match = _EXPIRE_RE.match(_text(value))
+    if match is None:
+        # Left to card_expire().
+        return
+    today = datetime.date.today()
+    year = 2000 + int(match.group(2))
+    if (year, int(match.group(1))) < (today.year, today.month):
+        raise V3ClientDeclinedException("EXPIRED CARD")
+
+
+class Schema(object):
+    """
+    The rules for one kind of request: the fields it requires, and the
+    checks to run on fields when they're present.
+
+        >>> Schema(required=('amount', 'trans_id'),
+        ...        checks={'amount': [amount]})
+    """
+    def __init__(self, required=(), checks=None):
+        """
+        :keyword required: Names of the fields that must be present and
+            non-blank.
+        :keyword dict checks: Maps field names to lists of checks. A check is
+            called with the field's name and value, and raises a
+            V3ClientException subclass if the value is no good.
+        """
+        self.required = tuple(required)
+        self.checks = dict((field, list(field_checks))
+                           for field, field_checks in (checks or {}).items())
+
+    def extend(self, required=(), checks=None):
+        """
+        :rtype: Schema
+        :returns: A copy of this schema, with more required fields and
+            checks.
+        """
+        merged = dict((field, list(field_checks))
+                      for field, field_checks in self.checks.items())
+        for field, field_checks in (checks or {}).items():
+            merged.setdefault(field, []).extend(field_checks)
+        return Schema(self.required + tuple(required), merged)
+
+    def compile(self):
+        """
+        Boils the schema down to a single function, so there's as little as
+        possible left to do per request.
+
+        :rtype: callable
+        :returns: A function that takes a request's values, and raises if
+            they're no good.
+        """
+        required = self.required
+        # Checks for required fields run unconditionally. The rest only run
+        # if the field's there.
+        checks = tuple((field, tuple(field_checks))
+                       for field, field_checks in sorted(self.checks.items())
+                       if field_checks)
+
+        def validate(values):
+            for field in required:
+                value = values.get(field)
+                if value is None or value == '':
+                    raise V3ClientInputException(
+                        "Missing required field: %s" % field)
+            for field, field_checks in checks:
+                value = values.get(field)
+                if value is None or value == '':
+                    continue
+                for check in field_checks:
+                    check(field, value)
+
+        return validate
+
+
+# Applies to every request.
+BASE_SCHEMA = Schema(
+    required=('pay_type', 'tran_type', 'account_id'),
+    checks={
+        'amount': [amount],
+        'recurring_amount': [amount],
+        'recurring_period': [positive_integer],
+        'card_number': [card_number],
+        'card_expire': [card_expire],
+    },
+)
+
+# Credit card authorizations and sales.
+CARD_CHARGE_SCHEMA = BASE_SCHEMA.extend(
+    required=('amount', 'card_number', 'card_expire'))
+
+
+class Validator(object):
+    """
+    Validates Direct Mode requests against a :py:class:`Schema` picked by
+    their ``pay_type`` and ``tran_type``. Each combination's schema is
+    compiled the first time it's seen, so a validation costs a few
+    microseconds.
+
+        >>> api = V3Client(validator=Validator())
+
+    Out of the box, credit card authorizations and sales (``pay_type`` C,
+    ``tran_type`` A or S) need an amount, card number and expiration date.
+    Everything else only gets the basic checks on whichever of those fields
+    it has. Add or replace schemas with :py:meth:`register`.
+    """
+    def __init__(self, schemas=None, reject_expired=True):
+        """
+        :keyword dict schemas: Maps ``(pay_type, tran_type)`` tuples to
+            schemas, on top of the defaults. Use None in either spot to
+            match any value.
+        :keyword bool reject_expired: If True, cards whose expiration date
+            has passed are declined without asking the gateway. Turn this
+            off if your test cards are expired.
+        """
+        self.reject_expired = reject_expired
+        self.schemas = {
+            (None, None): BASE_SCHEMA,
+            ('C', 'A'): CARD_CHARGE_SCHEMA,
+            ('C', 'S'): CARD_CHARGE_SCHEMA,
+        }
+        self.schemas.update(schemas or {})
+        # (pay_type, tran_type) -> compiled schema.
+        self._compiled = {}
+
+    def register(self, pay_type, tran_type, schema):
+        """
+        Sets the schema for a ``pay_type`` and ``tran_type``. Either can be
+        None, to match any value.
+        """
+        self.schemas[(pay_type, tran_type)] = schema
+        self._compiled.clear()
+
+    def _compile(self, key):
+        pay_type, tran_type = key
+        for candidate in (key, (pay_type, None), (None, tran_type), (None, None)):
+            schema = self.schemas.get(candidate)
+            if schema is not None:
+                break
+        if self.reject_expired:
+            schema = schema.extend(checks={'card_expire': [card_not_expired]})
+        validate = self._compiled[key] = schema.compile()
+        return validate
+
+    def validate(self, values):
+        """
+        :param dict values: A request's values, defaults included.
+        :raises: V3ClientInputException or V3ClientDeclinedException if the
+            request is no good.
+        """
+        key = (values.get('pay_type'), values.get('tran_type'))
+        validate = self._compiled.get(key)
+        if validate is None:
+            validate = self._compile(key)
+        validate(values)
+
+    __call__ = validate
@@ -0,0 +1,144 @@
+"""
+Hedged requests, to cut the tail latency of read-only calls. If a request
+hasn't been answered after a while, an identical one is sent alongside it,
+and whichever answers first wins.
+
+Only safe for requests that can be sent twice without harm, which is why
+only :py:class:`bluefin.dataretrieval.clients.V1Client` supports it. Direct
+Mode charges are never hedged.
+"""
+import bisect
+import threading
+from collections import deque
+
+from bluefin.retry import RetryBudget
+
+
+class HedgePolicy(object):
+    """
+    Decides when to hedge, and caps how often. Pass one to
+    :py:class:`bluefin.dataretrieval.clients.V1Client`'s ``hedge_policy``
+    keyword.
+
+        >>> api = V1Client(hedge_policy=HedgePolicy(percentile=95))
+
+    The hedge delay tracks the given percentile of recent response times,
+    so with the default of 95, about one call in twenty is hedged. A
+    :py:class:`bluefin.retry.RetryBudget` caps the extra load on top of that:
+    every call deposits ``budget.ratio`` tokens, and every hedge withdraws a
+    whole one. Instances are thread-safe, and may be shared between clients.
+    """
+    def __init__(self, percentile=95, initial_delay=0.5, min_delay=0.01,
+                 max_delay=None, window=1000, min_samples=20, budget=None,
+                 chunk_size=8192):
+        """
+        :keyword float percentile: The percentile of recent response times
+            to wait for before hedging, between 0 and 100.
+        :keyword float initial_delay: Seconds to wait before hedging, until
+            there are ``min_samples`` response times to go by.
+        :keyword float min_delay: Shortest delay, in seconds. Keeps a run of
+            quick responses from setting off a hedge for every call.
+        :keyword float max_delay: Longest delay, in seconds. None means no
+            limit.
+        :keyword int window: Number of recent response times to keep.
+        :keyword int min_samples: Response times needed before the
+            percentile is trusted.
+        :keyword bluefin.retry.RetryBudget budget: Caps the share of extra
+            requests. Defaults to 5% of calls, with bursts of up to 5.
+        :keyword int chunk_size: Bytes to read at a time. The losing request
+            is dropped between chunks.
+        """
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.window = window
+        self.min_samples = min_samples
+        self.budget = budget if budget is not None else RetryBudget(
+            ratio=0.05, capacity=5.0)
+        self.chunk_size = chunk_size
+
+        self._lock = threading.Lock()
+        # Recent response times, oldest first, and the same sorted.
+        self._samples = deque()
+        self._sorted = []
+        self._delay = None
+        # Lifetime totals, for dashboards.
+        self._calls = 0
+        self._hedges = 0
+        self._hedges_denied = 0
+
+    def record(self, elapsed):
+        """
+        Called with the response time of every request that completes.
+
+        :param float elapsed: Seconds from sending until the response body
+            was read.
+        """
+        with self._lock:
+            self._samples.append(elapsed)
+            bisect.insort(self._sorted, elapsed)
+            if len(self._samples) > self.window:
+                oldest = self._samples.popleft()
+                del self._sorted[bisect.bisect_left(self._sorted, oldest)]
+            self._delay = None
+
+    def delay(self):
+        """
+        :rtype: float
+        :returns: Seconds to wait for a response before hedging.
+        """
+        with self._lock:
+            delay = self._delay
+            if delay is None:
+                samples = self._sorted
+                if len(samples) < self.min_samples:
+                    delay = self.initial_delay
+                else:
+                    index = int(round((len(samples) - 1) * self.percentile / 100.0))
+                    delay = samples[index]
+                delay = max(self.min_delay, delay)
+                if self.max_delay is not None:
+                    delay = min(self.max_delay, delay)
+                self._delay = delay
+            return delay
+
+    def start(self):
+        """
+        Called at the start of each call.
+        """
+        self.budget.deposit()
+        with self._lock:
+            self._calls += 1
+
+    def allow_hedge(self):
+        """
+        Called when a call is due for a hedge.
+
+        :rtype: bool
+        :returns: True if the hedge may be sent, False if the budget is
+            spent.
+        """
+        allowed = self.budget.withdraw()
+        with self._lock:
+            if allowed:
+                self._hedges += 1
+            else:
+                self._hedges_denied += 1
+        return allowed
+
+    def snapshot(self):
+        """
+        Returns the policy's current state, for dashboards.
+
+        :rtype: dict
+        """
+        delay = self.delay()
+        with self._lock:
+            return {
+                'delay': delay,
+                'samples': len(self._samples),
+                'calls': self._calls,
+                'hedges': self._hedges,
+                'hedges_denied': self._hedges_denied,
+            }
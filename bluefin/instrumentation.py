@@ -0,0 +1,252 @@
+"""
+Timing events and latency metrics for the clients' requests.
+
+Clients take a list of ``listeners``: callables that are handed a
+:py:class:`RequestEvent` after each attempt, and once more when the call as
+a whole is done. Events only ever carry the fields listed on
+:py:class:`RequestEvent`. Request values (card numbers, security codes and
+the like) never make it into them.
+"""
+import collections
+import logging
+import threading
+
+from bluefin.compat import monotonic as _clock
+
+logger = logging.getLogger('bluefin')
+
+# Sent after each attempt. Timings cover the network phases.
+ATTEMPT = 'attempt'
+# Sent once the call is done, successful or not. Timings cover parsing, and
+# the total time including retries and backoff.
+REQUEST = 'request'
+
+
+class RequestEvent(object):
+    """
+    Something happened while making a request.
+    """
+    __slots__ = ('kind', 'client', 'tran_type', 'pay_type', 'attempt',
+                 'http_status', 'status_code', 'exception', 'timings')
+
+    def __init__(self, kind, client, tran_type=None, pay_type=None,
+                 attempt=None, http_status=None, status_code=None,
+                 exception=None, timings=None):
+        # ATTEMPT or REQUEST.
+        self.kind = kind
+        # Name of the client class, such as 'V3Client'.
+        self.client = client
+        # The request's tran_type and pay_type, if it had any.
+        self.tran_type = tran_type
+        self.pay_type = pay_type
+        # 1 for the first attempt. For REQUEST events, the number of attempts.
+        self.attempt = attempt
+        # HTTP status of the (last) response, if one came in.
+        self.http_status = http_status
+        # Bluefin's 'status_code' response field, if the response was parsed.
+        self.status_code = status_code
+        # Class name of the exception raised, if any.
+        self.exception = exception
+        # Dict of phase name to seconds taken.
+        self.timings = timings or {}
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __repr__(self):
+        return '<RequestEvent %s %s attempt=%s status=%s>' % (
+            self.kind, self.tran_type, self.attempt,
+            self.exception or self.status_code or self.http_status)
+
+
+class RequestTrace(object):
+    """
+    Follows a single call through its attempts, and sends events to the
+    client's listeners.
+    """
+    def __init__(self, listeners, client, values):
+        self.listeners = listeners
+        self.client = client
+        # Grab what we need, and nothing more.
+        self.tran_type = values.get('tran_type')
+        self.pay_type = values.get('pay_type')
+        self.attempts = 0
+        self.http_status = None
+        self.status_code = None
+        self.parse_time = None
+        self._started = _clock()
+        self._parse_started = None
+
+    def _emit(self, kind, attempt, exc, timings):
+        event = RequestEvent(
+            kind, self.client, tran_type=self.tran_type,
+            pay_type=self.pay_type, attempt=attempt,
+            http_status=self.http_status, status_code=self.status_code,
+            exception=exc.__class__.__name__ if exc is not None else None,
+            timings=timings)
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception:
+                # A broken metrics hook mustn't break a payment.
+                logger.exception("Request listener %r failed.", listener)
+
+    def attempt(self, response=None, exc=None):
+        """
+        Called after each attempt.
+
+        :keyword response: The response, if one came in.
+        :keyword Exception exc: The exception the attempt failed with.
+        """
+        self.attempts += 1
+        # No response means no status, whatever the last attempt got.
+        self.http_status = getattr(response, 'status_code', None)
+        timings = getattr(response, 'timings', None)
+        self._emit(ATTEMPT, self.attempts, exc, dict(timings or {}))
+
+    def parse_started(self):
+        self._parse_started = _clock()
+
+    def parsed(self, result_dict):
+        """
+        Called once the response has been parsed.
+        """
+        self.parse_time = _clock() - self._parse_started
+        self.status_code = result_dict.get('status_code')
+
+    def finish(self, exc=None):
+        """
+        Called when the call is done.
+
+        :keyword Exception exc: The exception the call failed with.
+        """
+        timings = {'total': _clock() - self._started}
+        if self.parse_time is not None:
+            timings['parse'] = self.parse_time
+        self._emit(REQUEST, self.attempts, exc, timings)
+
+
+class _NullTrace(object):
+    """
+    Stands in for :py:class:`RequestTrace` when nobody's listening.
+    """
+    def attempt(self, response=None, exc=None):
+        pass
+
+    def parse_started(self):
+        pass
+
+    def parsed(self, result_dict):
+        pass
+
+    def finish(self, exc=None):
+        pass
+
+NULL_TRACE = _NullTrace()
+
+
+def start_trace(listeners, client, values):
+    """
+    :param list listeners: The client's listeners.
+    :param str client: Name of the client class.
+    :param dict values: The request's values.
+    :returns: A :py:class:`RequestTrace`, or a do-nothing stand-in if there
+        are no listeners.
+    """
+    if not listeners:
+        return NULL_TRACE
+    return RequestTrace(listeners, client, values)
+
+
+class LatencyAggregator(object):
+    """
+    A listener that keeps request counts and latency percentiles per
+    tran_type, in-process. Latencies are kept for the most recent
+    ``max_samples`` events per tran_type and phase.
+
+        >>> metrics = LatencyAggregator()
+        >>> api = V3Client(listeners=[metrics])
+        >>> metrics.percentile('A', 99)
+        0.412
+
+    Requests without a tran_type (Data Retrieval reports, for example) are
+    filed under the client's class name. Instances are thread-safe.
+    """
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        # (tran_type, phase) -> deque of seconds.
+        self._samples = {}
+        # tran_type -> Counter of outcomes.
+        self._outcomes = {}
+
+    def __call__(self, event):
+        key = event.tran_type or event.client
+        with self._lock:
+            for phase, seconds in event.timings.items():
+                samples = self._samples.get((key, phase))
+                if samples is None:
+                    samples = collections.deque(maxlen=self.max_samples)
+                    self._samples[(key, phase)] = samples
+                samples.append(seconds)
+
+            if event.kind == REQUEST:
+                outcome = event.exception or event.status_code or 'ok'
+                outcomes = self._outcomes.setdefault(key, collections.Counter())
+                outcomes[outcome] += 1
+                outcomes['retries'] += max(0, (event.attempt or 1) - 1)
+
+    def percentile(self, tran_type, percent, phase='total'):
+        """
+        :param str tran_type: The tran_type to look at.
+        :param float percent: The percentile, between 0 and 100.
+        :keyword str phase: The phase to look at. ``total`` and ``parse``
+            are per call, while ``connect``, ``tls``, ``server`` and
+            ``transfer`` are per attempt.
+        :rtype: float or None
+        :returns: Latency in seconds, or None if there are no samples.
+        """
+        with self._lock:
+            samples = sorted(self._samples.get((tran_type, phase), ()))
+        if not samples:
+            return None
+        index = int(round((len(samples) - 1) * percent / 100.0))
+        return samples[index]
+
+    def counts(self, tran_type):
+        """
+        :rtype: dict
+        :returns: Number of calls per outcome (status_code, exception class
+            name, or 'ok'), plus the total number of ``retries``.
+        """
+        with self._lock:
+            return dict(self._outcomes.get(tran_type, {}))
+
+    def summary(self, percents=(50, 90, 99)):
+        """
+        :rtype: dict
+        :returns: Counts and percentiles for every tran_type and phase seen,
+            as ``{tran_type: {'counts': {...}, 'latency': {phase: {p: s}}}}``.
+        """
+        with self._lock:
+            keys = list(self._samples.keys())
+            tran_types = set(self._outcomes) | set(k[0] for k in keys)
+
+        summary = {}
+        for tran_type in tran_types:
+            latency = {}
+            for key, phase in keys:
+                if key == tran_type:
+                    latency[phase] = dict(
+                        (p, self.percentile(tran_type, p, phase))
+                        for p in percents)
+            summary[tran_type] = {
+                'counts': self.counts(tran_type),
+                'latency': latency,
+            }
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._outcomes.clear()
@@ -0,0 +1,181 @@
+"""
+Parsers for the urlencoded ``key=value&...`` bodies that Bluefin responds
+with, and an encoder for the ones we send.
+"""
+try:
+    from urllib.parse import unquote, unquote_to_bytes, urlencode
+except ImportError:
+    from urllib import unquote, urlencode
+    unquote_to_bytes = unquote
+
+# For POSTing encoded bodies, since requests only sets it for dicts.
+FORM_HEADERS = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+
+if str is bytes:
+    # Python 2, where unquote() only works right on bytes.
+    def _unquote_text(raw, encoding):
+        return unquote(raw.encode(encoding)).decode(encoding, 'replace')
+else:
+    def _unquote_text(raw, encoding):
+        return unquote(raw, encoding, 'replace')
+
+
+def _utf8(value):
+    if isinstance(value, bytes) or not hasattr(value, 'encode'):
+        return value
+    return value.encode('utf-8')
+
+
+def encode_form(values):
+    """
+    Form-encodes a dict of values, exactly the way requests does when it's
+    handed one as ``data``: None values are left out, lists and tuples
+    repeat their key, and text is sent as UTF-8.
+
+    :param dict values: Key/value pairs to encode.
+    :rtype: bytes
+    """
+    pairs = []
+    for key, value in values.items():
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                if item is not None:
+                    pairs.append((_utf8(key), _utf8(item)))
+        elif value is not None:
+            pairs.append((_utf8(key), _utf8(value)))
+    return urlencode(pairs).encode('ascii')
+
+
+def _unquote_bytes(raw, encoding):
+    """
+    Percent-decodes a raw key or value. Most of what the gateway sends
+    doesn't need it, so that case is kept cheap.
+
+    :param bytes raw: The raw key or value.
+    :rtype: text
+    """
+    if b'+' in raw:
+        raw = raw.replace(b'+', b' ')
+    if b'%' in raw:
+        raw = unquote_to_bytes(raw)
+    return raw.decode(encoding, 'replace')
+
+
+def _decode_field(field, encoding):
+    """
+    Decodes a single raw ``key=value`` field.
+
+    :param bytes field: The raw field, without the separating ampersands.
+    :rtype: tuple or None
+    :returns: A ``(key, value)`` tuple of text strings, or None for fields
+        that ``urlparse.parse_qs`` would skip (blank, or missing a value).
+    """
+    key, sep, value = field.partition(b'=')
+    if not value:
+        return None
+    return _unquote_bytes(key, encoding), _unquote_bytes(value, encoding)
+
+
+def parse_response(body, encoding='utf-8'):
+    """
+    Parses a whole urlencoded body into a flat dict, in a single pass.
+    Repeated keys have their values joined with commas.
+
+    This gives the same result as running ``urlparse.parse_qs`` on the
+    decoded body, then joining each value list with commas, without
+    building a list per key. Fields that don't need percent-decoding (most
+    of them) are left alone. Like :py:func:`iter_fields`, it only splits on
+    ampersands, not semicolons.
+
+    :param bytes body: The raw response body, such as ``response.content``.
+    :keyword str encoding: Encoding of the percent-decoded values.
+    :rtype: dict
+    """
+    # Urlencoded bodies are plain ASCII, so decoding the whole thing up front
+    # is cheap, and the rest is done on text.
+    if isinstance(body, bytes):
+        body = body.decode(encoding, 'replace')
+
+    result = {}
+    # Only built if a key turns up more than once.
+    repeated = None
+    for field in body.split('&'):
+        key, sep, value = field.partition('=')
+        if not value:
+            # parse_qs skips these too.
+            continue
+        if '+' in key:
+            key = key.replace('+', ' ')
+        if '%' in key:
+            key = _unquote_text(key, encoding)
+        if '+' in value:
+            value = value.replace('+', ' ')
+        if '%' in value:
+            value = _unquote_text(value, encoding)
+        if key in result:
+            if repeated is None:
+                repeated = {}
+            if key in repeated:
+                repeated[key].append(value)
+            else:
+                repeated[key] = [result[key], value]
+        else:
+            result[key] = value
+
+    if repeated:
+        for key, values in repeated.items():
+            result[key] = ','.join(values)
+    return result
+
+
+def iter_fields(chunks, encoding='utf-8'):
+    """
+    Incrementally parses a urlencoded body, yielding each ``(key, value)``
+    pair as soon as the chunk containing its end has been read. Only the
+    current, incomplete field is buffered, so a body of any size is parsed in
+    constant memory.
+
+    :param chunks: An iterable of ``bytes`` chunks, such as
+        ``response.iter_content(8192)``.
+    :keyword str encoding: Encoding of the percent-decoded values.
+    :rtype: generator
+    """
+    buf = b''
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buf += chunk
+        fields = buf.split(b'&')
+        # The last piece may be cut off mid-field. Hang on to it.
+        buf = fields.pop()
+        for field in fields:
+            pair = _decode_field(field, encoding)
+            if pair is not None:
+                yield pair
+
+    pair = _decode_field(buf, encoding)
+    if pair is not None:
+        yield pair
+
+
+def iter_records(fields):
+    """
+    Groups a stream of ``(key, value)`` pairs into records. Report responses
+    repeat the same set of keys once per transaction, so a new record is
+    started whenever a key turns up that the current record already has.
+
+    :param fields: An iterable of ``(key, value)`` pairs, as yielded by
+        :py:func:`iter_fields`.
+    :rtype: generator
+    :returns: A dict per record.
+    """
+    record = {}
+    for key, value in fields:
+        if key in record:
+            yield record
+            record = {}
+        record[key] = value
+
+    if record:
+        yield record
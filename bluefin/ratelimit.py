@@ -0,0 +1,323 @@
+"""
+Client-side rate limiting, to keep traffic spikes from turning into a pile
+of gateway 408's and slow responses (and then a pile of retries on top).
+
+A :py:class:`RateLimiter` combines two limits, either of which may be left
+off: a token bucket capping requests per second, and a cap on requests in
+flight that adapts to how the gateway is coping. Every attempt, retries
+included, needs a permit from the limiter.
+"""
+import threading
+import time
+
+from bluefin.compat import monotonic as _clock
+
+
+class Permit(object):
+    """
+    Handed out by :py:meth:`RateLimiter.acquire` for a single attempt. Give
+    it back with :py:meth:`RateLimiter.release`.
+    """
+    __slots__ = ('started', 'saturated')
+
+    def __init__(self, started, saturated):
+        # When the attempt started.
+        self.started = started
+        # Whether it took the last free slot. Only attempts sent while the
+        # limit was actually in the way count towards raising it.
+        self.saturated = saturated
+
+
+class RateLimiter(object):
+    """
+    Limits the rate of requests to the gateway, and the number in flight.
+    Pass one to a client's ``limiter`` keyword, or the same one to several
+    clients (thread-based and asyncio alike) to have them share it.
+
+        >>> limiter = RateLimiter(rate=50, concurrency=10, max_concurrency=40)
+        >>> api = V3Client(limiter=limiter)
+
+    The in-flight limit is adjusted AIMD-style, like TCP's congestion
+    window. Each attempt that goes through quickly while the limit is
+    reached raises it by ``1 / limit``, so it grows by about one per round
+    trip. Each throttled attempt (a 408, 429 or 503, a timeout, or a
+    response much slower than the gateway's usual) cuts it by ``backoff``.
+    Only one cut is made per round trip, since the attempts in flight at
+    the time are all likely to be throttled too. Instances are thread-safe.
+    """
+    def __init__(self, rate=None, burst=None, concurrency=10,
+                 min_concurrency=1, max_concurrency=100, adaptive=True,
+                 backoff=0.7, latency_tolerance=3.0, latency_floor=0.1,
+                 throttle_statuses=(408, 429, 503), throttle_exceptions=None,
+                 max_wait=None, poll_interval=0.005):
+        """
+        :keyword float rate: Most requests per second. None means no limit.
+        :keyword float burst: Most requests that may be sent at once after
+            a quiet spell. Defaults to ``rate``.
+        :keyword int concurrency: Starting limit on requests in flight. None
+            means no limit.
+        :keyword int min_concurrency: The in-flight limit never drops below
+            this.
+        :keyword int max_concurrency: ...or rises above this.
+        :keyword bool adaptive: If False, the in-flight limit stays at
+            ``concurrency``.
+        :keyword float backoff: What the in-flight limit is multiplied by
+            when throttled.
+        :keyword float latency_tolerance: A response this many times slower
+            than the fastest seen lately counts as throttled.
+        :keyword float latency_floor: Responses quicker than this, in
+            seconds, never count as throttled, however much slower than
+            the fastest they are.
+        :keyword tuple throttle_statuses: HTTP status codes that mean the
+            gateway is overloaded.
+        :keyword tuple throttle_exceptions: Exception classes that mean the
+            same. Defaults to requests' Timeout.
+        :keyword float max_wait: Most seconds to wait for a permit. None
+            means no limit.
+        :keyword float poll_interval: How often asyncio clients check for a
+            free slot, in seconds.
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.adaptive = adaptive
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self.latency_floor = latency_floor
+        self.throttle_statuses = frozenset(throttle_statuses)
+        # Clients that raise exceptions of their own add them to the
+        # defaults. See add_default_throttle_exceptions().
+        self._default_exceptions = throttle_exceptions is None
+        if throttle_exceptions is None:
+            from requests.exceptions import Timeout
+            throttle_exceptions = (Timeout,)
+        self.throttle_exceptions = tuple(throttle_exceptions)
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)
+        self._tokens = self.burst
+        self._refilled_at = _clock()
+        self._limit = float(concurrency) if concurrency is not None else None
+        self._in_flight = 0
+        # Roughly the gateway's unloaded latency: a minimum that slowly
+        # drifts up, so it recovers if the gateway gets slower for good.
+        self._baseline = None
+        self._decreased_at = None
+        # Lifetime totals, for dashboards.
+        self._throttled = 0
+        self._timeouts = 0
+
+    @property
+    def limit(self):
+        """
+        The current in-flight limit, or None if there isn't one.
+        """
+        with self._lock:
+            if self._limit is None:
+                return None
+            return int(self._limit)
+
+    def is_throttled(self, exc):
+        """
+        :param Exception exc: The exception an attempt failed with.
+        :rtype: bool
+        :returns: True if the exception says the gateway is overloaded.
+        """
+        if isinstance(exc, self.throttle_exceptions):
+            return True
+        try:
+            return int(getattr(exc, 'error_code', None)) in self.throttle_statuses
+        except (TypeError, ValueError):
+            return False
+
+    def add_default_throttle_exceptions(self, exceptions):
+        """
+        Adds to the throttle exceptions, unless they were passed in. Called
+        by clients whose transports raise exceptions other than requests',
+        such as the asyncio ones.
+
+        :param tuple exceptions: Exception classes that mean the gateway is
+            overloaded.
+        """
+        if self._default_exceptions:
+            self.throttle_exceptions += tuple(
+                e for e in exceptions if e not in self.throttle_exceptions)
+
+    def reserve(self, max_wait=None):
+        """
+        Takes a token from the bucket, possibly one that's yet to be
+        refilled.
+
+        :keyword float max_wait: Most seconds the caller is willing to wait.
+        :rtype: float or None
+        :returns: Seconds to wait before sending, or None (and no token
+            taken) if that would be longer than ``max_wait``.
+        """
+        if self.rate is None:
+            return 0.0
+        with self._lock:
+            now = _clock()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._refilled_at) * self.rate)
+            self._refilled_at = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                return None
+            # May go negative, which queues up the callers behind us.
+            self._tokens -= 1
+            return wait
+
+    def refund(self):
+        """
+        Gives back a token taken by :py:meth:`reserve`, for a request that
+        won't be sent after all. :py:meth:`acquire` does this itself.
+        """
+        with self._lock:
+            self._refund()
+
+    def _refund(self):
+        """
+        Must be called with the lock held.
+        """
+        if self.rate is not None:
+            self._tokens = min(self.burst, self._tokens + 1)
+
+    def _enter(self):
+        """
+        Takes an in-flight slot if there's one free. Must be called with the
+        lock held.
+
+        :rtype: Permit or None
+        """
+        limit = self._limit
+        if limit is not None and self._in_flight >= int(limit):
+            return None
+        self._in_flight += 1
+        saturated = limit is not None and self._in_flight >= int(limit)
+        return Permit(_clock(), saturated)
+
+    def try_acquire(self):
+        """
+        Takes an in-flight slot without waiting, and without touching the
+        token bucket. Used by the asyncio clients, which do their waiting
+        on the event loop. See :py:meth:`reserve`.
+
+        :rtype: Permit or None
+        """
+        with self._lock:
+            return self._enter()
+
+    def acquire(self, max_wait=None):
+        """
+        Waits for a token and a free slot.
+
+        :keyword float max_wait: Most seconds to wait. Defaults to the
+            limiter's ``max_wait``.
+        :rtype: Permit or None
+        :returns: A permit, or None if there wasn't one to be had in time.
+        """
+        if max_wait is None:
+            max_wait = self.max_wait
+        started = _clock()
+        wait = self.reserve(max_wait)
+        if wait is None:
+            self.record_timeout()
+            return None
+        if wait:
+            time.sleep(wait)
+
+        with self._lock:
+            while True:
+                permit = self._enter()
+                if permit is not None:
+                    return permit
+                if max_wait is None:
+                    self._slot_freed.wait()
+                    continue
+                remaining = max_wait - (_clock() - started)
+                if remaining <= 0:
+                    self._timeouts += 1
+                    self._refund()
+                    return None
+                self._slot_freed.wait(remaining)
+
+    def record_timeout(self):
+        """
+        Counts a caller giving up on a permit. :py:meth:`acquire` does this
+        itself.
+        """
+        with self._lock:
+            self._timeouts += 1
+
+    def release(self, permit, exc=None):
+        """
+        Gives a permit back, and adjusts the in-flight limit according to
+        how the attempt went.
+
+        :param Permit permit: The attempt's permit.
+        :keyword Exception exc: The exception the attempt failed with, or
+            None if it went through fine.
+        """
+        now = _clock()
+        elapsed = now - permit.started
+        throttled = exc is not None and self.is_throttled(exc)
+        with self._lock:
+            self._in_flight -= 1
+            self._slot_freed.notify()
+
+            if exc is None:
+                baseline = self._baseline
+                if baseline is None or elapsed < baseline:
+                    baseline = elapsed
+                else:
+                    baseline += (elapsed - baseline) * 0.01
+                self._baseline = baseline
+                throttled = elapsed > max(self.latency_floor,
+                                          baseline * self.latency_tolerance)
+
+            if throttled:
+                self._throttled += 1
+            if self._limit is None or not self.adaptive:
+                return
+
+            if throttled:
+                # One cut per round trip: attempts that started before the
+                # last cut don't count.
+                if self._decreased_at is None or \
+                        permit.started >= self._decreased_at:
+                    self._limit = max(float(self.min_concurrency),
+                                      self._limit * self.backoff)
+                    self._decreased_at = now
+            elif exc is None and permit.saturated:
+                self._limit = min(float(self.max_concurrency),
+                                  self._limit + 1.0 / self._limit)
+                # More room. Wake up anybody waiting on it.
+                self._slot_freed.notify_all()
+
+    def cancel(self, permit):
+        """
+        Gives a permit back unused, without adjusting anything.
+
+        :param Permit permit: The permit.
+        """
+        with self._lock:
+            self._in_flight -= 1
+            self._slot_freed.notify()
+
+    def snapshot(self):
+        """
+        Returns the limiter's current state, for dashboards.
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'limit': None if self._limit is None else int(self._limit),
+                'in_flight': self._in_flight,
+                'baseline_latency': self._baseline,
+                'throttled': self._throttled,
+                'timeouts': self._timeouts,
+            }
@@ -0,0 +1,193 @@
+"""
+Retry policies shared by the Direct Mode and Data Retrieval clients.
+"""
+import random
+import threading
+import time
+
+from bluefin.compat import monotonic as _clock
+
+
+class RetryBudget(object):
+    """
+    Caps the share of traffic that retries may take up, so a struggling
+    gateway isn't buried under a pile of retries on top of the regular
+    load.
+
+    This is a token bucket: every request deposits ``ratio`` tokens, and
+    every retry withdraws a whole one. With the default ratio of 0.2,
+    retries may add at most 20% on top of the normal request volume once
+    the initial tokens have been spent. Instances are thread-safe, and may
+    be shared between policies and clients.
+    """
+    def __init__(self, ratio=0.2, capacity=10.0, initial=None):
+        """
+        :keyword float ratio: Tokens deposited per request.
+        :keyword float capacity: Most tokens the bucket will hold, and thus
+            the largest burst of retries allowed.
+        :keyword float initial: Tokens to start with. Defaults to
+            ``capacity``, so that low-traffic clients can still retry.
+        """
+        self.ratio = ratio
+        self.capacity = capacity
+        self.tokens = capacity if initial is None else initial
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def withdraw(self):
+        """
+        Takes a token out of the bucket for a retry.
+
+        :rtype: bool
+        :returns: True if there was a token to take (retry away), False if
+            the budget is spent.
+        """
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class RetryPolicy(object):
+    """
+    Decides which failures are retried, how long to wait between attempts,
+    and when to give up. Pass one to a client's ``retry_policy`` keyword.
+
+        >>> policy = RetryPolicy(max_retries=5, backoff_base=0.1,
+        ...                      deadline=30, budget=RetryBudget(ratio=0.1))
+        >>> api = V3Client(retry_policy=policy)
+
+    A policy may be shared between clients, in which case they also share
+    its retry budget.
+    """
+    def __init__(self, max_retries=3, retry_statuses=(408,),
+                 retry_exceptions=(), backoff_base=0.05, backoff_max=2.0,
+                 jitter=True, deadline=None, budget=None):
+        """
+        :keyword int max_retries: Most retries per call. The first attempt
+            doesn't count.
+        :keyword retry_statuses: HTTP status codes worth retrying. These
+            are matched against the ``error_code`` of the exceptions raised
+            by the clients' status checks.
+        :keyword tuple retry_exceptions: Exception classes worth retrying,
+            typically from ``requests.exceptions``.
+        :keyword float backoff_base: Delay before the first retry, in
+            seconds. Doubles with every retry after that.
+        :keyword float backoff_max: Longest delay between two attempts.
+        :keyword bool jitter: If True, each delay is picked at random
+            between zero and the exponential backoff value ("full jitter").
+            This keeps clients that failed together from retrying in
+            lockstep.
+        :keyword float deadline: Most time, in seconds, to spend on a call
+            across all attempts. Each attempt's timeout is cut short so as
+            not to overrun it. None means no deadline.
+        :keyword RetryBudget budget: Caps the retry share of traffic. If not
+            specified, a budget with the default settings is created.
+        """
+        self.max_retries = max_retries
+        self.retry_statuses = frozenset(int(status) for status in retry_statuses)
+        self.retry_exceptions = tuple(retry_exceptions)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.jitter = jitter
+        self.deadline = deadline
+        self.budget = budget if budget is not None else RetryBudget()
+
+    def is_retryable(self, exc):
+        """
+        :param Exception exc: The exception an attempt failed with.
+        :rtype: bool
+        """
+        if self.retry_exceptions and isinstance(exc, self.retry_exceptions):
+            return True
+        error_code = getattr(exc, 'error_code', None)
+        try:
+            return int(error_code) in self.retry_statuses
+        except (TypeError, ValueError):
+            # Decline status codes and the like aren't HTTP statuses.
+            return False
+
+    def backoff(self, retry_number):
+        """
+        :param int retry_number: 1 for the first retry, 2 for the second...
+        :rtype: float
+        :returns: Seconds to wait before the retry.
+        """
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (retry_number - 1))
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def start(self):
+        """
+        Starts tracking a new call.
+
+        :rtype: RetryState
+        """
+        return RetryState(self)
+
+
+class RetryState(object):
+    """
+    Keeps track of a single call's attempts under a :py:class:`RetryPolicy`.
+    Clients use it like this::
+
+        state = policy.start()
+        while True:
+            try:
+                response = post(timeout=state.timeout(http_timeout))
+                check(response)
+            except Exception as exc:
+                delay = state.next_delay(exc)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            break
+    """
+    def __init__(self, policy):
+        self.policy = policy
+        self.retries = 0
+        self.deadline = None
+        if policy.deadline is not None:
+            self.deadline = _clock() + policy.deadline
+        policy.budget.deposit()
+
+    def timeout(self, http_timeout):
+        """
+        :param http_timeout: The client's socket timeout.
+        :returns: The timeout to use for the next attempt, cut short if the
+            deadline is nearer than that.
+        """
+        if self.deadline is None:
+            return http_timeout
+        remaining = max(0.001, self.deadline - _clock())
+        if http_timeout is None:
+            return remaining
+        return min(http_timeout, remaining)
+
+    def next_delay(self, exc):
+        """
+        Decides whether to retry after a failed attempt.
+
+        :param Exception exc: The exception the attempt failed with.
+        :rtype: float or None
+        :returns: Seconds to wait before retrying, or None if the failure
+            isn't retryable, or we're out of retries, budget or time.
+        """
+        policy = self.policy
+        if self.retries >= policy.max_retries or not policy.is_retryable(exc):
+            return None
+
+        delay = policy.backoff(self.retries + 1)
+        if self.deadline is not None and _clock() + delay >= self.deadline:
+            return None
+        if not policy.budget.withdraw():
+            return None
+
+        self.retries += 1
+        return delay
@@ -0,0 +1,223 @@
+"""
+Routing across several gateway endpoints. Give a client a list of hosts,
+and each request goes to whichever one has lately been the fastest and
+most reliable. Failures that the retry policy retries go to a different
+endpoint, and endpoints that keep failing are left alone for a while.
+"""
+import threading
+
+from bluefin.circuitbreaker import default_failure_exceptions, is_gateway_failure
+from bluefin.compat import monotonic as _clock
+
+
+class Endpoint(object):
+    """
+    What an :py:class:`EndpointRouter` knows about one of its hosts.
+    """
+    def __init__(self, host):
+        self.host = host
+        # Moving average of successful attempts' durations, in seconds. None
+        # until there's been one.
+        self.latency = None
+        # Moving average of failures (1) and successes (0).
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        # Set while the endpoint is marked down: when it may be probed again.
+        self.down_until = None
+        # True while a probe request is in flight.
+        self.probing = False
+        # Lifetime totals, for health checks and dashboards.
+        self.attempts = 0
+        self.failures = 0
+        self.times_down = 0
+
+    def score(self, error_penalty):
+        """
+        Lower is better. Untried endpoints score zero, so they get tried.
+        """
+        # Added, not multiplied, or an endpoint that fails fast would look
+        # better than one that works.
+        return (self.latency or 0.0) + error_penalty * self.error_rate
+
+
+class EndpointRouter(object):
+    """
+    Picks which of several gateway endpoints each attempt goes to. Keeps an
+    exponentially weighted moving average of each endpoint's latency and
+    error rate, and sends requests to the one with the best mix of the two.
+    Ties go to the endpoint listed first.
+
+    Timeouts, connection errors, and 5xx/7xx responses are failures, as for
+    :py:class:`bluefin.circuitbreaker.CircuitBreaker`. After
+    ``failure_threshold`` of them in a row, an endpoint is marked down and
+    skipped. Once ``down_for`` seconds have passed, a single request is sent
+    its way as a probe. If it goes through, the endpoint is back in
+    rotation. If not, it's marked down again. The gateway has no health
+    check to ping, so probes are real requests.
+
+    The clients build one of these when their ``host`` is a list. Build your
+    own to tune it, and pass it as their ``router`` instead. Instances are
+    thread-safe, and may be shared between clients.
+
+        >>> router = EndpointRouter(['https://gw1.example.com:1402',
+        ...                          'https://gw2.example.com:1402'])
+        >>> api = V3Client(router=router)
+        >>> router.choose()
+        'https://gw1.example.com:1402'
+    """
+    def __init__(self, hosts, alpha=0.2, error_penalty=1.0,
+                 failure_threshold=3, down_for=10,
+                 failure_exceptions=None,
+                 failure_statuses=((500, 599), (700, 799))):
+        """
+        :param list hosts: Full URIs to the endpoints, including protocol,
+            hostname, and port. No trailing slashes.
+        :keyword float alpha: Weight of the newest attempt in the moving
+            averages, between 0 and 1. Higher reacts faster, but is noisier.
+        :keyword float error_penalty: Seconds of latency that an error rate
+            of 100% is worth. With the default, an endpoint failing 10% of
+            the time has to be 100ms faster to be picked over a healthy one.
+        :keyword int failure_threshold: Consecutive failures that mark an
+            endpoint down.
+        :keyword float down_for: Seconds to skip a down endpoint before
+            probing it again.
+        :keyword tuple failure_exceptions: Exception classes that count as
+            failures. Defaults to requests' ConnectionError and Timeout.
+        :keyword tuple failure_statuses: Inclusive ``(low, high)`` ranges of
+            HTTP status codes that count as failures.
+        """
+        if not hosts:
+            raise ValueError("At least one host is needed.")
+        if failure_exceptions is None:
+            failure_exceptions = default_failure_exceptions()
+        self.alpha = alpha
+        self.error_penalty = error_penalty
+        self.failure_threshold = failure_threshold
+        self.down_for = down_for
+        self.failure_exceptions = tuple(failure_exceptions)
+        self.failure_statuses = tuple(failure_statuses)
+
+        self.endpoints = [Endpoint(host) for host in hosts]
+        self._by_host = dict((endpoint.host, endpoint)
+                             for endpoint in self.endpoints)
+        self._lock = threading.Lock()
+
+    @property
+    def hosts(self):
+        return [endpoint.host for endpoint in self.endpoints]
+
+    def is_failure(self, exc):
+        """
+        :param Exception exc: The exception an attempt failed with.
+        :rtype: bool
+        :returns: True if the exception says the endpoint is in trouble.
+        """
+        return is_gateway_failure(exc, self.failure_exceptions,
+                                  self.failure_statuses)
+
+    def _pick(self, exclude, now):
+        """
+        The best endpoint that's up and not excluded, or one that's due for
+        a probe. Must be called with the lock held.
+
+        :rtype: Endpoint or None
+        """
+        best = None
+        best_score = None
+        for endpoint in self.endpoints:
+            if endpoint.host in exclude:
+                continue
+            if endpoint.down_until is not None:
+                if not endpoint.probing and now >= endpoint.down_until:
+                    # Probes go first, or they'd never happen while any
+                    # other endpoint is up.
+                    endpoint.probing = True
+                    return endpoint
+                continue
+            score = endpoint.score(self.error_penalty)
+            if best is None or score < best_score:
+                best = endpoint
+                best_score = score
+        return best
+
+    def choose(self, exclude=()):
+        """
+        Picks the endpoint for the next attempt.
+
+        :keyword exclude: Hosts not to pick, such as those that already
+            failed during the current call. They're only picked if there's
+            nothing else left.
+        :rtype: str
+        :returns: The endpoint's host.
+        """
+        with self._lock:
+            now = _clock()
+            endpoint = self._pick(exclude, now)
+            if endpoint is None and exclude:
+                endpoint = self._pick((), now)
+            if endpoint is None:
+                # Everything's down. Better to try something than nothing:
+                # the endpoint that's closest to being probed.
+                endpoint = min(self.endpoints, key=lambda e: e.down_until)
+            return endpoint.host
+
+    def record(self, host, elapsed=None, exc=None):
+        """
+        Called by the clients after each attempt.
+
+        :param str host: The host the attempt went to.
+        :keyword float elapsed: How long the attempt took, in seconds.
+        :keyword Exception exc: The exception the attempt failed with, or
+            None if it went through fine.
+        """
+        failed = exc is not None and self.is_failure(exc)
+        with self._lock:
+            endpoint = self._by_host.get(host)
+            if endpoint is None:
+                return
+            alpha = self.alpha
+            was_probe = endpoint.probing
+            endpoint.probing = False
+            endpoint.attempts += 1
+            endpoint.error_rate += alpha * ((1.0 if failed else 0.0) -
+                                            endpoint.error_rate)
+
+            if not failed:
+                endpoint.consecutive_failures = 0
+                endpoint.down_until = None
+                if elapsed is not None:
+                    if endpoint.latency is None:
+                        endpoint.latency = elapsed
+                    else:
+                        endpoint.latency += alpha * (elapsed - endpoint.latency)
+                return
+
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if was_probe or endpoint.down_until is not None or \
+                    endpoint.consecutive_failures >= self.failure_threshold:
+                if endpoint.down_until is None:
+                    endpoint.times_down += 1
+                endpoint.down_until = _clock() + self.down_for
+
+    def snapshot(self):
+        """
+        Returns each endpoint's current state, for health checks.
+
+        :rtype: list
+        :returns: A dict per endpoint, in the order they were given.
+        """
+        with self._lock:
+            now = _clock()
+            return [{
+                'host': endpoint.host,
+                'up': endpoint.down_until is None,
+                'retry_in': (None if endpoint.down_until is None
+                             else max(0, endpoint.down_until - now)),
+                'latency': endpoint.latency,
+                'error_rate': endpoint.error_rate,
+                'consecutive_failures': endpoint.consecutive_failures,
+                'attempts': endpoint.attempts,
+                'failures': endpoint.failures,
+                'times_down': endpoint.times_down,
+            } for endpoint in self.endpoints]
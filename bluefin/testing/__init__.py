@@ -0,0 +1,4 @@
+"""
+Tools for testing and benchmarking code that uses python-bluefin, without
+talking to the real gateway.
+"""
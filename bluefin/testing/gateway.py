@@ -0,0 +1,340 @@
+"""
+Local stand-ins for the Bluefin gateway, for tests and benchmarks that
+shouldn't (or can't) hit the real thing.
+"""
+import datetime
+import itertools
+import random
+import socket
+import sys
+import threading
+import time
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs
+    from urllib import urlencode
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlencode
+
+from bluefin.cache import TTLCache
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive needs HTTP/1.1.
+    protocol_version = 'HTTP/1.1'
+    # Send the headers and body in one go. Otherwise Nagle's algorithm and
+    # delayed ACKs stall every kept-alive response by ~40ms.
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections.add(self.connection)
+
+    def finish(self):
+        try:
+            BaseHTTPRequestHandler.finish(self)
+        finally:
+            with self.server.lock:
+                self.server.connections.discard(self.connection)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        server = self.server
+        with server.lock:
+            if server.record_requests:
+                server.requests.append((self.path, body))
+            server.client_ports.add(self.client_address[1])
+        status, response_body = server.responder(self.path, body)
+        if not isinstance(response_body, bytes):
+            response_body = response_body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(response_body)))
+        if self.close_connection:
+            # The client asked us to. Say so, or it may try to re-use it.
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(response_body)
+
+    def log_message(self, *args):
+        # Keep the output clean.
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """
+    Answers every POST with whatever ``responder(path, body)`` returns, as a
+    ``(status, body)`` tuple. Keeps track of the requests it has seen, and
+    of the client ports they came from, so tests can count connections.
+
+        >>> server = StubServer(lambda path, body: (200, 'status_code=1'))
+        >>> server.start()
+        >>> api = V3Client(host=server.url)
+    """
+    daemon_threads = True
+    # Benchmarks open lots of connections at once.
+    request_queue_size = 128
+
+    def __init__(self, responder, port=0, record_requests=True):
+        """
+        :param callable responder: Called with the path and raw body of each
+            request. Returns a ``(status, body)`` tuple.
+        :keyword int port: Port to listen on. Defaults to any free one.
+        :keyword bool record_requests: If False, don't keep every request in
+            :py:attr:`requests`. Useful for long benchmark runs.
+        """
+        HTTPServer.__init__(self, ('127.0.0.1', port), _Handler)
+        self.responder = responder
+        self.record_requests = record_requests
+        self.lock = threading.Lock()
+        self.requests = []
+        self.client_ports = set()
+        self.connections = set()
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+
+    @property
+    def url(self):
+        """
+        The server's URL, suitable for the clients' ``host`` keyword.
+        """
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        # Hang up on kept-alive connections, so their threads exit.
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up early (hedged requests, timeouts) are expected.
+        # Anything else is worth seeing.
+        if not isinstance(sys.exc_info()[1], socket.error):
+            HTTPServer.handle_error(self, request, client_address)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class FakeGateway(StubServer):
+    """
+    A fake Bluefin gateway that speaks the Direct Mode 3.1 and
+    transaction1.5 report wire formats.
+
+    Direct Mode requests are approved, unless they're missing a required
+    value (HTTP 6xx, like the real thing), or picked at random to fail
+    according to ``error_rates`` and ``decline_rate``.
+
+    Report requests get ``records_per_day`` transactions per day between
+    ``transactions_after`` and ``transactions_before`` (inclusive), or
+    ``report_size`` transactions if the request has no date range. Report
+    bodies are generated once per query and kept, so benchmarks measure the
+    client rather than the fake.
+
+        >>> with FakeGateway(latency=0.05, error_rates={408: 0.01}) as gateway:
+        ...     api = V3Client(host=gateway.url)
+        ...     api.send_request({...})
+    """
+    direct_path = '/gw/sas/direct3.1'
+    report_path = '/gw/reports/transaction1.5'
+
+    # Direct Mode values the gateway insists on.
+    required_values = ('pay_type', 'tran_type', 'account_id', 'amount')
+    # Auth messages to decline with, picked at random.
+    decline_messages = (
+        ('0', 'AUTH DECLINED'),
+        ('0', 'INVALID CARD NO'),
+        ('0', 'CVV2 MISMATCH'),
+        ('F', 'C/DECLINED'),
+    )
+    # Most report bodies to keep.
+    report_cache_entries = 32
+
+    def __init__(self, latency=0, error_rates=None, decline_rate=0,
+                 report_size=100, records_per_day=10, seed=None, port=0,
+                 record_requests=False):
+        """
+        :keyword latency: Seconds to wait before answering each request. A
+            ``(low, high)`` tuple picks a random latency in that range.
+        :keyword dict error_rates: Maps HTTP status codes (408, 6xx, 7xx,
+            5xx...) to the fraction of requests that should fail with them.
+        :keyword float decline_rate: Fraction of otherwise successful Direct
+            Mode requests to decline, with a 'status_code' of 0 or F.
+        :keyword int report_size: Number of transactions in a report without
+            a date range.
+        :keyword int records_per_day: Number of transactions per day in a
+            report with a date range.
+        :keyword seed: Seed for the random number generator, for repeatable
+            runs.
+        :keyword int port: Port to listen on. Defaults to any free one.
+        :keyword bool record_requests: If True, keep every request in
+            :py:attr:`requests`.
+        """
+        StubServer.__init__(self, self.respond, port=port,
+                            record_requests=record_requests)
+        self.latency = latency
+        self.error_rates = dict(error_rates or {})
+        self.decline_rate = decline_rate
+        self.report_size = report_size
+        self.records_per_day = records_per_day
+        self.random = random.Random(seed)
+        self._trans_ids = itertools.count(100000000000)
+        self._reports = TTLCache(max_entries=self.report_cache_entries)
+
+    def _sleep(self):
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            with self.lock:
+                latency = self.random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+
+    def _pick_error(self):
+        """
+        :returns: An HTTP status code to fail with, or None.
+        """
+        with self.lock:
+            roll = self.random.random()
+        for status, rate in sorted(self.error_rates.items()):
+            if roll < rate:
+                return status
+            roll -= rate
+        return None
+
+    def respond(self, path, body):
+        self._sleep()
+        error = self._pick_error()
+        if error is not None:
+            return error, 'Simulated error %d' % error
+
+        values = dict((k, v[0]) for k, v in
+                      parse_qs(body.decode('utf-8')).items())
+        if path == self.direct_path:
+            return self.direct_response(values)
+        if path == self.report_path:
+            return 200, self.report_response(values)
+        return 404, 'Not Found'
+
+    def direct_response(self, values):
+        """
+        :param dict values: The request's values.
+        :rtype: tuple
+        :returns: A ``(status, body)`` tuple.
+        """
+        for name in self.required_values:
+            if not values.get(name):
+                return 601, 'Missing required value: %s' % name
+        if values.get('pay_type') == 'C' and not values.get('card_number'):
+            return 601, 'Missing required value: card_number'
+        try:
+            if float(values['amount']) <= 0:
+                raise ValueError
+        except ValueError:
+            return 602, 'Invalid amount'
+
+        with self.lock:
+            declined = self.random.random() < self.decline_rate
+            decline = self.random.choice(self.decline_messages)
+        trans_id = next(self._trans_ids)
+
+        if declined:
+            status_code, auth_msg = decline
+            return 200, urlencode([
+                ('status_code', status_code), ('auth_msg', auth_msg),
+                ('reason_code2', auth_msg), ('trans_id', trans_id),
+            ])
+
+        return 200, urlencode([
+            ('avs_code', 'X'), ('auth_msg', 'TEST APPROVED'),
+            ('status_code', '1'), ('ticket_code', 'XXXXXXXXXXXXXXX'),
+            ('auth_date', time.strftime('%Y-%m-%d %H:%M:%S')),
+            ('settle_currency', 'USD'), ('auth_code', '999999'),
+            ('settle_amount', values['amount']), ('cvv2_code', 'M'),
+            ('processor', 'TEST'), ('trans_id', trans_id),
+        ])
+
+    def report_response(self, values):
+        """
+        :param dict values: The request's values.
+        :rtype: bytes
+        :returns: The report body.
+        """
+        start = values.get('transactions_after')
+        end = values.get('transactions_before')
+        site_tag = values.get('site_tag', 'MAIN')
+        if start and end:
+            key = (start, end, site_tag, self.records_per_day)
+        else:
+            key = (datetime.date.today(), site_tag, self.report_size)
+        body = self._reports.get(key)
+        if body is not None:
+            return body
+
+        if start and end:
+            start = _parse_date(start)
+            end = _parse_date(end)
+            days = [start + datetime.timedelta(days=n)
+                    for n in range((end - start).days + 1)]
+            records = ((day, n) for day in days
+                       for n in range(self.records_per_day))
+        else:
+            records = ((key[0], n) for n in range(self.report_size))
+
+        body = generate_report(records, site_tag=site_tag)
+        self._reports.set(key, body)
+        return body
+
+
+def _parse_date(value):
+    """
+    Parses a YYYY-MM-DD date. Not with strptime(), which may fail the first
+    time it's called from several threads at once on Python 2.
+
+    :rtype: datetime.date
+    """
+    year, month, day = value.split('-')
+    return datetime.date(int(year), int(month), int(day))
+
+
+def generate_report(records, site_tag='MAIN'):
+    """
+    Builds a transaction1.5-style report body. Transaction IDs, amounts and
+    statuses are derived from the date and sequence number, so the same
+    record always looks the same, no matter which request it shows up in.
+
+    :param records: An iterable of ``(date, sequence_number)`` tuples.
+    :keyword str site_tag: The site tag to put on every record.
+    :rtype: bytes
+    """
+    fields = []
+    for day, n in records:
+        fields.append(urlencode([
+            ('trans_id', '%s%s%06d' % (site_tag, day.strftime('%Y%m%d'), n)),
+            ('auth_date', '%s %02d:%02d:00' % (day.isoformat(),
+                                               (n // 60) % 24, n % 60)),
+            ('settle_amount', '%d.%02d' % (1 + n % 100, n % 100)),
+            ('settle_currency', 'USD'),
+            ('status_code', '0' if n % 10 == 9 else '1'),
+            ('processor', 'TEST' if n % 2 else 'VISA'),
+            ('site_tag', site_tag),
+        ]))
+    return '&'.join(fields).encode('utf-8')
@@ -0,0 +1,189 @@
+"""
+HTTP transport shared by the Direct Mode and Data Retrieval clients. This is
+where requests gets imported, so the clients only import this module once
+they're about to send something.
+"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from bluefin.compat import monotonic as _clock
+# Moved to bluefin.parsing. Still importable from here.
+from bluefin.parsing import FORM_HEADERS, encode_form
+
+# Connection setup times for the request the current thread is making. New
+# connections are opened in the thread that needs them, so this is safe.
+_timings = threading.local()
+
+
+class ConnectError(requests.exceptions.ConnectionError):
+    """
+    The connection couldn't be made at all (refused, or the host couldn't be
+    resolved), so the request was never sent. Unlike most connection errors,
+    these are always safe to retry, even for charges.
+    """
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        started = _clock()
+        HTTPConnection.connect(self)
+        _timings.connect = _clock() - started
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def _new_conn(self):
+        # This is just the TCP part.
+        started = _clock()
+        conn = HTTPSConnection._new_conn(self)
+        _timings.connect = _clock() - started
+        return conn
+
+    def connect(self):
+        started = _clock()
+        HTTPSConnection.connect(self)
+        _timings.tls = _clock() - started - getattr(_timings, 'connect', 0.0)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """
+    An adapter whose connections record how long their TCP and TLS
+    handshakes took.
+    """
+    def init_poolmanager(self, *args, **kwargs):
+        HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool,
+        }
+
+
+class HTTPTransport(object):
+    """
+    A pooled, thread-safe HTTP transport. Connections to the Bluefin gateway
+    are kept alive and re-used between calls, so only the first request to a
+    host pays for the TCP and TLS handshakes.
+
+    A single instance may be shared between any number of clients and
+    threads. Each thread gets its own :py:class:`requests.Session`, but all of
+    them are mounted on the same adapter, and thus the same connection pool.
+    """
+    def __init__(self, pool_connections=4, pool_maxsize=10, pool_block=False,
+                 keep_alive=True):
+        """
+        :keyword int pool_connections: Number of per-host connection pools
+            to keep around. You'll rarely need more than one or two, since
+            the clients only talk to a single gateway host.
+        :keyword int pool_maxsize: Maximum number of connections to keep
+            open per host.
+        :keyword bool pool_block: If True, never open more than
+            ``pool_maxsize`` connections per host. Threads will wait for a
+            free connection instead. If False, extra connections are opened
+            when the pool is exhausted, but are not kept around afterwards.
+        :keyword bool keep_alive: If False, connections are closed after
+            every request. Mostly useful for debugging.
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.keep_alive = keep_alive
+
+        # This is where the connection pools live. urllib3's pools are
+        # thread-safe, so every thread's session can share them.
+        self._adapter = _TimedHTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=pool_block,
+            # Retrying is the clients' job.
+            max_retries=0,
+        )
+        self._local = threading.local()
+
+    def _get_session(self):
+        """
+        Returns the calling thread's session, creating it if need be. Sessions
+        keep some state of their own (cookies, mostly), so they aren't shared
+        between threads.
+
+        :rtype: requests.Session
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('https://', self._adapter)
+            session.mount('http://', self._adapter)
+            self._local.session = session
+        return session
+
+    def post(self, url, data=None, headers=None, timeout=None, stream=False):
+        """
+        POSTs to the given URL over a pooled connection.
+
+        :param str url: Full URI to POST to.
+        :keyword data: A dict of form values, or an already-encoded body.
+        :keyword dict headers: Any extra HTTP headers to send.
+        :keyword timeout: Socket timeout in seconds.
+        :keyword bool stream: If True, the body isn't read until asked for.
+            Close the response when done with it, or read it to the end, to
+            return the connection to the pool.
+        :rtype: requests.Response
+        :returns: The response, with an extra ``timings`` attribute. This is
+            a dict of how long (in seconds) each phase of the request took:
+            ``connect`` and ``tls`` (both zero on re-used connections),
+            ``server`` (from sending the request until the response headers
+            came in) and ``transfer`` (reading the body).
+        :raises: :py:class:`ConnectError` if the connection couldn't be
+            made, or whatever else requests raises.
+        """
+        if not self.keep_alive:
+            headers = dict(headers or {})
+            headers['Connection'] = 'close'
+
+        _timings.__dict__.clear()
+        started = _clock()
+        try:
+            response = self._get_session().post(
+                url,
+                data=data,
+                headers=headers,
+                timeout=timeout,
+                stream=stream
+            )
+        except requests.exceptions.ConnectionError as exc:
+            reason = exc.args[0] if exc.args else None
+            if isinstance(reason, MaxRetryError) and \
+                    isinstance(reason.reason, NewConnectionError):
+                raise ConnectError(*exc.args, request=exc.request)
+            raise
+        total = _clock() - started
+
+        connect = getattr(_timings, 'connect', 0.0)
+        tls = getattr(_timings, 'tls', 0.0)
+        # Measured by requests, from sending until the headers were parsed.
+        until_headers = response.elapsed.total_seconds()
+        response.timings = {
+            'connect': connect,
+            'tls': tls,
+            'server': max(0.0, until_headers - connect - tls),
+            'transfer': max(0.0, total - until_headers),
+        }
+        return response
+
+    def close(self):
+        """
+        Closes all pooled connections. The transport may still be used
+        afterwards, new connections will be opened as needed.
+        """
+        self._adapter.close()
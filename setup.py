@@ -27,8 +27,13 @@ setup(
         'bluefin',
         'bluefin.directmode',
         'bluefin.dataretrieval',
+        'bluefin.testing',
     ],
     install_requires=['requests'],
+    extras_require={
+        'async': ['aiohttp'],
+        'columnar': ['numpy'],
+    },
     author='Gregory Taylor',
     author_email='gtaylor@duointeractive.com',
     url='https://github.com/duointeractive/python-bluefin/',
@@ -0,0 +1,168 @@
+import socket
+import unittest
+from bluefin.directmode.exceptions import V3ClientException, V3ClientInputException, V3ClientDeclinedException
+from bluefin.testing.gateway import StubServer
+
+try:
+    import asyncio
+    from bluefin.directmode.aioclients import AsyncV3Client
+except (ImportError, SyntaxError):
+    AsyncV3Client = None
+
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+APPROVED = 'status_code=1&auth_msg=TEST+APPROVED&trans_id=123'
+
+
+@unittest.skipIf(AsyncV3Client is None, "asyncio and aiohttp are required")
+class AsyncV3ClientTests(unittest.TestCase):
+    """
+    Tests for the asyncio Direct Mode client, against a local server.
+    """
+    def setUp(self):
+        self.responses = []
+        self.server = StubServer(self.respond).start()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.server.stop()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def respond(self, path, body):
+        if self.responses:
+            return self.responses.pop(0)
+        return 200, APPROVED
+
+    def run_client(self, coro_func, **kwargs):
+        """
+        Runs coro_func(api) on our loop, closing the client afterwards.
+        """
+        api = AsyncV3Client(host=self.server.url, **kwargs)
+        try:
+            return self.loop.run_until_complete(coro_func(api))
+        finally:
+            self.loop.run_until_complete(api.close())
+
+    def test_basic(self):
+        result = self.run_client(lambda api: api.send_request({'tran_type': 'A'}))
+        self.assertEqual(result['status_code'], '1')
+        self.assertEqual(result['auth_msg'], 'TEST APPROVED')
+
+    def test_default_values(self):
+        self.run_client(lambda api: api.send_request({'tran_type': 'A'}),
+                        account_id=123, dynip_sec_code='SECRET')
+        path, body = self.server.requests[0]
+        values = parse_qs(body.decode('utf-8'))
+        self.assertEqual(path, '/gw/sas/direct3.1')
+        self.assertEqual(values['account_id'], ['123'])
+        self.assertEqual(values['dynip_sec_code'], ['SECRET'])
+        self.assertEqual(values['tran_type'], ['A'])
+
+    def test_retries_408(self):
+        self.responses = [(408, 'Timeout'), (408, 'Timeout')]
+        result = self.run_client(lambda api: api.send_request({}))
+        self.assertEqual(result['status_code'], '1')
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_max_retries(self):
+        self.responses = [(408, 'Timeout')] * 3
+        self.assertRaises(V3ClientException,
+                          self.run_client,
+                          lambda api: api.send_request({}), max_retries=1)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_input_error(self):
+        self.responses = [(601, 'Missing card number')]
+        self.assertRaises(V3ClientInputException, self.run_client,
+                          lambda api: api.send_request({}))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_declined(self):
+        self.responses = [(200, 'status_code=0&auth_msg=AUTH+DECLINED')]
+        self.assertRaises(V3ClientDeclinedException, self.run_client,
+                          lambda api: api.send_request({}))
+
+    def test_failover(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        dead_url = 'http://127.0.0.1:%d' % sock.getsockname()[1]
+        sock.close()
+
+        api = AsyncV3Client(host=[dead_url, self.server.url])
+        try:
+            result = self.loop.run_until_complete(api.send_request({}))
+        finally:
+            self.loop.run_until_complete(api.close())
+        self.assertEqual(result['status_code'], '1')
+        self.assertEqual(api.router.snapshot()[0]['failures'], 1)
+
+    def test_default_breaker_trips(self):
+        from bluefin.circuitbreaker import OPEN, CircuitBreaker
+        from bluefin.ratelimit import RateLimiter
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        dead_url = 'http://127.0.0.1:%d' % sock.getsockname()[1]
+        sock.close()
+
+        breaker = CircuitBreaker(failure_threshold=1)
+        api = AsyncV3Client(host=dead_url, max_retries=0,
+                            circuit_breaker=breaker)
+        try:
+            self.assertRaises(Exception, self.loop.run_until_complete,
+                              api.send_request({}))
+        finally:
+            self.loop.run_until_complete(api.close())
+        self.assertEqual(breaker.state, OPEN)
+        limiter = RateLimiter()
+        AsyncV3Client(limiter=limiter)
+        self.assertTrue(limiter.is_throttled(asyncio.TimeoutError()))
+        # Exceptions that were passed in are left alone.
+        breaker = CircuitBreaker(failure_exceptions=(KeyError,))
+        AsyncV3Client(circuit_breaker=breaker)
+        self.assertEqual(breaker.failure_exceptions, (KeyError,))
+
+    def test_limiter(self):
+        from bluefin.ratelimit import RateLimiter
+        limiter = RateLimiter(concurrency=3, adaptive=False)
+
+        def gather(api):
+            return asyncio.gather(*[api.send_request({}) for i in range(20)])
+
+        results = self.run_client(gather, limiter=limiter)
+        self.assertEqual(len(results), 20)
+        self.assertTrue(len(self.server.client_ports) <= 3)
+        self.assertEqual(limiter.snapshot()['in_flight'], 0)
+
+    def test_concurrency(self):
+        """
+        Many requests in flight at once, over a handful of connections.
+        """
+        def gather(api):
+            return asyncio.gather(*[api.send_request({}) for i in range(50)])
+
+        results = self.run_client(gather, concurrency=5)
+        self.assertEqual(len(results), 50)
+        self.assertTrue(all(r['status_code'] == '1' for r in results))
+        self.assertTrue(len(self.server.client_ports) <= 5)
+
+    def test_send_batch(self):
+        self.responses = [(200, APPROVED), (601, 'Missing card number')]
+        values = [{'n': str(i)} for i in range(10)]
+
+        def batch(api):
+            return api.send_batch(values, concurrency=3)
+
+        results = self.run_client(batch)
+        self.assertEqual([r.index for r in results], list(range(10)))
+        failed = [r for r in results if not r.ok]
+        self.assertEqual(len(failed), 1)
+        self.assertTrue(isinstance(failed[0].exception, V3ClientInputException))
+        self.assertTrue(all(r.result['status_code'] == '1'
+                            for r in results if r.ok))
+        self.assertEqual(len(self.server.requests), 10)
+        self.assertTrue(len(self.server.client_ports) <= 3)
@@ -0,0 +1,90 @@
+import itertools
+import random
+import time
+import unittest
+from bluefin.batch import run_parallel
+from bluefin.directmode.clients import V3Client
+from bluefin.directmode.exceptions import V3ClientDeclinedException
+from bluefin.testing.gateway import StubServer
+
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+
+def respond(path, body):
+    values = parse_qs(body.decode('utf-8'))
+    amount = values['amount'][0]
+    if amount == '13':
+        return 200, 'status_code=0&auth_msg=AUTH+DECLINED'
+    return 200, 'status_code=1&trans_id=%s' % amount
+
+
+class SendBatchTests(unittest.TestCase):
+    """
+    Tests for V3Client.send_batch(), against a local server.
+    """
+    def setUp(self):
+        self.server = StubServer(respond).start()
+        self.api = V3Client(host=self.server.url)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_ordered(self):
+        charges = ({'amount': i} for i in range(30))
+        results = list(self.api.send_batch(charges, concurrency=5))
+        self.assertEqual([r.index for r in results], list(range(30)))
+        for result in results:
+            if result.index == 13:
+                self.assertFalse(result.ok)
+                self.assertTrue(isinstance(result.exception,
+                                           V3ClientDeclinedException))
+                self.assertRaises(V3ClientDeclinedException, result.get)
+            else:
+                self.assertEqual(result.get()['trans_id'], str(result.index))
+        self.assertTrue(len(self.server.client_ports) <= 5)
+
+    def test_unordered(self):
+        charges = ({'amount': i} for i in range(30))
+        results = list(self.api.send_batch(charges, concurrency=5,
+                                           ordered=False))
+        self.assertEqual(sorted(r.index for r in results), list(range(30)))
+
+
+class RunParallelTests(unittest.TestCase):
+    """
+    Tests for the thread pool behind send_batch().
+    """
+    def test_lazy_consumption(self):
+        """
+        Endless inputs are fine, since items are only pulled as needed.
+        """
+        results = run_parallel(lambda x: x * 2, itertools.count(), concurrency=3)
+        first = list(itertools.islice(results, 100))
+        results.close()
+        self.assertEqual([r.result for r in first], list(range(0, 200, 2)))
+
+    def test_ordered_with_varying_times(self):
+        def slow(x):
+            time.sleep(random.random() / 100)
+            return x
+
+        results = list(run_parallel(slow, range(50), concurrency=8))
+        self.assertEqual([r.result for r in results], list(range(50)))
+
+    def test_close_drops_pending(self):
+        calls = []
+
+        def record(x):
+            calls.append(x)
+            time.sleep(0.01)
+            return x
+
+        results = run_parallel(record, range(1000), concurrency=2)
+        next(results)
+        results.close()
+        time.sleep(0.1)
+        # Only the items in the window were ever started.
+        self.assertTrue(len(calls) <= 4, calls)
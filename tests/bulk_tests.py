@@ -0,0 +1,85 @@
+import datetime
+import multiprocessing
+import unittest
+from bluefin.dataretrieval.bulk import parse_records
+from bluefin.dataretrieval.clients import V1Client
+from bluefin.testing.gateway import StubServer, generate_report
+
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+DAY = datetime.date(2011, 1, 1)
+
+
+def count_records(body):
+    return len(parse_records(body))
+
+
+class BulkReportTests(unittest.TestCase):
+    """
+    Tests for V1Client.bulk_reports(), against a local server.
+    """
+    def setUp(self):
+        self.server = StubServer(self.respond).start()
+        self.api = V1Client(host=self.server.url)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def respond(self, path, body):
+        values = parse_qs(body.decode('utf-8'))
+        site_tag = values['site_tag'][0]
+        if site_tag == 'BROKEN':
+            return 600, 'Invalid site_tag'
+        size = int(values['size'][0])
+        return 200, generate_report(((DAY, n) for n in range(size)), site_tag)
+
+    def accounts(self, count):
+        return [{'site_tag': 'SITE%d' % i, 'size': str(10 + i)}
+                for i in range(count)]
+
+    def test_bulk_reports(self):
+        accounts = self.accounts(6)
+        results = list(self.api.bulk_reports(accounts, concurrency=3,
+                                             processes=2))
+        self.assertEqual(len(results), 6)
+        by_site = dict((r.values['site_tag'], r.get()) for r in results)
+        for account in accounts:
+            records = by_site[account['site_tag']]
+            self.assertEqual(len(records), int(account['size']))
+            self.assertEqual(records[0]['site_tag'], account['site_tag'])
+
+    def test_ordered(self):
+        accounts = self.accounts(5)
+        results = list(self.api.bulk_reports(accounts, transform=count_records,
+                                             processes=2, ordered=True))
+        self.assertEqual([r.result for r in results], [10, 11, 12, 13, 14])
+
+    def test_in_threads(self):
+        results = list(self.api.bulk_reports(self.accounts(3),
+                                             transform=count_records,
+                                             processes=0, ordered=True))
+        self.assertEqual([r.result for r in results], [10, 11, 12])
+
+    def test_shared_pool(self):
+        pool = multiprocessing.Pool(2)
+        try:
+            results = list(self.api.bulk_reports(
+                self.accounts(3), transform=count_records, pool=pool))
+            self.assertEqual(sorted(r.result for r in results), [10, 11, 12])
+            # Still usable afterwards.
+            self.assertEqual(pool.apply(count_records, (b'a=1',)), 1)
+        finally:
+            pool.close()
+            pool.join()
+
+    def test_failures_are_isolated(self):
+        accounts = self.accounts(2) + [{'site_tag': 'BROKEN', 'size': '1'}]
+        results = list(self.api.bulk_reports(accounts, processes=2,
+                                             ordered=True))
+        self.assertTrue(results[0].ok)
+        self.assertTrue(results[1].ok)
+        self.assertFalse(results[2].ok)
+        self.assertEqual(results[2].exception.error_code, 600)
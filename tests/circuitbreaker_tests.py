@@ -0,0 +1,146 @@
+import time
+import unittest
+from requests.exceptions import ReadTimeout
+from bluefin import circuitbreaker
+from bluefin.circuitbreaker import CircuitBreaker
+from bluefin.dataretrieval.clients import V1Client
+from bluefin.dataretrieval.exceptions import V1ClientCircuitOpenException
+from bluefin.directmode.clients import V3Client
+from bluefin.directmode.exceptions import V3ClientException, V3ClientProcessingException, V3ClientDeclinedException, V3ClientInputException, V3ClientCircuitOpenException
+from bluefin.retry import RetryPolicy
+from bluefin.testing.gateway import StubServer
+
+APPROVED = 'status_code=1&auth_msg=TEST+APPROVED&trans_id=123'
+
+
+class CircuitBreakerTests(unittest.TestCase):
+    """
+    Tests for the breaker's state machine.
+    """
+    def test_is_failure(self):
+        breaker = CircuitBreaker()
+        self.assertTrue(breaker.is_failure(ReadTimeout()))
+        self.assertTrue(breaker.is_failure(V3ClientException('', error_code=503)))
+        self.assertTrue(breaker.is_failure(V3ClientProcessingException('', error_code=701)))
+        self.assertFalse(breaker.is_failure(V3ClientInputException('', error_code=601)))
+        self.assertFalse(breaker.is_failure(V3ClientDeclinedException('', error_code='0')))
+        self.assertFalse(breaker.is_failure(V3ClientException('', error_code=408)))
+
+    def test_opens_and_recovers(self):
+        breaker = CircuitBreaker(failure_threshold=3, cooldown=0.05)
+        failure = V3ClientException('', error_code=503)
+
+        for i in range(2):
+            self.assertTrue(breaker.allow_request())
+            breaker.record(failure)
+        self.assertEqual(breaker.state, circuitbreaker.CLOSED)
+
+        breaker.record(failure)
+        self.assertEqual(breaker.state, circuitbreaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+        self.assertEqual(breaker.snapshot()['rejected'], 1)
+
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, circuitbreaker.HALF_OPEN)
+        # One probe at a time.
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        breaker.record()
+        self.assertEqual(breaker.state, circuitbreaker.CLOSED)
+        self.assertEqual(breaker.snapshot()['consecutive_failures'], 0)
+
+    def test_failed_probe_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=0.05)
+        breaker.record(ReadTimeout())
+        time.sleep(0.06)
+        self.assertTrue(breaker.allow_request())
+        breaker.record(ReadTimeout())
+        self.assertEqual(breaker.state, circuitbreaker.OPEN)
+        self.assertEqual(breaker.snapshot()['times_opened'], 2)
+
+    def test_late_success_keeps_it_open(self):
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=60)
+        # Sent before the trip, back after it.
+        self.assertTrue(breaker.allow_request())
+        breaker.record(ReadTimeout())
+        breaker.record()
+        self.assertEqual(breaker.state, circuitbreaker.OPEN)
+        self.assertFalse(breaker.allow_request())
+
+    def test_late_success_while_half_open(self):
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=0.05)
+        # Sent before the trip, back once the probes have started.
+        late = breaker.allow_request()
+        breaker.record(ReadTimeout(), breaker.allow_request())
+        time.sleep(0.06)
+        probe = breaker.allow_request()
+        self.assertTrue(probe)
+        breaker.record(None, late)
+        self.assertEqual(breaker.state, circuitbreaker.HALF_OPEN)
+        # Still one probe at a time.
+        self.assertFalse(breaker.allow_request())
+        breaker.record(None, probe)
+        self.assertEqual(breaker.state, circuitbreaker.CLOSED)
+
+    def test_late_failure_while_open(self):
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=0.1)
+        late = breaker.allow_request()
+        breaker.record(ReadTimeout(), breaker.allow_request())
+        retry_in = breaker.snapshot()['retry_in']
+        time.sleep(0.05)
+        breaker.record(ReadTimeout(), late)
+        snapshot = breaker.snapshot()
+        # The cooldown carries on from the first failure.
+        self.assertTrue(snapshot['retry_in'] < retry_in - 0.04)
+        self.assertEqual(snapshot['times_opened'], 1)
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, circuitbreaker.HALF_OPEN)
+
+    def test_success_resets_count(self):
+        breaker = CircuitBreaker(failure_threshold=2)
+        breaker.record(ReadTimeout())
+        breaker.record()
+        breaker.record(ReadTimeout())
+        self.assertEqual(breaker.state, circuitbreaker.CLOSED)
+
+
+class ClientCircuitBreakerTests(unittest.TestCase):
+    """
+    Tests for the clients' use of the breaker, against a local server.
+    """
+    def setUp(self):
+        self.status = 200
+        self.server = StubServer(lambda path, body: (self.status, APPROVED)).start()
+        self.breaker = CircuitBreaker(failure_threshold=3, cooldown=0.05)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_v3_fails_fast(self):
+        self.status = 701
+        api = V3Client(host=self.server.url, circuit_breaker=self.breaker)
+        for i in range(3):
+            self.assertRaises(V3ClientProcessingException, api.send_request, {})
+        self.assertRaises(V3ClientCircuitOpenException, api.send_request, {})
+        self.assertEqual(len(self.server.requests), 3)
+
+        self.status = 200
+        time.sleep(0.06)
+        self.assertEqual(api.send_request({})['status_code'], '1')
+        self.assertEqual(self.breaker.state, circuitbreaker.CLOSED)
+
+    def test_v3_declines_are_not_failures(self):
+        api = V3Client(host=self.server.url, circuit_breaker=self.breaker)
+        self.server.responder = lambda path, body: (200, 'status_code=0&auth_msg=AUTH+DECLINED')
+        for i in range(5):
+            self.assertRaises(V3ClientDeclinedException, api.send_request, {})
+        self.assertEqual(self.breaker.state, circuitbreaker.CLOSED)
+
+    def test_v1_fails_fast(self):
+        self.status = 503
+        api = V1Client(host=self.server.url, circuit_breaker=self.breaker,
+                       retry_policy=RetryPolicy(max_retries=5, backoff_base=0,
+                                                retry_statuses=(503,)))
+        # The breaker opens mid-retry.
+        self.assertRaises(V1ClientCircuitOpenException, api.send_request, {})
+        self.assertEqual(len(self.server.requests), 3)
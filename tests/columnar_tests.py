@@ -0,0 +1,151 @@
+import datetime
+import decimal
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from bluefin.parsing import iter_fields, iter_records
+from bluefin.testing.gateway import StubServer, generate_report
+
+try:
+    import numpy
+    from bluefin.dataretrieval.columnar import ColumnarReport
+except ImportError:
+    ColumnarReport = None
+
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+DAYS = [datetime.date(2011, 1, 1), datetime.date(2011, 1, 2)]
+REPORT = generate_report((day, n) for day in DAYS for n in range(20))
+
+
+@unittest.skipIf(ColumnarReport is None, "NumPy is required")
+class ColumnarReportTests(unittest.TestCase):
+    def setUp(self):
+        self.records = list(iter_records(iter_fields([REPORT])))
+        self.report = ColumnarReport.from_fields(iter_fields([REPORT]))
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def expected_total(self, records):
+        return sum((decimal.Decimal(r['settle_amount']) for r in records),
+                   decimal.Decimal('0.00'))
+
+    def test_columns(self):
+        report = self.report
+        self.assertEqual(len(report), 40)
+        self.assertEqual(report.names, [
+            'trans_id', 'auth_date', 'settle_amount', 'settle_currency',
+            'status_code', 'processor', 'site_tag'])
+        self.assertEqual(report['trans_id'].tolist(),
+                         [r['trans_id'] for r in self.records])
+        self.assertEqual(report['settle_amount'].dtype, numpy.int64)
+        self.assertEqual(report['settle_amount'][1], 201)
+        self.assertEqual(report['auth_date'].dtype,
+                         numpy.dtype('datetime64[s]'))
+        self.assertEqual(report['auth_date'][1],
+                         numpy.datetime64('2011-01-01T00:01:00'))
+
+    def test_from_records(self):
+        report = ColumnarReport.from_records(self.records)
+        self.assertEqual(report['trans_id'].tolist(),
+                         self.report['trans_id'].tolist())
+        self.assertEqual(report.total(), self.report.total())
+
+    def test_missing_fields(self):
+        report = ColumnarReport.from_fields([
+            ('trans_id', '1'), ('settle_amount', '1.50'), ('note', 'a'),
+            ('trans_id', '2'), ('settle_amount', '2.00'),
+            ('trans_id', '3'), ('note', 'c'),
+        ])
+        self.assertEqual(len(report), 3)
+        self.assertEqual(report['note'].tolist(), ['a', '', 'c'])
+        self.assertEqual(report['settle_amount'].tolist(), [150, 200, 0])
+
+    def test_where(self):
+        approved = self.report.where(status_code='1', processor='VISA')
+        expected = [r for r in self.records
+                    if r['status_code'] == '1' and r['processor'] == 'VISA']
+        self.assertEqual(approved['trans_id'].tolist(),
+                         [r['trans_id'] for r in expected])
+        mask = self.report['settle_amount'] > 1100
+        self.assertEqual(len(self.report[mask]), 2 * 10)
+
+    def test_totals(self):
+        self.assertEqual(self.report.total(), self.expected_total(self.records))
+        by_status = self.report.total_by('status_code')
+        self.assertEqual(sorted(by_status), ['0', '1'])
+        for status, total in by_status.items():
+            self.assertEqual(total, self.expected_total(
+                [r for r in self.records if r['status_code'] == status]))
+        by_day = self.report.total_by('day')
+        self.assertEqual(sorted(by_day), DAYS)
+        self.assertEqual(by_day[DAYS[0]], self.expected_total(self.records[:20]))
+        self.assertEqual(self.report.count_by('processor'),
+                         {'VISA': 20, 'TEST': 20})
+
+    def test_to_csv(self):
+        report = ColumnarReport.from_records([
+            {'trans_id': '1', 'settle_amount': '-1.05', 'auth_msg': 'A, "B"',
+             'auth_date': '2011-01-01 12:30:00'},
+            {'trans_id': '2', 'settle_amount': '10.00', 'auth_msg': 'OK',
+             'auth_date': ''},
+        ])
+        path = os.path.join(self.tmpdir, 'report.csv')
+        report.to_csv(path, names=['trans_id', 'settle_amount', 'auth_msg',
+                                   'auth_date'])
+        with io.open(path, encoding='utf-8') as f:
+            self.assertEqual(f.read().splitlines(), [
+                'trans_id,settle_amount,auth_msg,auth_date',
+                '1,-1.05,"A, ""B""",2011-01-01 12:30:00',
+                '2,10.00,OK,',
+            ])
+
+    def test_to_csv_chunks(self):
+        report = ColumnarReport.from_records(
+            [{'trans_id': str(n), 'settle_amount': '1.00'} for n in range(5)])
+        report.csv_chunk_rows = 2
+        path = os.path.join(self.tmpdir, 'report.csv')
+        report.to_csv(path, names=['trans_id', 'settle_amount'])
+        with io.open(path, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], 'trans_id,settle_amount')
+        self.assertEqual(lines[1:], ['%d,1.00' % n for n in range(5)])
+
+    def test_npz(self):
+        path = os.path.join(self.tmpdir, 'report.npz')
+        self.report.to_npz(path)
+        report = ColumnarReport.from_npz(path)
+        self.assertEqual(report.names, self.report.names)
+        self.assertEqual(report.total_by('day'), self.report.total_by('day'))
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is required")
+    def test_parquet(self):
+        path = os.path.join(self.tmpdir, 'report.parquet')
+        self.report.to_parquet(path)
+        table = pyarrow.parquet.read_table(path)
+        self.assertEqual(table.num_rows, 40)
+        self.assertEqual(table.column('settle_amount')[1].as_py(),
+                         decimal.Decimal('2.01'))
+
+
+@unittest.skipIf(ColumnarReport is None, "NumPy is required")
+class V1ClientColumnarTests(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer(lambda path, body: (200, REPORT)).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_columnar_report(self):
+        from bluefin.dataretrieval.clients import V1Client
+        api = V1Client(host=self.server.url)
+        report = api.columnar_report({}, chunk_size=100)
+        self.assertEqual(len(report), 40)
+        self.assertEqual(report.count_by('day'), {DAYS[0]: 20, DAYS[1]: 20})
@@ -0,0 +1,82 @@
+import unittest
+from bluefin.directmode import declines
+from bluefin.directmode.clients import V3Client
+from bluefin.directmode.declines import DeclineClassifier, classify
+from bluefin.directmode.exceptions import V3ClientDeclinedException
+
+
+class DeclineClassifierTests(unittest.TestCase):
+    def test_default_rules(self):
+        self.assertEqual(classify('CVV2 MISMATCH').category,
+                         declines.SECURITY_CODE)
+        self.assertEqual(classify('INVALID CARD NO').category,
+                         declines.INVALID_CARD)
+        self.assertEqual(classify('C/DECLINED').category, declines.DECLINED)
+        self.assertEqual(classify('auth declined').category, declines.DECLINED)
+        self.assertTrue(classify('SOMETHING ELSE') is declines.UNCLASSIFIED)
+        self.assertTrue(classify('') is declines.UNCLASSIFIED)
+        self.assertTrue(classify(None) is declines.UNCLASSIFIED)
+
+    def test_longest_prefix(self):
+        classifier = DeclineClassifier(rules=())
+        classifier.add('DECLINED', 'declined')
+        classifier.add('DECLINED - CALL', 'call_issuer', retryable=True,
+                       message='Please call your bank.')
+        self.assertEqual(classifier.classify('DECLINED').category, 'declined')
+        self.assertEqual(classifier.classify('DECLINED - C').category,
+                         'declined')
+        decline = classifier.classify('DECLINED - CALL 800-555-0100')
+        self.assertEqual(decline.category, 'call_issuer')
+        self.assertTrue(decline.retryable)
+        self.assertEqual(classifier.classify('DECLINE').category, 'unknown')
+
+        # Replacing a rule keeps the longer ones under it.
+        classifier.add('DECLINED', 'hard_decline')
+        self.assertEqual(classifier.classify('DECLINED').category,
+                         'hard_decline')
+        self.assertEqual(classifier.classify('DECLINED - CALL').category,
+                         'call_issuer')
+        self.assertEqual(len(classifier.rules), 2)
+        self.assertRaises(ValueError, classifier.add, '', 'nothing')
+
+    def test_classify_response(self):
+        self.assertEqual(declines.classifier.classify_response(
+            {'status_code': '1', 'auth_msg': 'APPROVED'}), None)
+        decline = declines.classifier.classify_response(
+            {'status_code': '0', 'reason_code2': 'CVV2 MISMATCH'})
+        self.assertEqual(decline.category, declines.SECURITY_CODE)
+
+
+class DeclinedExceptionTests(unittest.TestCase):
+    def test_exception(self):
+        exc = V3ClientDeclinedException('CVV2 MISMATCH', error_code='0')
+        self.assertEqual(exc.category, declines.SECURITY_CODE)
+        self.assertFalse(exc.retryable)
+        self.assertTrue(exc.message.startswith('The Card Security Code'))
+        self.assertEqual(exc.raw_message, 'CVV2 MISMATCH')
+
+        exc = V3ClientDeclinedException('NEW MESSAGE', error_code='0')
+        self.assertEqual(exc.category, declines.UNKNOWN)
+        self.assertEqual(exc.message, 'NEW MESSAGE')
+
+    def test_runtime_rules(self):
+        rule = declines.classifier.add('ISSUER UNAVAILABLE', 'issuer_down',
+                                       retryable=True)
+        try:
+            api = V3Client()
+            try:
+                api._check_parsed_response_for_error_codes(
+                    {'status_code': 'F', 'auth_msg': 'ISSUER UNAVAILABLE'})
+            except V3ClientDeclinedException as exc:
+                self.assertEqual(exc.category, 'issuer_down')
+                self.assertTrue(exc.retryable)
+                self.assertEqual(exc.error_code, 'F')
+            else:
+                self.fail()
+        finally:
+            declines.classifier = DeclineClassifier()
+
+        class StrictDeclinedException(V3ClientDeclinedException):
+            classifier = DeclineClassifier(rules=[rule])
+        exc = StrictDeclinedException('CVV2 MISMATCH')
+        self.assertEqual(exc.category, declines.UNKNOWN)
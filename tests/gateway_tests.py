@@ -0,0 +1,75 @@
+import datetime
+import unittest
+from bluefin.dataretrieval.clients import V1Client
+from bluefin.directmode.clients import V3Client
+from bluefin.directmode.exceptions import V3ClientException, V3ClientInputException, V3ClientDeclinedException
+from bluefin.retry import RetryPolicy
+from bluefin.testing.gateway import FakeGateway
+
+CHARGE = {
+    'pay_type': 'C',
+    'tran_type': 'A',
+    'account_id': 123456789012,
+    'amount': 1.0,
+    'card_number': 4444333322221111,
+    'card_expire': '1212',
+}
+
+
+class FakeGatewayTests(unittest.TestCase):
+    """
+    Tests for the fake gateway that the benchmarks run against.
+    """
+    def test_approved(self):
+        with FakeGateway() as gateway:
+            result = V3Client(host=gateway.url).send_request(CHARGE)
+        self.assertEqual(result['status_code'], '1')
+        self.assertEqual(result['auth_msg'], 'TEST APPROVED')
+        self.assertEqual(result['settle_amount'], '1.0')
+
+    def test_input_errors(self):
+        with FakeGateway() as gateway:
+            api = V3Client(host=gateway.url)
+            for name in ('card_number', 'amount'):
+                values = CHARGE.copy()
+                del values[name]
+                self.assertRaises(V3ClientInputException, api.send_request, values)
+            self.assertRaises(V3ClientInputException, api.send_request,
+                              dict(CHARGE, amount='a'))
+
+    def test_declines(self):
+        with FakeGateway(decline_rate=1) as gateway:
+            api = V3Client(host=gateway.url)
+            self.assertRaises(V3ClientDeclinedException, api.send_request, CHARGE)
+
+    def test_error_injection(self):
+        with FakeGateway(error_rates={408: 1}, record_requests=True) as gateway:
+            api = V3Client(host=gateway.url, retry_policy=RetryPolicy(
+                max_retries=2, backoff_base=0))
+            self.assertRaises(V3ClientException, api.send_request, CHARGE)
+            self.assertEqual(len(gateway.requests), 3)
+
+    def test_report(self):
+        with FakeGateway(records_per_day=5) as gateway:
+            api = V1Client(host=gateway.url)
+            records = list(api.fetch_report({'site_tag': 'MAIN'},
+                                            datetime.date(2011, 1, 1),
+                                            datetime.date(2011, 1, 10),
+                                            days_per_shard=3))
+        self.assertEqual(len(records), 50)
+        self.assertEqual(records[0]['trans_id'], 'MAIN20110101000000')
+        self.assertEqual(records[0]['site_tag'], 'MAIN')
+
+    def test_report_size(self):
+        with FakeGateway(report_size=1000) as gateway:
+            records = list(V1Client(host=gateway.url).iter_records({}))
+        self.assertEqual(len(records), 1000)
+
+    def test_report_cached(self):
+        with FakeGateway(report_size=10) as gateway:
+            first = gateway.report_response({})
+            self.assertTrue(gateway.report_response({}) is first)
+            self.assertFalse(gateway.report_response({'site_tag': 'X'}) is first)
+            gateway.report_size = 20
+            records = list(V1Client(host=gateway.url).iter_records({}))
+        self.assertEqual(len(records), 20)
@@ -0,0 +1,132 @@
+import threading
+import time
+import unittest
+from bluefin.dataretrieval.clients import V1Client
+from bluefin.dataretrieval.exceptions import V1ClientInputException
+from bluefin.hedging import HedgePolicy
+from bluefin.instrumentation import ATTEMPT, REQUEST
+from bluefin.retry import RetryBudget
+from bluefin.testing.gateway import StubServer
+
+APPROVED = 'status_code=1&auth_msg=TEST+APPROVED&trans_id=123'
+
+
+class HedgePolicyTests(unittest.TestCase):
+    """
+    Tests for the policy itself.
+    """
+    def test_delay(self):
+        policy = HedgePolicy(percentile=90, initial_delay=0.3, min_samples=10,
+                             min_delay=0.02, max_delay=0.5)
+        self.assertEqual(policy.delay(), 0.3)
+        for i in range(1, 11):
+            policy.record(i / 100.0)
+        self.assertEqual(policy.delay(), 0.09)
+
+        policy.record(5.0)
+        policy.record(6.0)
+        self.assertEqual(policy.delay(), 0.5)
+
+        policy = HedgePolicy(min_samples=1, min_delay=0.02)
+        policy.record(0.001)
+        self.assertEqual(policy.delay(), 0.02)
+
+    def test_window(self):
+        policy = HedgePolicy(percentile=0, min_samples=1, min_delay=0,
+                             window=3)
+        for elapsed in (0.1, 0.2, 0.3, 0.4):
+            policy.record(elapsed)
+        # 0.1 has been pushed out.
+        self.assertEqual(policy.delay(), 0.2)
+        self.assertEqual(policy.snapshot()['samples'], 3)
+
+    def test_budget(self):
+        policy = HedgePolicy(budget=RetryBudget(ratio=0.5, capacity=1,
+                                                initial=0))
+        policy.start()
+        self.assertFalse(policy.allow_hedge())
+        policy.start()
+        self.assertTrue(policy.allow_hedge())
+        self.assertFalse(policy.allow_hedge())
+        snapshot = policy.snapshot()
+        self.assertEqual(snapshot['calls'], 2)
+        self.assertEqual(snapshot['hedges'], 1)
+        self.assertEqual(snapshot['hedges_denied'], 2)
+
+
+class HedgedRequestTests(unittest.TestCase):
+    """
+    Tests for V1Client's hedged requests, against a local server.
+    """
+    def setUp(self):
+        # Seconds to stall each request for, in order.
+        self.stalls = []
+        self.responses = []
+        self.lock = threading.Lock()
+        self.server = StubServer(self.respond).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def respond(self, path, body):
+        with self.lock:
+            stall = self.stalls.pop(0) if self.stalls else 0
+            response = self.responses.pop(0) if self.responses else (200, APPROVED)
+        time.sleep(stall)
+        return response
+
+    def client(self, **kwargs):
+        return V1Client(host=self.server.url, hedge_policy=HedgePolicy(
+            initial_delay=0.05, **kwargs))
+
+    def test_not_hedged_when_fast(self):
+        api = self.client()
+        for i in range(5):
+            self.assertEqual(api.send_request({})['status_code'], '1')
+        self.assertEqual(len(self.server.requests), 5)
+        self.assertEqual(api.hedge_policy.snapshot()['hedges'], 0)
+
+    def test_hedged_when_slow(self):
+        self.stalls = [1.0]
+        api = self.client()
+        started = time.time()
+        self.assertEqual(api.send_request({})['status_code'], '1')
+        self.assertTrue(time.time() - started < 0.5)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(api.hedge_policy.snapshot()['hedges'], 1)
+
+    def test_loser_gives_up(self):
+        # The first request stalls past the client's timeout, which would
+        # normally be retried.
+        self.stalls = [1.0]
+        events = []
+        api = V1Client(host=self.server.url, http_timeout=0.2,
+                       listeners=[events.append],
+                       hedge_policy=HedgePolicy(initial_delay=0.05))
+        self.assertEqual(api.send_request({})['status_code'], '1')
+        # Long enough for the loser to time out, and retry if it were
+        # going to.
+        time.sleep(0.5)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual([e.kind for e in events], [ATTEMPT, REQUEST])
+
+    def test_budget_caps_hedges(self):
+        self.stalls = [0.2, 0, 0.2]
+        api = self.client(budget=RetryBudget(ratio=0, capacity=1))
+        api.send_request({})
+        api.send_request({})
+        # One hedge, for the first call.
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(api.hedge_policy.snapshot()['hedges_denied'], 1)
+
+    def test_other_request_may_still_win(self):
+        self.stalls = [0.2]
+        self.responses = [(601, 'Invalid site_tag')]
+        api = self.client()
+        self.assertEqual(api.send_request({})['status_code'], '1')
+
+    def test_failure(self):
+        self.responses = [(601, 'Invalid site_tag')]
+        api = self.client()
+        self.assertRaises(V1ClientInputException, api.send_request, {})
+        self.assertEqual(len(self.server.requests), 1)
@@ -0,0 +1,218 @@
+import threading
+import time
+import unittest
+from bluefin.cache import TTLCache
+from bluefin.directmode.clients import V3Client
+from bluefin.directmode.exceptions import V3ClientDeclinedException, V3ClientException
+from bluefin.directmode.idempotency import IdempotencyCache
+from bluefin.testing.gateway import StubServer
+
+APPROVED = 'status_code=1&auth_msg=TEST+APPROVED&trans_id=123'
+DECLINED = 'status_code=0&auth_msg=AUTH+DECLINED'
+
+CHARGE = {'pay_type': 'C', 'tran_type': 'A', 'amount': '1.00',
+          'card_number': '4111111111111111'}
+
+
+class TTLCacheTests(unittest.TestCase):
+    def test_expiry(self):
+        cache = TTLCache()
+        cache.set('a', 1, ttl=0.05)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        time.sleep(0.1)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.get('b'), 2)
+
+    def test_lru_eviction(self):
+        cache = TTLCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        # Touching 'a' makes 'b' the least recently used.
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(len(cache), 2)
+
+    def test_max_bytes(self):
+        cache = TTLCache(max_bytes=100)
+        cache.set('a', 1, size=40)
+        cache.set('b', 2, size=40)
+        cache.set('c', 3, size=40)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.bytes, 80)
+        # Too big to keep at all.
+        cache.set('d', 4, size=101)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.bytes, 0)
+        self.assertEqual(cache.evictions, 4)
+
+    def test_add(self):
+        cache = TTLCache()
+        self.assertTrue(cache.add('a', 1))
+        self.assertFalse(cache.add('a', 2))
+        self.assertEqual(cache.get('a'), 1)
+        cache.delete('a')
+        self.assertTrue(cache.add('a', 3))
+
+
+class IdempotencyTests(unittest.TestCase):
+    """
+    Tests for request de-duplication, against a local server.
+    """
+    def setUp(self):
+        self.body = APPROVED
+        self.status = 200
+        self.delay = 0
+        self.server = StubServer(self.respond).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def respond(self, path, body):
+        time.sleep(self.delay)
+        return self.status, self.body
+
+    def make_client(self, **kwargs):
+        return V3Client(host=self.server.url, max_retries=0,
+                        idempotency=IdempotencyCache(**kwargs))
+
+    def test_duplicate_key(self):
+        api = self.make_client()
+        first = api.send_request(CHARGE, idempotency_key='order-1')
+        second = api.send_request(CHARGE, idempotency_key='order-1')
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.server.requests), 1)
+        api.send_request(CHARGE, idempotency_key='order-2')
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_fingerprint(self):
+        api = self.make_client()
+        api.send_request(CHARGE)
+        api.send_request(dict(CHARGE))
+        self.assertEqual(len(self.server.requests), 1)
+        api.send_request(dict(CHARGE, amount='2.00'))
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_fingerprint_secret(self):
+        other_card = dict(CHARGE, card_number='4444333322221111')
+        # The default backend gets a random secret.
+        cache = IdempotencyCache()
+        self.assertNotEqual(cache.fingerprint(CHARGE),
+                            cache.fingerprint(other_card))
+        self.assertNotEqual(cache.fingerprint(CHARGE),
+                            IdempotencyCache().fingerprint(CHARGE))
+        # A shared backend needs one passed in.
+        self.assertRaises(ValueError, IdempotencyCache, backend=TTLCache())
+        IdempotencyCache(backend=TTLCache(), use_fingerprints=False)
+        cache = IdempotencyCache(backend=TTLCache(), secret='s3cret')
+        self.assertNotEqual(cache.fingerprint(CHARGE),
+                            cache.fingerprint(other_card))
+        self.assertEqual(cache.fingerprint(CHARGE),
+                         IdempotencyCache(secret=b's3cret').fingerprint(CHARGE))
+        self.assertNotEqual(cache.fingerprint(CHARGE),
+                            IdempotencyCache(secret='other').fingerprint(CHARGE))
+
+    def test_shared_backend_different_cards(self):
+        backend = TTLCache()
+        api = V3Client(host=self.server.url, max_retries=0,
+                       idempotency=IdempotencyCache(backend=backend,
+                                                    secret='s3cret'))
+        api.send_request(CHARGE)
+        api.send_request(dict(CHARGE, card_number='4444333322221111'))
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_backend_io_unlocked(self):
+        """
+        A slow backend call for one key shouldn't hold up the others.
+        """
+        release = threading.Event()
+
+        class SlowBackend(TTLCache):
+            def get(self, key):
+                if 'slow' in key:
+                    release.wait(5)
+                return TTLCache.get(self, key)
+
+        api = V3Client(host=self.server.url, max_retries=0,
+                       idempotency=IdempotencyCache(backend=SlowBackend(),
+                                                    secret='s3cret'))
+        slow = threading.Thread(target=api.send_request, args=(CHARGE,),
+                                kwargs={'idempotency_key': 'slow'})
+        slow.start()
+        try:
+            api.send_request(CHARGE, idempotency_key='fast')
+            self.assertEqual(len(self.server.requests), 1)
+        finally:
+            release.set()
+            slow.join()
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_no_fingerprints(self):
+        api = self.make_client(use_fingerprints=False)
+        api.send_request(CHARGE)
+        api.send_request(CHARGE)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_expired(self):
+        api = self.make_client(ttl=0.05)
+        api.send_request(CHARGE, idempotency_key='order-1')
+        time.sleep(0.1)
+        api.send_request(CHARGE, idempotency_key='order-1')
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_declines_are_cached(self):
+        self.body = DECLINED
+        api = self.make_client()
+        for i in range(2):
+            try:
+                api.send_request(CHARGE, idempotency_key='order-1')
+                self.fail("Should have been declined.")
+            except V3ClientDeclinedException as exc:
+                self.assertEqual(exc.raw_message, 'AUTH DECLINED')
+                self.assertEqual(exc.error_code, '0')
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_unknown_outcomes_are_not_cached(self):
+        self.status = 500
+        api = self.make_client()
+        self.assertRaises(V3ClientException, api.send_request, CHARGE,
+                          idempotency_key='order-1')
+        self.status = 200
+        result = api.send_request(CHARGE, idempotency_key='order-1')
+        self.assertEqual(result['status_code'], '1')
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_join_in_flight(self):
+        """
+        Concurrent duplicates should wait for the first one's result.
+        """
+        self.delay = 0.1
+        api = self.make_client()
+        results = []
+
+        def worker():
+            results.append(api.send_request(CHARGE, idempotency_key='order-1'))
+
+        threads = [threading.Thread(target=worker) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 5)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_shared_backend(self):
+        """
+        Clients sharing a backend should de-duplicate between themselves.
+        """
+        backend = TTLCache()
+        api1 = V3Client(host=self.server.url, idempotency=IdempotencyCache(
+            backend=backend, secret='s3cret'))
+        api2 = V3Client(host=self.server.url, idempotency=IdempotencyCache(
+            backend=backend, secret='s3cret'))
+        api1.send_request(CHARGE, idempotency_key='order-1')
+        api2.send_request(CHARGE, idempotency_key='order-1')
+        self.assertEqual(len(self.server.requests), 1)
@@ -0,0 +1,26 @@
+import subprocess
+import sys
+import unittest
+
+# Run in a fresh interpreter, since this one has imported everything already.
+SCRIPT = """
+import sys
+import bluefin.directmode.clients, bluefin.dataretrieval.clients
+api = bluefin.directmode.clients.V3Client()
+print(' '.join(m for m in ('requests', 'urllib3', 'multiprocessing', 'numpy')
+               if m in sys.modules))
+"""
+
+
+class ImportTests(unittest.TestCase):
+    def test_http_stack_imported_lazily(self):
+        output = subprocess.check_output([sys.executable, '-c', SCRIPT])
+        self.assertEqual(output.decode('ascii').strip(), '')
+
+    def test_lazy_defaults(self):
+        from bluefin.dataretrieval.clients import V1Client
+        from bluefin.transport import HTTPTransport
+        api = V1Client(max_retries=5)
+        self.assertTrue(isinstance(api.transport, HTTPTransport))
+        self.assertTrue(api.transport is api.transport)
+        self.assertEqual(api.retry_policy.max_retries, 5)
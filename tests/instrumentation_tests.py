@@ -0,0 +1,143 @@
+import unittest
+from requests.exceptions import ConnectionError
+from bluefin.dataretrieval.clients import V1Client
+from bluefin.directmode.clients import V3Client
+from bluefin.directmode.exceptions import V3ClientDeclinedException, V3ClientException
+from bluefin.instrumentation import ATTEMPT, REQUEST, LatencyAggregator, RequestEvent, RequestTrace
+from bluefin.testing.gateway import StubServer
+
+APPROVED = 'status_code=1&auth_msg=TEST+APPROVED&trans_id=123'
+
+CHARGE = {
+    'pay_type': 'C',
+    'tran_type': 'A',
+    'amount': 1.0,
+    'card_number': 4444333322221111,
+    'card_expire': '1212',
+}
+
+
+class InstrumentationTests(unittest.TestCase):
+    """
+    Tests for the clients' request events, against a local server.
+    """
+    def setUp(self):
+        self.responses = []
+        self.events = []
+        self.server = StubServer(self.respond).start()
+        self.api = V3Client(host=self.server.url, account_id=123,
+                            dynip_sec_code='SECRET',
+                            listeners=[self.events.append])
+
+    def tearDown(self):
+        self.server.stop()
+
+    def respond(self, path, body):
+        if self.responses:
+            return self.responses.pop(0)
+        return 200, APPROVED
+
+    def test_events(self):
+        self.responses = [(408, 'Timeout')]
+        self.api.send_request(CHARGE)
+
+        self.assertEqual([e.kind for e in self.events],
+                         [ATTEMPT, ATTEMPT, REQUEST])
+        first, second, request = self.events
+        self.assertEqual(first.attempt, 1)
+        self.assertEqual(first.http_status, 408)
+        self.assertEqual(first.exception, 'V3ClientException')
+        self.assertTrue(first.timings['connect'] > 0)
+        self.assertEqual(second.attempt, 2)
+        self.assertEqual(second.http_status, 200)
+        self.assertEqual(second.exception, None)
+        # Second attempt re-used the connection.
+        self.assertEqual(second.timings['connect'], 0)
+        self.assertEqual(set(second.timings),
+                         set(['connect', 'tls', 'server', 'transfer']))
+
+        self.assertEqual(request.client, 'V3Client')
+        self.assertEqual(request.tran_type, 'A')
+        self.assertEqual(request.pay_type, 'C')
+        self.assertEqual(request.attempt, 2)
+        self.assertEqual(request.status_code, '1')
+        self.assertEqual(set(request.timings), set(['parse', 'total']))
+
+    def test_no_response_no_status(self):
+        class Response(object):
+            status_code = 408
+
+        trace = RequestTrace([self.events.append], 'V3Client', CHARGE)
+        trace.attempt(Response(), V3ClientException('', error_code=408))
+        trace.attempt(None, ConnectionError())
+        trace.finish(ConnectionError())
+        self.assertEqual([e.http_status for e in self.events], [408, None, None])
+
+    def test_no_sensitive_values(self):
+        self.api.send_request(CHARGE)
+        for event in self.events:
+            text = repr(event.as_dict())
+            self.assertFalse('4444333322221111' in text)
+            self.assertFalse('SECRET' in text)
+            self.assertFalse('1212' in text)
+
+    def test_declined(self):
+        self.responses = [(200, 'status_code=0&auth_msg=AUTH+DECLINED')]
+        self.assertRaises(V3ClientDeclinedException, self.api.send_request, CHARGE)
+        request = self.events[-1]
+        self.assertEqual(request.status_code, '0')
+        self.assertEqual(request.exception, 'V3ClientDeclinedException')
+
+    def test_broken_listener(self):
+        def broken(event):
+            raise ValueError("Oops")
+
+        self.api.add_listener(broken)
+        self.assertEqual(self.api.send_request(CHARGE)['status_code'], '1')
+
+    def test_v1_events(self):
+        api = V1Client(host=self.server.url, listeners=[self.events.append])
+        api.send_request({'authorization': 'SECRET'})
+        list(api.iter_records({'authorization': 'SECRET'}))
+        self.assertEqual([e.kind for e in self.events],
+                         [ATTEMPT, REQUEST, ATTEMPT, REQUEST])
+        self.assertEqual(self.events[1].client, 'V1Client')
+
+    def test_v1_stream_stopped_early(self):
+        api = V1Client(host=self.server.url, listeners=[self.events.append])
+        fields = api.iter_fields({'authorization': 'SECRET'})
+        for pair in fields:
+            break
+        fields.close()
+        self.assertEqual([e.kind for e in self.events], [ATTEMPT, REQUEST])
+        self.assertEqual(self.events[1].exception, None)
+
+
+class LatencyAggregatorTests(unittest.TestCase):
+    """
+    Tests for the in-process metrics listener.
+    """
+    def test_percentiles_and_counts(self):
+        metrics = LatencyAggregator()
+        for i in range(1, 101):
+            metrics(RequestEvent(REQUEST, 'V3Client', tran_type='A',
+                                 attempt=1 + (i % 10 == 0), status_code='1',
+                                 timings={'total': i / 1000.0}))
+        metrics(RequestEvent(REQUEST, 'V3Client', tran_type='A', attempt=1,
+                             exception='V3ClientDeclinedException',
+                             timings={'total': 0.5}))
+
+        self.assertEqual(metrics.percentile('A', 50), 0.051)
+        self.assertEqual(metrics.percentile('A', 100), 0.5)
+        self.assertEqual(metrics.percentile('S', 50), None)
+        self.assertEqual(metrics.counts('A'), {
+            '1': 100, 'V3ClientDeclinedException': 1, 'retries': 10})
+
+        summary = metrics.summary()
+        self.assertEqual(summary['A']['latency']['total'][50], 0.051)
+
+    def test_max_samples(self):
+        metrics = LatencyAggregator(max_samples=10)
+        for i in range(100):
+            metrics(RequestEvent(ATTEMPT, 'V1Client', timings={'server': i}))
+        self.assertEqual(metrics.percentile('V1Client', 0, 'server'), 90)
@@ -0,0 +1,105 @@
+import unittest
+from bluefin.dataretrieval.clients import V1Client
+from bluefin.parsing import iter_fields, iter_records, parse_response
+from bluefin.testing.gateway import StubServer
+
+try:
+    from urllib.parse import parse_qsl
+except ImportError:
+    from urlparse import parse_qsl
+
+BODY = (b'trans_id=1&auth_msg=TEST+APPROVED&amount=1.00&blank=&noequals'
+        b'&trans_id=2&auth_msg=C%2FDECLINED&amount=2.50'
+        b'&trans_id=3&auth_msg=caf%C3%A9&amount=3.00')
+
+
+def expected_fields(body):
+    """
+    What parse_qsl makes of the body, decoded as UTF-8 the same way on
+    Python 2 and 3.
+    """
+    if str is not bytes:
+        return parse_qsl(body.decode('utf-8'))
+    return [(k.decode('utf-8'), v.decode('utf-8')) for k, v in parse_qsl(body)]
+
+
+def chunked(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class IterFieldsTests(unittest.TestCase):
+    """
+    Tests for the incremental response parser.
+    """
+    def test_matches_parse_qsl(self):
+        expected = expected_fields(BODY)
+        for size in (1, 2, 3, 7, 64, len(BODY)):
+            fields = list(iter_fields(chunked(BODY, size)))
+            self.assertEqual(fields, expected, size)
+
+    def test_decoding(self):
+        fields = dict(iter_fields([b'a=caf%C3%A9+au+lait&b=x%26y%3Dz']))
+        self.assertEqual(fields[u'a'], u'caf\xe9 au lait')
+        self.assertEqual(fields[u'b'], u'x&y=z')
+
+    def test_empty(self):
+        self.assertEqual(list(iter_fields([])), [])
+        self.assertEqual(list(iter_fields([b''])), [])
+
+    def test_records(self):
+        records = list(iter_records(iter_fields([BODY])))
+        self.assertEqual([r['trans_id'] for r in records], ['1', '2', '3'])
+        self.assertEqual(records[1]['auth_msg'], 'C/DECLINED')
+        self.assertEqual(records[2]['amount'], '3.00')
+
+
+class ParseResponseTests(unittest.TestCase):
+    """
+    Tests for the single-pass response parser.
+    """
+    def test_matches_parse_qs(self):
+        expected = {}
+        for k, v in expected_fields(BODY):
+            expected[k] = expected[k] + ',' + v if k in expected else v
+        self.assertEqual(parse_response(BODY), expected)
+
+    def test_repeated_keys(self):
+        result = parse_response(BODY)
+        self.assertEqual(result['trans_id'], '1,2,3')
+        self.assertEqual(result['auth_msg'], u'TEST APPROVED,C/DECLINED,caf\xe9')
+
+    def test_skips_blanks(self):
+        result = parse_response(b'a=1&&b=&c&=d&e=2')
+        self.assertEqual(result, {'a': '1', '': 'd', 'e': '2'})
+
+    def test_text_body(self):
+        self.assertEqual(parse_response(u'a=caf%C3%A9'), {'a': u'caf\xe9'})
+
+    def test_empty(self):
+        self.assertEqual(parse_response(b''), {})
+
+
+class V1ClientStreamingTests(unittest.TestCase):
+    """
+    Tests for the streaming V1Client methods, against a local server.
+    """
+    def setUp(self):
+        self.server = StubServer(lambda path, body: (200, BODY)).start()
+        self.api = V1Client(host=self.server.url)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_iter_fields(self):
+        fields = list(self.api.iter_fields({}, chunk_size=5))
+        self.assertEqual(fields, expected_fields(BODY))
+
+    def test_iter_records(self):
+        records = list(self.api.iter_records({}))
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[0]['auth_msg'], 'TEST APPROVED')
+
+    def test_connection_reused(self):
+        list(self.api.iter_records({}))
+        list(self.api.iter_records({}))
+        self.assertEqual(len(self.server.client_ports), 1)
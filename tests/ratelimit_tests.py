@@ -0,0 +1,170 @@
+import threading
+import time
+import unittest
+from requests.exceptions import ReadTimeout
+from bluefin.dataretrieval.clients import V1Client
+from bluefin.dataretrieval.exceptions import V1ClientRateLimitedException
+from bluefin.directmode.clients import V3Client
+from bluefin.directmode.exceptions import V3ClientException, V3ClientInputException, V3ClientRateLimitedException
+from bluefin.ratelimit import RateLimiter
+from bluefin.retry import RetryPolicy
+from bluefin.testing.gateway import StubServer
+
+APPROVED = 'status_code=1&auth_msg=TEST+APPROVED&trans_id=123'
+THROTTLED = V3ClientException('Timeout', error_code=408)
+
+
+class RateLimiterTests(unittest.TestCase):
+    """
+    Tests for the limiter itself.
+    """
+    def test_token_bucket(self):
+        limiter = RateLimiter(rate=100, burst=2, concurrency=None)
+        self.assertEqual(limiter.reserve(), 0)
+        self.assertEqual(limiter.reserve(), 0)
+        self.assertAlmostEqual(limiter.reserve(), 0.01, places=2)
+        # Queued up behind the last one.
+        self.assertAlmostEqual(limiter.reserve(), 0.02, places=2)
+        self.assertEqual(limiter.reserve(max_wait=0.01), None)
+
+    def test_paces_requests(self):
+        limiter = RateLimiter(rate=100, burst=1, concurrency=None)
+        started = time.time()
+        for i in range(6):
+            limiter.release(limiter.acquire())
+        self.assertTrue(time.time() - started >= 0.045)
+
+    def test_in_flight_limit(self):
+        limiter = RateLimiter(concurrency=2, adaptive=False)
+        first = limiter.acquire()
+        second = limiter.acquire()
+        self.assertEqual(limiter.acquire(max_wait=0.01), None)
+        self.assertEqual(limiter.snapshot()['timeouts'], 1)
+
+        # Waiters get the next free slot.
+        threading.Timer(0.02, limiter.release, (first,)).start()
+        self.assertTrue(limiter.acquire(max_wait=1) is not None)
+        limiter.cancel(second)
+        self.assertEqual(limiter.snapshot()['in_flight'], 1)
+
+    def test_timeout_refunds_token(self):
+        # A slow rate, so the bucket barely refills during the test.
+        limiter = RateLimiter(rate=0.1, burst=2, concurrency=1,
+                              adaptive=False)
+        permit = limiter.acquire()
+        for i in range(3):
+            # Gets a token, but no slot.
+            self.assertEqual(limiter.acquire(max_wait=0.01), None)
+        limiter.release(permit)
+        # The second token is still there.
+        self.assertEqual(limiter.reserve(), 0)
+
+    def test_additive_increase(self):
+        limiter = RateLimiter(concurrency=2, max_concurrency=3)
+        for i in range(10):
+            permits = [limiter.acquire() for n in range(limiter.limit)]
+            for permit in permits:
+                limiter.release(permit)
+        self.assertEqual(limiter.limit, 3)
+
+        # Not when the limit isn't in the way.
+        limiter = RateLimiter(concurrency=4)
+        for i in range(10):
+            limiter.release(limiter.acquire())
+        self.assertEqual(limiter.limit, 4)
+
+    def test_multiplicative_decrease(self):
+        limiter = RateLimiter(concurrency=10, min_concurrency=2, backoff=0.5)
+        permits = [limiter.acquire() for i in range(3)]
+        limiter.release(permits[0], THROTTLED)
+        self.assertEqual(limiter.limit, 5)
+        # Sent before the cut, so it doesn't cut again.
+        limiter.release(permits[1], ReadTimeout())
+        self.assertEqual(limiter.limit, 5)
+        # Not throttling.
+        limiter.release(permits[2], V3ClientInputException('', error_code=601))
+        self.assertEqual(limiter.limit, 5)
+
+        for i in range(3):
+            limiter.release(limiter.acquire(), THROTTLED)
+        self.assertEqual(limiter.limit, 2)
+        self.assertEqual(limiter.snapshot()['throttled'], 5)
+
+    def test_slow_responses(self):
+        limiter = RateLimiter(concurrency=10, latency_tolerance=3,
+                              latency_floor=0.05, backoff=0.5)
+        limiter.release(limiter.acquire())
+        self.assertEqual(limiter.limit, 10)
+
+        permit = limiter.acquire()
+        # Pretend it took a while.
+        permit.started -= 0.1
+        limiter.release(permit)
+        self.assertEqual(limiter.limit, 5)
+
+
+class ClientRateLimitTests(unittest.TestCase):
+    """
+    Tests for the clients' use of the limiter, against a local server.
+    """
+    def setUp(self):
+        self.responses = []
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.server = StubServer(self.respond).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def respond(self, path, body):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            response = self.responses.pop(0) if self.responses else (200, APPROVED)
+        time.sleep(0.01)
+        with self.lock:
+            self.in_flight -= 1
+        return response
+
+    def test_limits_concurrency(self):
+        limiter = RateLimiter(concurrency=2, adaptive=False)
+        api = V3Client(host=self.server.url, limiter=limiter)
+        results = list(api.send_batch([{}] * 12, concurrency=6))
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(self.max_in_flight, 2)
+        self.assertEqual(limiter.snapshot()['in_flight'], 0)
+
+    def test_backs_off_on_408s(self):
+        self.responses = [(408, 'Timeout')] * 4
+        limiter = RateLimiter(concurrency=8, backoff=0.5)
+        api = V3Client(host=self.server.url, limiter=limiter,
+                       retry_policy=RetryPolicy(max_retries=5, backoff_base=0))
+        self.assertEqual(api.send_request({})['status_code'], '1')
+        # Each retry went out after the previous cut, so each one cut it
+        # again, down to 1. Then the success nudged it back up.
+        self.assertEqual(limiter.snapshot()['throttled'], 4)
+        self.assertEqual(limiter.limit, 2)
+
+    def test_rate_limited(self):
+        limiter = RateLimiter(rate=1, burst=1, max_wait=0.01)
+        api = V3Client(host=self.server.url, limiter=limiter)
+        api.send_request({})
+        self.assertRaises(V3ClientRateLimitedException, api.send_request, {})
+        self.assertEqual(len(self.server.requests), 1)
+
+        api = V1Client(host=self.server.url, limiter=limiter)
+        self.assertRaises(V1ClientRateLimitedException, api.send_request, {})
+
+    def test_shared_between_clients(self):
+        limiter = RateLimiter(concurrency=1, adaptive=False)
+        v3 = V3Client(host=self.server.url, limiter=limiter)
+        v1 = V1Client(host=self.server.url, limiter=limiter)
+        threads = [threading.Thread(target=client.send_request, args=({},))
+                   for client in (v3, v1, v3, v1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertEqual(self.max_in_flight, 1)
@@ -0,0 +1,111 @@
+import datetime
+import threading
+import unittest
+from bluefin.dataretrieval.clients import V1Client
+from bluefin.dataretrieval.exceptions import V1ClientInputException
+from bluefin.testing.gateway import StubServer
+
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+class FetchReportTests(unittest.TestCase):
+    """
+    Tests for V1Client.fetch_report(), against a local server that has one
+    transaction per day.
+    """
+    def setUp(self):
+        self.lock = threading.Lock()
+        # Number of times to fail requests for a given start date.
+        self.failures = {}
+        self.server = StubServer(self.respond).start()
+        self.api = V1Client(host=self.server.url)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def respond(self, path, body):
+        values = parse_qs(body.decode('utf-8'))
+        after = values['transactions_after'][0]
+        with self.lock:
+            if self.failures.get(after):
+                self.failures[after] -= 1
+                return 500, 'Internal Server Error'
+        if 'site_tag' in values and values['site_tag'] == ['BAD']:
+            return 601, 'Invalid site tag'
+        day = parse_date(after)
+        end = parse_date(values['transactions_before'][0])
+        fields = []
+        while day <= end:
+            fields.append('trans_id=%s&auth_date=%s' % (
+                day.strftime('%Y%m%d'), day.isoformat()))
+            day += datetime.timedelta(days=1)
+        return 200, '&'.join(fields)
+
+    def test_shards_and_dedupe(self):
+        start = datetime.date(2011, 1, 1)
+        end = datetime.date(2011, 3, 31)
+        records = list(self.api.fetch_report({'site_tag': 'MAIN'}, start, end,
+                                             days_per_shard=10))
+        self.assertEqual(len(records), 90)
+        self.assertEqual(records[0]['auth_date'], '2011-01-01')
+        self.assertEqual(records[-1]['auth_date'], '2011-03-31')
+        self.assertEqual(len(set(r['trans_id'] for r in records)), 90)
+        self.assertEqual(len(self.server.requests), 9)
+        for path, body in self.server.requests:
+            self.assertEqual(parse_qs(body.decode('utf-8'))['site_tag'], ['MAIN'])
+
+    def test_one_day_shards(self):
+        # Every day but the first and last is on two shards' boundaries.
+        start = datetime.date(2011, 1, 1)
+        records = list(self.api.fetch_report({}, start,
+                                             datetime.date(2011, 1, 10),
+                                             days_per_shard=1))
+        self.assertEqual([r['trans_id'] for r in records],
+                         ['201101%02d' % day for day in range(1, 11)])
+
+    def test_single_day(self):
+        day = datetime.date(2011, 1, 1)
+        records = list(self.api.fetch_report({}, day, day))
+        self.assertEqual([r['trans_id'] for r in records], ['20110101'])
+
+    def test_shard_retry(self):
+        self.failures['2011-01-08'] = 2
+        records = list(self.api.fetch_report(
+            {}, datetime.date(2011, 1, 1), datetime.date(2011, 1, 31)))
+        self.assertEqual(len(records), 31)
+        # Four shards, one of them retried twice.
+        self.assertEqual(len(self.server.requests), 7)
+
+    def test_shard_failure(self):
+        self.failures['2011-01-08'] = 10
+        self.assertRaises(V1ClientInputException, list, self.api.fetch_report(
+            {}, datetime.date(2011, 1, 1), datetime.date(2011, 1, 31),
+            shard_retries=1))
+
+    def test_input_error_not_retried(self):
+        self.assertRaises(V1ClientInputException, list, self.api.fetch_report(
+            {'site_tag': 'BAD'}, datetime.date(2011, 1, 1),
+            datetime.date(2011, 1, 3)))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_bad_shard_size(self):
+        day = datetime.date(2011, 1, 1)
+        for days in (0, -1):
+            # Raised by the call itself, not once iterating starts.
+            self.assertRaises(ValueError, self.api.fetch_report, {}, day, day,
+                              days_per_shard=days)
+        self.assertEqual(len(self.server.requests), 0)
+
+    def test_records_without_key(self):
+        # Shards 1-4, 4-7 and 7-10. Days 4 and 7 come through twice.
+        records = list(self.api.fetch_report(
+            {}, datetime.date(2011, 1, 1), datetime.date(2011, 1, 10),
+            days_per_shard=3, key='settle_id'))
+        self.assertEqual(len(records), 12)
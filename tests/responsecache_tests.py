@@ -0,0 +1,132 @@
+import datetime
+import logging
+import threading
+import time
+import unittest
+from bluefin.dataretrieval.clients import V1Client
+from bluefin.dataretrieval.exceptions import V1ClientInputException
+from bluefin.dataretrieval.responsecache import ResponseCache
+from bluefin.testing.gateway import StubServer
+
+REPORT = 'trans_id=123&settle_amount=1.00'
+VALUES = {'account_id': 123, 'site_tag': 'MAIN', 'authorization': 'SECRET',
+          'transactions_after': datetime.date(2011, 1, 1)}
+
+
+class ResponseCacheTests(unittest.TestCase):
+    """
+    Tests for V1Client's response cache, against a local server.
+    """
+    def setUp(self):
+        self.delay = 0
+        self.status = 200
+        self.server = StubServer(self.respond).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def respond(self, path, body):
+        time.sleep(self.delay)
+        return self.status, REPORT
+
+    def client(self, **kwargs):
+        cache = ResponseCache(**kwargs)
+        return V1Client(host=self.server.url, response_cache=cache)
+
+    def test_hits(self):
+        api = self.client()
+        first = api.send_request(VALUES)
+        # Each caller gets its own copy.
+        first['trans_id'] = 'changed'
+        same = dict(VALUES, account_id='123',
+                    transactions_after='2011-01-01')
+        self.assertEqual(api.send_request(same)['trans_id'], '123')
+        self.assertEqual(len(self.server.requests), 1)
+
+        api.send_request(dict(VALUES, authorization='OTHER'))
+        self.assertEqual(len(self.server.requests), 2)
+        snapshot = api.response_cache.snapshot()
+        self.assertEqual(snapshot['hits'], 1)
+        self.assertEqual(snapshot['misses'], 2)
+        self.assertEqual(snapshot['entries'], 2)
+        self.assertTrue(snapshot['bytes'] > 0)
+
+    def test_expiry(self):
+        api = self.client(ttl=0.05)
+        api.send_request(VALUES)
+        time.sleep(0.1)
+        api.send_request(VALUES)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_ttl_per_request(self):
+        def ttl(values):
+            if values['transactions_after'] < datetime.date(2011, 1, 1):
+                return 3600
+            return None
+        api = self.client(ttl=ttl)
+        old = dict(VALUES, transactions_after=datetime.date(2010, 1, 1))
+        for i in range(2):
+            api.send_request(old)
+            api.send_request(VALUES)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(api.response_cache.snapshot()['bypassed'], 2)
+
+    def test_eviction(self):
+        api = self.client(max_entries=2)
+        for site_tag in ('A', 'B', 'C', 'A'):
+            api.send_request(dict(VALUES, site_tag=site_tag))
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertEqual(api.response_cache.snapshot()['evictions'], 2)
+
+        api = self.client(max_bytes=10)
+        api.send_request(VALUES)
+        api.send_request(VALUES)
+        self.assertEqual(api.response_cache.snapshot()['entries'], 0)
+
+    def test_single_flight(self):
+        self.delay = 0.1
+        api = self.client()
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(api.send_request(VALUES)))
+            for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(api.response_cache.snapshot()['coalesced'], 4)
+
+    def test_errors_not_cached(self):
+        self.status = 601
+        api = self.client()
+        self.assertRaises(V1ClientInputException, api.send_request, VALUES)
+        self.status = 200
+        api.send_request(VALUES)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_keys_hide_authorization(self):
+        cache = ResponseCache()
+        key = cache.make_key(VALUES)
+        self.assertFalse('SECRET' in key)
+        self.assertTrue('account_id=123&authorization=hmac:' in key)
+        self.assertNotEqual(key, cache.make_key(dict(VALUES, authorization='X')))
+        # A different cache, a different secret.
+        self.assertNotEqual(key, ResponseCache().make_key(VALUES))
+
+        messages = []
+        handler = logging.Handler()
+        handler.emit = lambda record: messages.append(record.getMessage())
+        logger = logging.getLogger('bluefin')
+        logger.addHandler(handler)
+        logger.setLevel(logging.DEBUG)
+        try:
+            api = V1Client(host=self.server.url, response_cache=cache)
+            api.send_request(VALUES)
+            api.send_request(VALUES)
+        finally:
+            logger.removeHandler(handler)
+            logger.setLevel(logging.NOTSET)
+        self.assertEqual(len(messages), 2)
+        self.assertFalse(any('SECRET' in message for message in messages))
@@ -0,0 +1,109 @@
+import datetime
+import decimal
+import json
+import pickle
+import unittest
+from bluefin.directmode.clients import V3Client
+from bluefin.directmode.results import Status, V3Result
+from bluefin.testing.gateway import StubServer
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+RESPONSE = {
+    'avs_code': 'X', 'auth_msg': 'TEST APPROVED', 'status_code': '1',
+    'auth_date': '2011-01-01 12:30:00', 'settle_currency': 'USD',
+    'auth_code': '999999', 'settle_amount': '12.34', 'trans_id': '123',
+    'custom_field': 'extra',
+}
+
+# The test gateway's response, from the README.
+README_RESPONSE = (
+    'avs_code=X&auth_msg=TEST+APPROVED&status_code=T&'
+    'ticket_code=XXXXXXXXXXXXXXX&auth_date=2011-06-22+19%3A04%3A30&'
+    'settle_currency=USD&auth_code=999999&settle_amount=1&cvv2_code=M&'
+    'processor=TEST&trans_id=123456789012')
+
+
+class V3ResultTests(unittest.TestCase):
+    def setUp(self):
+        self.result = V3Result(RESPONSE)
+
+    def test_dict_compatible(self):
+        result = self.result
+        self.assertTrue(isinstance(result, Mapping))
+        self.assertEqual(result['trans_id'], '123')
+        self.assertEqual(result['custom_field'], 'extra')
+        self.assertEqual(result.get('processor'), None)
+        self.assertEqual(result.get('processor', 'x'), 'x')
+        self.assertRaises(KeyError, lambda: result['processor'])
+        self.assertTrue('status_code' in result)
+        self.assertFalse('processor' in result)
+        self.assertEqual(len(result), len(RESPONSE))
+        self.assertEqual(sorted(result), sorted(RESPONSE))
+        self.assertEqual(dict(result), RESPONSE)
+        self.assertEqual(result, RESPONSE)
+        self.assertEqual(RESPONSE, result)
+        self.assertNotEqual(result, {})
+
+    def test_read_only(self):
+        self.assertFalse(hasattr(self.result, '__dict__'))
+        self.assertRaises(AttributeError, setattr, self.result, 'trans_id', '1')
+
+    def test_typed_accessors(self):
+        self.assertEqual(self.result.amount, decimal.Decimal('12.34'))
+        self.assertEqual(self.result.authorized_at,
+                         datetime.datetime(2011, 1, 1, 12, 30))
+        self.assertTrue(self.result.status is Status.APPROVED)
+        self.assertTrue(self.result.is_approved)
+        self.assertFalse(V3Result({'status_code': '0'}).is_approved)
+        self.assertFalse(V3Result().is_approved)
+
+    def test_missing_typed_values(self):
+        result = V3Result({'status_code': 'Z'})
+        self.assertEqual(result.amount, None)
+        self.assertEqual(result.authorized_at, None)
+        self.assertEqual(result.status.name, 'UNKNOWN')
+        self.assertEqual(V3Result().status, None)
+
+    def test_pickle(self):
+        result = pickle.loads(pickle.dumps(self.result))
+        self.assertEqual(result, self.result)
+        self.assertTrue(isinstance(result, V3Result))
+
+    def test_to_dict(self):
+        self.assertEqual(json.loads(json.dumps(self.result.to_dict())),
+                         RESPONSE)
+
+
+class V3ClientResultClassTests(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer(lambda path, body: (
+            200, 'status_code=1&settle_amount=1.00&trans_id=123')).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_result_class(self):
+        api = V3Client(host=self.server.url, result_class=V3Result)
+        result = api.send_request({})
+        self.assertTrue(isinstance(result, V3Result))
+        self.assertEqual(result.amount, decimal.Decimal('1.00'))
+        self.assertEqual(result['trans_id'], '123')
+
+    def test_default_is_dict(self):
+        result = V3Client(host=self.server.url).send_request({})
+        self.assertEqual(type(result), dict)
+
+    def test_test_gateway_approval(self):
+        server = StubServer(lambda path, body: (200, README_RESPONSE)).start()
+        try:
+            api = V3Client(host=server.url, result_class=V3Result)
+            result = api.send_request({})
+        finally:
+            server.stop()
+        self.assertTrue(result.status is Status.TEST_APPROVED)
+        self.assertTrue(result.is_approved)
+        self.assertEqual(result['trans_id'], '123456789012')
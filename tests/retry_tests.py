@@ -0,0 +1,128 @@
+import socket
+import time
+import unittest
+from requests.exceptions import ConnectionError
+from bluefin.dataretrieval.clients import V1Client
+from bluefin.directmode.clients import V3Client
+from bluefin.directmode.exceptions import V3ClientException, V3ClientInputException
+from bluefin.retry import RetryBudget, RetryPolicy
+from bluefin.testing.gateway import StubServer
+
+APPROVED = 'status_code=1&auth_msg=TEST+APPROVED&trans_id=123'
+
+
+def unused_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class RetryPolicyTests(unittest.TestCase):
+    """
+    Tests for the retry policy itself.
+    """
+    def test_backoff(self):
+        policy = RetryPolicy(backoff_base=0.1, backoff_max=0.5, jitter=False)
+        self.assertEqual([policy.backoff(n) for n in range(1, 6)],
+                         [0.1, 0.2, 0.4, 0.5, 0.5])
+
+    def test_jitter(self):
+        policy = RetryPolicy(backoff_base=0.1, backoff_max=0.5)
+        for i in range(100):
+            self.assertTrue(0 <= policy.backoff(3) <= 0.4)
+
+    def test_is_retryable(self):
+        policy = RetryPolicy(retry_statuses=(408,),
+                             retry_exceptions=(ConnectionError,))
+        self.assertTrue(policy.is_retryable(ConnectionError()))
+        self.assertTrue(policy.is_retryable(V3ClientException('', error_code=408)))
+        self.assertTrue(policy.is_retryable(V3ClientException('', error_code='408')))
+        self.assertFalse(policy.is_retryable(V3ClientException('', error_code=601)))
+        self.assertFalse(policy.is_retryable(V3ClientException('', error_code='F')))
+        self.assertFalse(policy.is_retryable(ValueError()))
+
+    def test_max_retries(self):
+        state = RetryPolicy(max_retries=2, backoff_base=0).start()
+        exc = V3ClientException('', error_code=408)
+        self.assertEqual(state.next_delay(exc), 0)
+        self.assertEqual(state.next_delay(exc), 0)
+        self.assertEqual(state.next_delay(exc), None)
+
+    def test_budget(self):
+        budget = RetryBudget(ratio=0.5, capacity=2)
+        policy = RetryPolicy(max_retries=10, backoff_base=0, budget=budget)
+        exc = V3ClientException('', error_code=408)
+        state = policy.start()
+        # The bucket starts full, plus half a token for the request.
+        self.assertEqual(state.next_delay(exc), 0)
+        self.assertEqual(state.next_delay(exc), 0)
+        self.assertEqual(state.next_delay(exc), None)
+        # Two more requests earn another retry.
+        policy.start()
+        state = policy.start()
+        self.assertEqual(state.next_delay(exc), 0)
+        self.assertEqual(state.next_delay(exc), None)
+
+    def test_deadline(self):
+        policy = RetryPolicy(max_retries=10, backoff_base=0.05, jitter=False,
+                             deadline=0.1)
+        state = policy.start()
+        self.assertTrue(state.timeout(15) <= 0.1)
+        exc = V3ClientException('', error_code=408)
+        self.assertEqual(state.next_delay(exc), 0.05)
+        time.sleep(0.05)
+        # The next delay would take us past the deadline.
+        self.assertEqual(state.next_delay(exc), None)
+
+
+class ClientRetryTests(unittest.TestCase):
+    """
+    Tests for the clients' retry loops, against a local server.
+    """
+    def setUp(self):
+        self.responses = []
+        self.server = StubServer(self.respond).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def respond(self, path, body):
+        if self.responses:
+            return self.responses.pop(0)
+        return 200, APPROVED
+
+    def test_v3_retries_408(self):
+        self.responses = [(408, 'Timeout')] * 2
+        api = V3Client(host=self.server.url)
+        self.assertEqual(api.send_request({})['status_code'], '1')
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_v3_does_not_retry_input_errors(self):
+        self.responses = [(601, 'Bad input')]
+        api = V3Client(host=self.server.url)
+        self.assertRaises(V3ClientInputException, api.send_request, {})
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_v3_retries_connection_errors(self):
+        attempts = []
+        policy = RetryPolicy(max_retries=2, backoff_base=0,
+                             retry_exceptions=(ConnectionError,))
+        api = V3Client(host='http://127.0.0.1:%d' % unused_port(),
+                       retry_policy=policy)
+        original_post = api.transport.post
+
+        def post(*args, **kwargs):
+            attempts.append(1)
+            return original_post(*args, **kwargs)
+
+        api.transport.post = post
+        self.assertRaises(ConnectionError, api.send_request, {})
+        self.assertEqual(len(attempts), 3)
+
+    def test_v1_retries_server_errors(self):
+        self.responses = [(503, 'Unavailable'), (502, 'Bad Gateway')]
+        api = V1Client(host=self.server.url)
+        self.assertEqual(api.send_request({})['status_code'], '1')
+        self.assertEqual(len(self.server.requests), 3)
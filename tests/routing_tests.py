@@ -0,0 +1,168 @@
+import socket
+import time
+import unittest
+from requests.exceptions import ReadTimeout
+from bluefin.dataretrieval.clients import V1Client
+from bluefin.directmode.clients import V3Client
+from bluefin.directmode.exceptions import V3ClientException, V3ClientInputException
+from bluefin import routing
+from bluefin.routing import EndpointRouter
+from bluefin.testing.gateway import StubServer
+from bluefin.transport import ConnectError, HTTPTransport
+
+APPROVED = 'status_code=1&auth_msg=TEST+APPROVED&trans_id=123'
+
+
+def unused_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class EndpointRouterTests(unittest.TestCase):
+    """
+    Tests for the router itself.
+    """
+    def test_prefers_healthiest(self):
+        router = EndpointRouter(['a', 'b', 'c'])
+        # Untried endpoints go first, in order.
+        self.assertEqual(router.choose(), 'a')
+        router.record('a', 0.1)
+        self.assertEqual(router.choose(), 'b')
+        router.record('b', 0.05)
+        router.record('c', 0.2)
+        self.assertEqual(router.choose(), 'b')
+
+        # Errors count against an endpoint, even a fast one.
+        router.record('b', 0.05, V3ClientException('', error_code=503))
+        self.assertEqual(router.choose(), 'a')
+        # Declines and input errors don't.
+        router = EndpointRouter(['a', 'b'])
+        router.record('a', 0.05, V3ClientInputException('', error_code=601))
+        router.record('b', 0.1)
+        self.assertEqual(router.choose(), 'a')
+
+    def test_exclude(self):
+        router = EndpointRouter(['a', 'b'])
+        self.assertEqual(router.choose(exclude=('a',)), 'b')
+        # Nothing else left, so an excluded one it is.
+        self.assertEqual(router.choose(exclude=('a', 'b')), 'a')
+
+    def test_down_and_probe(self):
+        router = EndpointRouter(['a', 'b'], failure_threshold=2, down_for=0.05)
+        router.record('a', 0.01)
+        router.record('b', 0.1)
+        router.record('a', 1, ReadTimeout())
+        self.assertTrue(router.snapshot()[0]['up'])
+        router.record('a', 1, ReadTimeout())
+        snapshot = router.snapshot()[0]
+        self.assertFalse(snapshot['up'])
+        self.assertEqual(snapshot['times_down'], 1)
+        self.assertEqual(router.choose(), 'b')
+
+        time.sleep(0.06)
+        # One probe at a time.
+        self.assertEqual(router.choose(), 'a')
+        self.assertEqual(router.choose(), 'b')
+        # A failed probe marks it down again straight away.
+        router.record('a', 1, ReadTimeout())
+        self.assertEqual(router.choose(), 'b')
+        self.assertEqual(router.snapshot()[0]['times_down'], 1)
+
+        time.sleep(0.06)
+        self.assertEqual(router.choose(), 'a')
+        router.record('a', 0.01)
+        snapshot = router.snapshot()[0]
+        self.assertTrue(snapshot['up'])
+        self.assertEqual(snapshot['consecutive_failures'], 0)
+
+    def test_all_down(self):
+        router = EndpointRouter(['a', 'b'], failure_threshold=1, down_for=10)
+        router.record('b', 1, ReadTimeout())
+        router.record('a', 1, ReadTimeout())
+        # b comes back first.
+        self.assertEqual(router.choose(), 'b')
+
+
+class FailoverTests(unittest.TestCase):
+    """
+    Tests for the clients, against several local servers.
+    """
+    def setUp(self):
+        self.good = StubServer(lambda path, body: (200, APPROVED)).start()
+        self.bad = StubServer(lambda path, body: (503, 'Unavailable')).start()
+        self.dead_url = 'http://127.0.0.1:%d' % unused_port()
+
+    def tearDown(self):
+        self.good.stop()
+        self.bad.stop()
+
+    def test_connect_error(self):
+        self.assertRaises(ConnectError, HTTPTransport().post, self.dead_url)
+
+    def test_v3_fails_over_on_connect_errors(self):
+        api = V3Client(host=[self.dead_url, self.good.url])
+        self.assertEqual(api.send_request({})['status_code'], '1')
+        self.assertEqual(len(self.good.requests), 1)
+        dead, good = api.router.snapshot()
+        self.assertEqual(dead['failures'], 1)
+        self.assertEqual(good['failures'], 0)
+
+    def test_v3_does_not_fail_over_on_server_errors(self):
+        # The charge may have gone through.
+        api = V3Client(host=[self.bad.url, self.good.url])
+        self.assertRaises(V3ClientException, api.send_request, {})
+        self.assertEqual(len(self.good.requests), 0)
+        # But the next one goes elsewhere.
+        self.assertEqual(api.send_request({})['status_code'], '1')
+
+    def test_v1_fails_over(self):
+        api = V1Client(host=[self.bad.url, self.good.url])
+        self.assertEqual(api.send_request({})['status_code'], '1')
+        self.assertEqual(len(self.bad.requests), 1)
+        self.assertEqual(len(self.good.requests), 1)
+
+    def test_routes_to_fastest(self):
+        def slow(path, body):
+            time.sleep(0.02)
+            return 200, APPROVED
+        slow_server = StubServer(slow).start()
+        try:
+            api = V3Client(host=[slow_server.url, self.good.url])
+            for i in range(10):
+                api.send_request({})
+        finally:
+            slow_server.stop()
+        self.assertEqual(len(slow_server.requests), 1)
+        self.assertEqual(len(self.good.requests), 9)
+
+    def test_reprobe(self):
+        # The router's clock only moves when we say so.
+        now = [1000.0]
+        real_clock = routing._clock
+        routing._clock = lambda: now[0]
+        try:
+            port = unused_port()
+            router = EndpointRouter(['http://127.0.0.1:%d' % port,
+                                     self.good.url],
+                                    failure_threshold=1, down_for=10)
+            api = V1Client(router=router)
+            api.send_request({})
+            self.assertFalse(router.snapshot()[0]['up'])
+
+            revived = StubServer(lambda path, body: (200, APPROVED),
+                                 port=port).start()
+            try:
+                now[0] += 9
+                api.send_request({})
+                self.assertEqual(len(revived.requests), 0)
+                now[0] += 1
+                api.send_request({})
+                self.assertEqual(len(revived.requests), 1)
+                self.assertTrue(router.snapshot()[0]['up'])
+            finally:
+                revived.stop()
+        finally:
+            routing._clock = real_clock
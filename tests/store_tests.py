@@ -0,0 +1,115 @@
+import datetime
+import unittest
+from bluefin.dataretrieval.clients import V1Client
+from bluefin.dataretrieval.store import TransactionStore
+from bluefin.testing.gateway import StubServer
+
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def respond(path, body):
+    """
+    One transaction per day, at noon.
+    """
+    values = parse_qs(body.decode('utf-8'))
+    day = parse_date(values['transactions_after'][0])
+    end = parse_date(values['transactions_before'][0])
+    fields = []
+    while day <= end:
+        fields.append('trans_id=%s%s&auth_date=%s+12%%3A00%%3A00&settle_amount=1' % (
+            values.get('site_tag', ['ALL'])[0], day.strftime('%Y%m%d'), day.isoformat()))
+        day += datetime.timedelta(days=1)
+    return 200, '&'.join(fields)
+
+
+class TransactionStoreTests(unittest.TestCase):
+    """
+    Tests for the local transaction store.
+    """
+    def setUp(self):
+        self.server = StubServer(respond).start()
+        self.api = V1Client(host=self.server.url)
+        self.store = TransactionStore()
+        self.values = {'account_id': 123, 'site_tag': 'MAIN',
+                       'authorization': 'AUTH'}
+
+    def tearDown(self):
+        self.store.close()
+        self.server.stop()
+
+    def test_sync_and_lookup(self):
+        count = self.store.sync(self.api, self.values,
+                                since=datetime.date(2011, 1, 1),
+                                until=datetime.date(2011, 1, 31))
+        self.assertEqual(count, 31)
+        self.assertEqual(self.store.high_water_mark(123, 'MAIN'),
+                         datetime.date(2011, 1, 31))
+
+        record = self.store.get('MAIN20110115')
+        self.assertEqual(record['auth_date'], '2011-01-15 12:00:00')
+        self.assertEqual(self.store.get('nope'), None)
+
+        records = self.store.between(datetime.date(2011, 1, 10),
+                                     datetime.date(2011, 1, 12))
+        self.assertEqual([r['trans_id'] for r in records],
+                         ['MAIN20110110', 'MAIN20110111', 'MAIN20110112'])
+
+    def test_incremental_sync(self):
+        self.store.sync(self.api, self.values, since=datetime.date(2011, 1, 1),
+                        until=datetime.date(2011, 1, 31))
+        requests_before = len(self.server.requests)
+        count = self.store.sync(self.api, self.values,
+                                since=datetime.date(2011, 1, 1),
+                                until=datetime.date(2011, 2, 3))
+        # The high-water mark day, plus the three new ones.
+        self.assertEqual(count, 4)
+        self.assertEqual(len(self.server.requests), requests_before + 1)
+        path, body = self.server.requests[-1]
+        self.assertEqual(parse_qs(body.decode('utf-8'))['transactions_after'],
+                         ['2011-01-31'])
+        self.assertEqual(len(self.store.between(datetime.date(2011, 1, 1),
+                                                datetime.date(2011, 12, 31))), 34)
+
+    def test_site_tags(self):
+        since = datetime.date(2011, 1, 1)
+        until = datetime.date(2011, 1, 5)
+        self.store.sync(self.api, self.values, since=since, until=until)
+        other = dict(self.values, site_tag='OTHER')
+        self.store.sync(self.api, other, since=since, until=until)
+
+        self.assertEqual(len(self.store.between(since, until)), 10)
+        records = self.store.between(since, until, account_id=123,
+                                     site_tag='OTHER')
+        self.assertEqual(len(records), 5)
+        self.assertTrue(all(r['trans_id'].startswith('OTHER') for r in records))
+
+    def test_no_site_tag(self):
+        values = {'account_id': 123, 'authorization': 'AUTH'}
+        since = datetime.date(2011, 1, 1)
+        count = self.store.sync(self.api, values, since=since,
+                                until=datetime.date(2011, 1, 5))
+        self.assertEqual(count, 5)
+        self.assertEqual(self.store.high_water_mark(123, None),
+                         datetime.date(2011, 1, 5))
+        self.assertEqual(self.store.high_water_mark(123, 'MAIN'), None)
+
+        count = self.store.sync(self.api, values, since=since,
+                                until=datetime.date(2011, 1, 6))
+        self.assertEqual(count, 2)
+
+    def test_mark_written_with_records(self):
+        def records():
+            yield {'trans_id': '1', 'auth_date': '2011-01-01 12:00:00'}
+            raise IOError
+        self.api.fetch_report = lambda *args, **kwargs: records()
+        self.assertRaises(IOError, self.store.sync, self.api, self.values,
+                          since=datetime.date(2011, 1, 1),
+                          until=datetime.date(2011, 1, 31))
+        self.assertEqual(self.store.high_water_mark(123, 'MAIN'), None)
@@ -0,0 +1,220 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from bluefin.directmode import submissions
+from bluefin.directmode.clients import V3Client
+from bluefin.directmode.exceptions import V3ClientDeclinedException, V3ClientOutcomeUnknownException
+from bluefin.directmode.results import V3Result
+from bluefin.directmode.submissions import SubmissionQueue
+from bluefin.retry import RetryPolicy
+from bluefin.testing.gateway import StubServer
+
+APPROVED = 'status_code=1&auth_msg=TEST+APPROVED&trans_id=123'
+DECLINED = 'status_code=0&auth_msg=C%2FDECLINED'
+
+
+class SubmissionQueueTests(unittest.TestCase):
+    """
+    Tests for the durable submission queue, against a local server.
+    """
+    def setUp(self):
+        self.responses = []
+        self.lock = threading.Lock()
+        self.server = StubServer(self.respond).start()
+        self.api = V3Client(host=self.server.url, retry_policy=RetryPolicy(
+            max_retries=0))
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'submissions.log')
+        self.outcomes = []
+        self.queues = []
+
+    def tearDown(self):
+        for queue in self.queues:
+            queue.close(timeout=5)
+        self.server.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def respond(self, path, body):
+        with self.lock:
+            response = self.responses.pop(0) if self.responses else (200, APPROVED)
+        if callable(response):
+            response = response()
+        return response
+
+    def open_queue(self, **kwargs):
+        kwargs.setdefault('on_outcome', self.outcomes.append)
+        kwargs.setdefault('retry_interval', 0.01)
+        queue = SubmissionQueue(self.api, self.path, **kwargs)
+        self.queues.append(queue)
+        return queue
+
+    def journal(self):
+        with open(self.path) as journal:
+            return [json.loads(line) for line in journal]
+
+    def write_journal(self, records):
+        with open(self.path, 'w') as journal:
+            for record in records:
+                journal.write(json.dumps(record) + '\n')
+
+    def test_submit(self):
+        queue = self.open_queue()
+        submission = queue.submit({'amount': '1.00'}, idempotency_key='order-1')
+        self.assertEqual(submission.result(timeout=5)['trans_id'], '123')
+        self.assertTrue(queue.drain(timeout=5))
+        self.assertEqual(self.outcomes, [submission])
+        self.assertEqual(submission.values, None)
+        self.assertEqual(queue.get(submission.id), None)
+        self.assertEqual(len(self.server.requests), 1)
+
+        queue.close()
+        ops = [record['op'] for record in self.journal()]
+        self.assertEqual(ops, ['submit', 'send', 'done', 'ack'])
+        # Nothing left once it's replayed.
+        self.open_queue()
+        self.assertEqual(self.journal(), [])
+
+    def test_result_class(self):
+        self.api.result_class = V3Result
+        queue = self.open_queue()
+        result = queue.submit({}).result(timeout=5)
+        self.assertTrue(isinstance(result, V3Result))
+
+    def test_outcomes(self):
+        self.responses = [(200, DECLINED), (500, 'Oops')]
+        queue = self.open_queue()
+        declined = queue.submit({})
+        declined.wait(5)
+        failed = queue.submit({})
+        self.assertRaises(V3ClientDeclinedException, declined.result, 5)
+        self.assertRaises(V3ClientOutcomeUnknownException, failed.result, 5)
+        # Never sent again, since it may have gone through.
+        self.assertTrue(queue.drain(timeout=5))
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_read_timeout_with_permissive_policy(self):
+        def slow():
+            time.sleep(0.5)
+            return 200, APPROVED
+        self.responses = [slow]
+        # Retries everything, including what mustn't be sent again.
+        self.api = V3Client(host=self.server.url, http_timeout=0.1,
+                            retry_policy=RetryPolicy(
+                                max_retries=0, retry_statuses=(408, 500),
+                                retry_exceptions=(Exception,)))
+        queue = self.open_queue()
+        submission = queue.submit({})
+        self.assertRaises(V3ClientOutcomeUnknownException,
+                          submission.result, 5)
+        self.assertTrue(queue.drain(timeout=5))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_outage(self):
+        self.responses = [(408, 'Timeout')] * 3
+        queue = self.open_queue(retry_interval=0.05)
+        first = queue.submit({'n': '1'})
+        second = queue.submit({'n': '2'})
+        self.assertEqual(first.result(timeout=5)['status_code'], '1')
+        self.assertEqual(second.result(timeout=5)['status_code'], '1')
+        # Three failed tries at the first, alone, then both.
+        bodies = [body for path, body in self.server.requests]
+        self.assertEqual(bodies, [b'n=1'] * 4 + [b'n=2'])
+        self.assertFalse(queue.snapshot()['outage'])
+
+    def test_recovery(self):
+        self.write_journal([
+            {'op': 'submit', 'id': 'pending', 'values': {'n': '1'}, 'key': None},
+            {'op': 'submit', 'id': 'sending', 'values': {'n': '2'}, 'key': None},
+            {'op': 'send', 'id': 'sending'},
+            {'op': 'submit', 'id': 'unsent', 'values': {'n': '3'}, 'key': None},
+            {'op': 'send', 'id': 'unsent'},
+            {'op': 'unsent', 'id': 'unsent'},
+            {'op': 'submit', 'id': 'done', 'values': None, 'key': None},
+            {'op': 'done', 'id': 'done', 'outcome': {'result': {'x': 'y'}}},
+            {'op': 'submit', 'id': 'acked', 'values': None, 'key': None},
+            {'op': 'done', 'id': 'acked', 'outcome': {'result': {}}},
+            {'op': 'ack', 'id': 'acked'},
+        ])
+        # Torn by a crash.
+        with open(self.path, 'a') as journal:
+            journal.write('{"op": "submit", "id": "to')
+
+        queue = self.open_queue(start=False)
+        self.assertEqual(queue.get('acked'), None)
+        self.assertRaises(V3ClientOutcomeUnknownException,
+                          queue.get('sending').result)
+        self.assertEqual(queue.get('done').result(), {'x': 'y'})
+        pending = queue.get('pending')
+        unsent = queue.get('unsent')
+
+        queue.start()
+        self.assertEqual(pending.result(timeout=5)['trans_id'], '123')
+        self.assertEqual(unsent.result(timeout=5)['trans_id'], '123')
+        self.assertTrue(queue.drain(timeout=5))
+        bodies = sorted(body for path, body in self.server.requests)
+        self.assertEqual(bodies, [b'n=1', b'n=3'])
+        self.assertEqual(sorted(s.id for s in self.outcomes),
+                         ['done', 'pending', 'sending', 'unsent'])
+
+    def test_failed_handler(self):
+        def on_outcome(submission):
+            raise ValueError
+        queue = self.open_queue(on_outcome=on_outcome)
+        submission = queue.submit({})
+        submission.wait(5)
+        queue.close()
+
+        # Handed over again.
+        queue = self.open_queue(start=False)
+        self.assertEqual(queue.get(submission.id).result()['trans_id'], '123')
+        queue.start()
+        self.assertEqual([s.id for s in self.outcomes], [submission.id])
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_closed_queue_keeps_submissions(self):
+        queue = self.open_queue(start=False)
+        submission = queue.submit({})
+        queue.close()
+        self.assertFalse(submission.done())
+
+        queue = self.open_queue()
+        self.assertEqual(queue.get(submission.id).result(timeout=5)['trans_id'],
+                         '123')
+
+    def test_group_fsync(self):
+        fsyncs = []
+        real_fsync = os.fsync
+
+        def fsync(fd):
+            fsyncs.append(fd)
+            real_fsync(fd)
+        submissions.os.fsync = fsync
+        try:
+            queue = self.open_queue(start=False)
+            del fsyncs[:]
+            # Hold up the first fsync until everyone has written.
+            queue._sync_lock.acquire()
+            threads = [threading.Thread(target=queue.submit, args=({},))
+                       for i in range(20)]
+            for thread in threads:
+                thread.start()
+            while queue._written < 20:
+                time.sleep(0.001)
+            queue._sync_lock.release()
+            for thread in threads:
+                thread.join()
+        finally:
+            submissions.os.fsync = real_fsync
+        self.assertEqual(queue.snapshot()['pending'], 20)
+        self.assertEqual(len(fsyncs), 1)
+
+    def test_compaction(self):
+        queue = self.open_queue(compact_after=10)
+        for i in range(10):
+            queue.submit({}).wait(5)
+        self.assertTrue(queue.drain(timeout=5))
+        self.assertTrue(len(self.journal()) < 10)
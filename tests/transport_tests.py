@@ -0,0 +1,136 @@
+import threading
+import unittest
+from bluefin.transport import HTTPTransport, encode_form
+from bluefin.directmode.clients import V3Client
+from bluefin.dataretrieval.clients import V1Client
+from bluefin.testing.gateway import StubServer
+
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+APPROVED = 'status_code=1&auth_msg=TEST+APPROVED&trans_id=123'
+
+
+class HTTPTransportTests(unittest.TestCase):
+    """
+    Tests for connection pooling, against a local server.
+    """
+    def setUp(self):
+        self.server = StubServer(lambda path, body: (200, APPROVED)).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_connection_reuse(self):
+        """
+        Sequential requests should all go over the same connection.
+        """
+        api = V3Client(host=self.server.url)
+        for i in range(5):
+            result = api.send_request({'tran_type': 'A'})
+            self.assertEqual(result['status_code'], '1')
+        self.assertEqual(len(self.server.requests), 5)
+        self.assertEqual(len(self.server.client_ports), 1)
+
+    def test_no_keep_alive(self):
+        api = V3Client(host=self.server.url,
+                       transport=HTTPTransport(keep_alive=False))
+        for i in range(3):
+            api.send_request({'tran_type': 'A'})
+        self.assertEqual(len(self.server.client_ports), 3)
+
+    def test_shared_between_threads(self):
+        """
+        One client, many threads, never more than pool_maxsize connections.
+        """
+        transport = HTTPTransport(pool_maxsize=2, pool_block=True)
+        api = V3Client(host=self.server.url, transport=transport)
+        errors = []
+
+        def worker():
+            try:
+                for i in range(10):
+                    api.send_request({'tran_type': 'A'})
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=worker) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.server.requests), 60)
+        self.assertTrue(len(self.server.client_ports) <= 2)
+
+    def test_shared_between_clients(self):
+        transport = HTTPTransport()
+        V3Client(host=self.server.url, transport=transport).send_request({})
+        V1Client(host=self.server.url, transport=transport).send_request({})
+        self.assertEqual(len(self.server.client_ports), 1)
+
+
+class EncodeFormTests(unittest.TestCase):
+    def test_encode_form(self):
+        body = encode_form({'a': 1.5, 'b': u'caf\xe9 au lait', 'c': None,
+                            'd': ['x', None, 'y'], 'e': b'raw'})
+        self.assertTrue(isinstance(body, bytes))
+        self.assertEqual(sorted(body.split(b'&')), [
+            b'a=1.5', b'b=caf%C3%A9+au+lait', b'd=x', b'd=y', b'e=raw'])
+        self.assertEqual(encode_form({}), b'')
+
+
+class RequestBodyTests(unittest.TestCase):
+    """
+    Tests for V3Client's pre-encoded defaults, against a local server.
+    """
+    def setUp(self):
+        self.statuses = []
+        self.server = StubServer(self.respond).start()
+        self.api = V3Client(host=self.server.url, account_id=123,
+                            dynip_sec_code='secret')
+
+    def tearDown(self):
+        self.server.stop()
+
+    def respond(self, path, body):
+        if self.statuses:
+            return self.statuses.pop(0), 'Try again'
+        return 200, APPROVED
+
+    def sent_values(self, index=-1):
+        path, body = self.server.requests[index]
+        return parse_qs(body.decode('utf-8'))
+
+    def test_defaults_included(self):
+        self.api.send_request({'tran_type': 'A', 'amount': '1.00'})
+        self.assertEqual(self.sent_values(), {
+            'account_id': ['123'], 'dynip_sec_code': ['secret'],
+            'tran_type': ['A'], 'amount': ['1.00']})
+
+    def test_override_default(self):
+        self.api.send_request({'account_id': 456})
+        self.assertEqual(self.sent_values(), {
+            'account_id': ['456'], 'dynip_sec_code': ['secret']})
+
+    def test_changed_defaults(self):
+        self.api.send_request({})
+        self.api.default_values['account_id'] = 789
+        self.api.send_request({})
+        self.assertEqual(self.sent_values()['account_id'], ['789'])
+
+    def test_retry_sends_same_body(self):
+        self.statuses = [408]
+        self.api.retry_policy.backoff_base = 0
+        self.api.send_request({'tran_type': 'A'})
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[0], self.server.requests[1])
+
+    def test_endpoint_follows_host(self):
+        self.api.send_request({})
+        self.api.path = '/elsewhere'
+        self.api.send_request({})
+        self.assertEqual(self.server.requests[-1][0], '/elsewhere')
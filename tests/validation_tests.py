@@ -0,0 +1,98 @@
+import datetime
+import unittest
+from bluefin.directmode.clients import V3Client
+from bluefin.directmode.exceptions import V3ClientInputException, V3ClientDeclinedException
+from bluefin.directmode.validation import Schema, Validator, amount
+from bluefin.testing.gateway import StubServer
+
+APPROVED = 'status_code=1&auth_msg=TEST+APPROVED&trans_id=123'
+
+NEXT_YEAR = datetime.date.today().year + 1
+
+CHARGE = {
+    'pay_type': 'C',
+    'tran_type': 'A',
+    'account_id': 123456789012,
+    'amount': 1.0,
+    'card_number': 4444333322221111,
+    'card_expire': '12%02d' % (NEXT_YEAR % 100),
+}
+
+
+class ValidatorTests(unittest.TestCase):
+    def setUp(self):
+        self.validator = Validator()
+
+    def assertInvalid(self, exc_class, **changes):
+        values = dict(CHARGE)
+        for key, value in changes.items():
+            if value is None:
+                del values[key]
+            else:
+                values[key] = value
+        self.assertRaises(exc_class, self.validator, values)
+
+    def test_valid(self):
+        self.validator(CHARGE)
+        self.validator(dict(CHARGE, tran_type='S', amount='0.00',
+                            card_number='4012888888881881'))
+
+    def test_missing_fields(self):
+        for field in ('card_number', 'card_expire', 'amount', 'account_id'):
+            self.assertInvalid(V3ClientInputException, **{field: None})
+        self.assertInvalid(V3ClientInputException, card_number='')
+
+    def test_amount(self):
+        for value in (-1.0, 'a', '1.', '1e5'):
+            self.assertInvalid(V3ClientInputException, amount=value)
+
+    def test_card_number(self):
+        self.assertInvalid(V3ClientDeclinedException,
+                           card_number=4444333322221112)
+        self.assertInvalid(V3ClientInputException, card_number='4444-3333')
+        try:
+            self.validator(dict(CHARGE, card_number='4444333322221112'))
+        except V3ClientDeclinedException as exc:
+            self.assertEqual(exc.raw_message, 'INVALID CARD NO')
+            self.assertEqual(exc.error_code, None)
+
+    def test_card_expire(self):
+        for value in ('1300', '112', 'abcd'):
+            self.assertInvalid(V3ClientInputException, card_expire=value)
+        self.assertInvalid(V3ClientDeclinedException, card_expire='1212')
+        Validator(reject_expired=False)(dict(CHARGE, card_expire='1212'))
+
+    def test_other_tran_types(self):
+        """
+        Only the basic checks apply to requests without a specific schema.
+        """
+        self.validator({'pay_type': 'C', 'tran_type': 'V',
+                        'account_id': 1, 'trans_id': '123'})
+        self.assertRaises(V3ClientInputException, self.validator,
+                          {'pay_type': 'C', 'tran_type': 'V',
+                           'account_id': 1, 'amount': 'x'})
+
+    def test_register(self):
+        self.validator.register('C', 'V', Schema(
+            required=('account_id', 'trans_id'), checks={'amount': [amount]}))
+        self.assertRaises(V3ClientInputException, self.validator,
+                          {'pay_type': 'C', 'tran_type': 'V', 'account_id': 1})
+
+
+class V3ClientValidationTests(unittest.TestCase):
+    def setUp(self):
+        self.server = StubServer(lambda path, body: (200, APPROVED)).start()
+        self.api = V3Client(host=self.server.url, validator=Validator())
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_no_request_sent(self):
+        self.assertRaises(V3ClientInputException, self.api.send_request,
+                          dict(CHARGE, amount='a'))
+        self.assertEqual(len(self.server.requests), 0)
+
+    def test_valid_request_sent(self):
+        result = self.api.send_request(CHARGE)
+        self.assertEqual(result['status_code'], '1')
+        self.assertEqual(len(self.server.requests), 1)